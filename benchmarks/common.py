@@ -0,0 +1,136 @@
+"""
+Helpers shared by the benchmark scripts: building an app against a chosen
+database, seeding it, counting queries and summarising latencies.
+"""
+
+import datetime
+import json
+import os
+import platform
+import statistics
+import threading
+import time
+
+from sqlalchemy import event
+
+from user_authenticator import create_app, db
+from user_authenticator.config import BenchmarkConfig
+from user_authenticator.hashing import hash_password
+from user_authenticator.models import BlacklistToken, User
+
+SEED_PASSWORD = "benchmark-password"
+
+def database_uri(target):
+    """Maps `sqlite` and `postgres` shortcuts to local databases, anything else is used as a URI."""
+    if target == "sqlite":
+        return "sqlite:////tmp/user_authenticator_benchmark.sqlite"
+    if target == "postgres":
+        return os.environ.get(
+            "BENCHMARK_POSTGRES_URI", "postgresql+psycopg2://localhost/user_authenticator_benchmark"
+        )
+    return target
+
+def build_app(target="sqlite", **overrides):
+    """Creates a fresh app and schema on the target database with the benchmark profile."""
+    config = type("Config", (BenchmarkConfig,), {
+        "SQLALCHEMY_DATABASE_URI": database_uri(target),
+        "SQLALCHEMY_ENGINE_OPTIONS": {},
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "benchmark-secret-key-of-decent-length"),
+        "MAIL_DEFAULT_SENDER": "benchmark@example.com",
+        **overrides,
+    })
+    app = create_app(config)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+def seed(app, users=1000, revoked=1000, batch_size=1000):
+    """
+    Inserts `users` accounts sharing one precomputed password hash and
+    `revoked` blacklisted token ids.
+
+    Returns:
+        emails (list): Emails of the seeded users, all with password SEED_PASSWORD.
+    """
+    rounds = app.config.get("BCRYPT_LOG_ROUNDS", 4)
+    password_hash = hash_password(SEED_PASSWORD, "bcrypt", rounds)
+    emails = [f"user{i}@example.com" for i in range(users)]
+    with app.app_context():
+        for start in range(0, users, batch_size):
+            User.insert_new([
+                User("Bench", "Mark", email, password_hash=password_hash)
+                for email in emails[start:start + batch_size]
+            ])
+            db.session.commit()
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(days=3)
+        for start in range(0, revoked, batch_size):
+            db.session.execute(BlacklistToken.__table__.insert(), [
+                {"jti": os.urandom(16), "expires_at": expires_at, "blacklisted_on": datetime.datetime.utcnow()}
+                for _ in range(min(batch_size, revoked - start))
+            ])
+            db.session.commit()
+        # Pick up the seeded revocations
+        from user_authenticator.models import revocation_cache
+        revocation_cache.warm()
+    return emails
+
+class QueryCounter:
+    """Counts SQL statements per thread via SQLAlchemy engine events."""
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, "count", 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, "count", 0)
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+def summarise(latencies, elapsed, queries=None, statuses=None):
+    """Returns p50/p95/p99 latency in milliseconds, throughput and optional query and status counts."""
+    values = sorted(latency * 1000 for latency in latencies)
+    summary = {
+        "requests": len(values),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "mean_ms": round(statistics.fmean(values), 3) if values else 0.0,
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+    }
+    if queries is not None:
+        summary["queries_per_request"] = round(sum(queries) / len(queries), 2) if queries else 0.0
+    if statuses is not None:
+        summary["statuses"] = statuses
+    return summary
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def save_results(path, suite, results, **meta):
+    """Writes results as JSON so runs can be compared with `benchmarks.compare`."""
+    document = {
+        "suite": suite,
+        "created": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "meta": meta,
+        "results": results,
+    }
+    output = json.dumps(document, indent=2, sort_keys=True)
+    if path:
+        with open(path, "w") as f:
+            f.write(output + "\n")
+    return output
@@ -0,0 +1,51 @@
+"""
+Compares two benchmark result files and reports regressions.
+
+Example:
+    python -m benchmarks.compare baseline.json candidate.json --threshold 10
+"""
+
+import argparse
+import json
+import sys
+
+# Metrics where a larger value is better; every other numeric metric is a cost
+HIGHER_IS_BETTER = {"throughput_rps"}
+IGNORED = {"requests"}
+
+def compare(baseline, candidate, threshold):
+    """Yields (benchmark, metric, old, new, change %, regressed) for every shared numeric metric."""
+    for name, old_metrics in baseline["results"].items():
+        new_metrics = candidate["results"].get(name)
+        if new_metrics is None:
+            continue
+        for metric, old in old_metrics.items():
+            new = new_metrics.get(metric)
+            if metric in IGNORED or not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or not old:
+                continue
+            change = (new - old) / old * 100
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            yield name, metric, old, new, change, worse > threshold
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change counted as a regression.")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    regressions = 0
+    for name, metric, old, new, change, regressed in compare(baseline, candidate, args.threshold):
+        regressions += regressed
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:>35} {metric:>22}: {old:>12} -> {new:>12} ({change:+7.1f}%) {flag}")
+    print(f"{regressions} regression(s) above {args.threshold}%")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
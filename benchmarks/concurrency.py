@@ -0,0 +1,190 @@
+"""
+Concurrency of gunicorn worker classes at a fixed number of workers.
+
+Starts `gunicorn -c gunicorn.conf.py wsgi:app` once per worker class with the
+same worker count (so the same memory budget), drives it over HTTP with
+increasing numbers of concurrent clients and reports latency, throughput,
+errors and the peak resident memory of the server processes.
+
+Example:
+    python -m benchmarks.concurrency --db postgres --worker-classes gthread,gevent --concurrency 10,50,200
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from user_authenticator import db
+from user_authenticator.models import RefreshToken, User
+
+from .common import SEED_PASSWORD, build_app, database_uri, save_results, seed, summarise
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _rss_kb(pid):
+    """Resident memory of a process and its children, in KB."""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, StopIteration):
+        return total
+    return total + sum(_rss_kb(child) for child in children)
+
+class Server:
+    """A gunicorn process serving the benchmark profile."""
+    def __init__(self, target, worker_class, workers, threads, hash_workers, hash_max_pending):
+        self.port = _free_port()
+        env = dict(
+            os.environ,
+            APP_CONFIG="benchmark",
+            SQLALCHEMY_DATABASE_URI=database_uri(target),
+            SECRET_KEY=os.environ.get("SECRET_KEY", "benchmark-secret-key-of-decent-length"),
+            GUNICORN_BIND=f"127.0.0.1:{self.port}",
+            GUNICORN_WORKER_CLASS=worker_class,
+            WEB_CONCURRENCY=str(workers),
+            GUNICORN_THREADS=str(threads),
+            HASH_POOL_WORKERS=str(hash_workers),
+            HASH_POOL_MAX_PENDING=str(hash_max_pending),
+        )
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self._wait_ready()
+
+    def _wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=1)
+                connection.request("GET", "/auth/.well-known/jwks.json")
+                connection.getresponse().read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError("gunicorn did not start, run it by hand to see why")
+
+    def rss_kb(self):
+        return _rss_kb(self.process.pid)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+def _bodies(app, endpoint, emails, count):
+    """Returns `count` (path, JSON body, headers) requests for an endpoint."""
+    if endpoint == "login":
+        return [("/auth/login", {"email": email, "password": SEED_PASSWORD}, {})
+                for email, _ in zip(itertools.cycle(emails), range(count))]
+    with app.app_context():
+        users = User.query.filter(User.email.in_(emails[:count])).all()
+        sessions = []
+        for user, _ in zip(itertools.cycle(users), range(count)):
+            refresh_token, row = RefreshToken.issue(user.id)
+            sessions.append((User.encode_access_token(user.id, row.family_id), refresh_token))
+        db.session.commit()
+    if endpoint == "refresh":
+        return [("/auth/refresh", {"refresh_token": refresh_token}, {}) for _, refresh_token in sessions]
+    return [("/auth/logout", None, {"Authorization": f"Bearer {access_token}"}) for access_token, _ in sessions]
+
+def drive(server, requests, concurrency):
+    """Sends `requests` with `concurrency` keep-alive clients while sampling server memory."""
+    local = threading.local()
+    latencies, statuses = [], Counter()
+    lock = threading.Lock()
+    peak_rss = [server.rss_kb()]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.1):
+            peak_rss[0] = max(peak_rss[0], server.rss_kb())
+
+    def call(item):
+        path, body, headers = item
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=60)
+        started = time.perf_counter()
+        try:
+            connection.request("POST", path, body=json.dumps(body) if body is not None else None,
+                               headers={"Content-Type": "application/json", **headers})
+            response = connection.getresponse()
+            response.read()
+            status = str(response.status)
+        except OSError as e:
+            local.connection = None
+            status = type(e).__name__
+        latency = time.perf_counter() - started
+        with lock:
+            latencies.append(latency)
+            statuses[status] += 1
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, requests))
+    elapsed = time.perf_counter() - started
+    done.set()
+    sampler.join()
+    summary = summarise(latencies, elapsed, statuses=dict(statuses))
+    summary["peak_rss_mb"] = round(peak_rss[0] / 1024, 1)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="sqlite", help="'sqlite', 'postgres' or a database URI.")
+    parser.add_argument("--users", type=int, default=1000, help="Users seeded before the run.")
+    parser.add_argument("--endpoint", choices=["login", "refresh", "logout"], default="login")
+    parser.add_argument("--worker-classes", default="gthread,gevent", help="Comma-separated gunicorn worker classes.")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes, the same for every class.")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per gthread worker.")
+    parser.add_argument("--hash-workers", type=int, default=2, help="HASH_POOL_WORKERS of each worker.")
+    parser.add_argument("--hash-max-pending", type=int, default=256,
+                        help="HASH_POOL_MAX_PENDING of each worker, 0 for the default of 4 per hash worker.")
+    parser.add_argument("--concurrency", default="10,50,200", help="Comma-separated concurrent client counts.")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per concurrency level.")
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    args = parser.parse_args(argv)
+
+    app = build_app(args.db)
+    emails = seed(app, users=args.users, revoked=0)
+
+    results = {}
+    for worker_class in args.worker_classes.split(","):
+        server = Server(
+            args.db, worker_class, args.workers, args.threads, args.hash_workers, args.hash_max_pending
+        )
+        try:
+            for concurrency in (int(level) for level in args.concurrency.split(",")):
+                requests = _bodies(app, args.endpoint, emails, args.requests)
+                name = f"{worker_class}_c{concurrency}"
+                results[name] = drive(server, requests, concurrency)
+                print(f"{name:>15}: {results[name]}")
+        finally:
+            server.stop()
+
+    save_results(args.output, "concurrency", results, db=args.db, endpoint=args.endpoint, workers=args.workers,
+                 threads=args.threads, hash_workers=args.hash_workers, hash_max_pending=args.hash_max_pending,
+                 requests=args.requests)
+
+if __name__ == "__main__":
+    main()
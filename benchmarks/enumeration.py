@@ -0,0 +1,81 @@
+"""
+Login timing of unknown emails against wrong passwords for registered ones.
+
+Sends both kinds of failed login to /auth/login in random order and compares
+their latency distributions with a two-sample Kolmogorov-Smirnov test. With
+the dummy hash the statistic stays below the critical value, so response
+times do not tell which emails have an account.
+
+Example:
+    python -m benchmarks.enumeration --rounds 10 --requests 400 --output enumeration.json
+"""
+
+import argparse
+import bisect
+import math
+import random
+import time
+import uuid
+
+from .common import build_app, save_results, seed, summarise
+
+def ks_statistic(a, b):
+    """Returns the largest distance between the empirical distribution functions of `a` and `b`."""
+    a, b = sorted(a), sorted(b)
+    return max(
+        abs(bisect.bisect_right(a, x) / len(a) - bisect.bisect_right(b, x) / len(b))
+        for x in a + b
+    )
+
+def ks_critical(n, m, alpha=0.05):
+    """Returns the asymptotic critical value of the two-sample statistic at significance `alpha`."""
+    return math.sqrt(-math.log(alpha / 2) / 2) * math.sqrt((n + m) / (n * m))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="sqlite", help="'sqlite', 'postgres' or a database URI.")
+    parser.add_argument("--users", type=int, default=200, help="Users seeded before the run.")
+    parser.add_argument("--rounds", type=int, default=10, help="BCRYPT_LOG_ROUNDS of the run, high enough for hashing to dominate.")
+    parser.add_argument("--requests", type=int, default=400, help="Failed logins per case.")
+    parser.add_argument("--hash-workers", type=int, default=0, help="HASH_POOL_WORKERS for the run.")
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    args = parser.parse_args(argv)
+
+    app = build_app(args.db, HASH_POOL_WORKERS=args.hash_workers, BCRYPT_LOG_ROUNDS=args.rounds)
+    emails = seed(app, users=args.users, revoked=0)
+    calls = [("registered", email) for email, _ in zip(emails * (args.requests // len(emails) + 1), range(args.requests))]
+    calls += [("unknown", f"{uuid.uuid4().hex}@example.com") for _ in range(args.requests)]
+    random.shuffle(calls)
+
+    client = app.test_client()
+    # Warm up connections and the pool so neither case pays for them
+    for email in emails[:5]:
+        client.post("/auth/login", json={"email": email, "password": "wrong-password"})
+
+    latencies = {"registered": [], "unknown": []}
+    statuses = {"registered": {}, "unknown": {}}
+    for case, email in calls:
+        started = time.perf_counter()
+        response = client.post("/auth/login", json={"email": email, "password": "wrong-password"})
+        latencies[case].append(time.perf_counter() - started)
+        statuses[case][str(response.status_code)] = statuses[case].get(str(response.status_code), 0) + 1
+
+    results = {
+        f"login_{case}_email": summarise(values, sum(values), statuses=statuses[case])
+        for case, values in latencies.items()
+    }
+    statistic = ks_statistic(latencies["registered"], latencies["unknown"])
+    critical = ks_critical(len(latencies["registered"]), len(latencies["unknown"]))
+    results["ks_test"] = {
+        "statistic": round(statistic, 4),
+        "critical_0_05": round(critical, 4),
+        "indistinguishable": statistic < critical,
+    }
+    for name, metrics in results.items():
+        print(f"{name:>22}: {metrics}")
+
+    save_results(args.output, "enumeration", results, db=args.db, users=args.users, rounds=args.rounds,
+                 requests=args.requests, hash_workers=args.hash_workers)
+
+if __name__ == "__main__":
+    main()
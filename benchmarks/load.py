@@ -0,0 +1,119 @@
+"""
+Load test of every /auth endpoint against an in-process app.
+
+Example:
+    python -m benchmarks.load --db sqlite --users 2000 --revoked 10000 --concurrency 8 --requests 500 --output load.json
+"""
+
+import argparse
+import itertools
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from user_authenticator import db
+from user_authenticator.models import RefreshToken, User
+
+from .common import SEED_PASSWORD, QueryCounter, build_app, save_results, seed, summarise
+
+ENDPOINTS = ("register", "login", "refresh", "logout", "forgotpassword", "resetpassword")
+
+def _tokens(app, emails, count):
+    """
+    Issues password reset tokens for up to `count` seeded users without going through /auth/forgotpassword.
+
+    A reset token only works until its user's password changes, so every token belongs to a different user.
+    """
+    with app.app_context():
+        users = User.query.filter(User.email.in_(emails[:count])).all()
+        return [user.encode_reset_token() for user in users]
+
+def _sessions(app, emails, count):
+    """Opens `count` sessions for seeded users without going through /auth/login. Returns (access, refresh) tokens."""
+    with app.app_context():
+        users = User.query.filter(User.email.in_(emails[:count])).all()
+        sessions = []
+        for user, _ in zip(itertools.cycle(users), range(count)):
+            refresh_token, row = RefreshToken.issue(user.id)
+            sessions.append((User.encode_access_token(user.id, row.family_id), refresh_token))
+        db.session.commit()
+        return sessions
+
+def _requests(app, endpoint, emails, count):
+    """Returns `count` (path, kwargs) test-client calls for an endpoint."""
+    if endpoint == "register":
+        return [("/auth/register", {"json": {
+            "firstname": "Load", "lastname": "Test", "email": f"{uuid.uuid4().hex}@example.com", "password": SEED_PASSWORD,
+        }}) for _ in range(count)]
+    if endpoint == "login":
+        return [("/auth/login", {"json": {"email": email, "password": SEED_PASSWORD}})
+                for email, _ in zip(itertools.cycle(emails), range(count))]
+    if endpoint == "forgotpassword":
+        return [("/auth/forgotpassword", {"json": {"email": email}})
+                for email, _ in zip(itertools.cycle(emails), range(count))]
+    if endpoint == "refresh":
+        return [("/auth/refresh", {"json": {"refresh_token": refresh_token}})
+                for _, refresh_token in _sessions(app, emails, count)]
+    if endpoint == "logout":
+        return [("/auth/logout", {"headers": {"Authorization": f"Bearer {access_token}"}})
+                for access_token, _ in _sessions(app, emails, count)]
+    tokens = _tokens(app, emails, count)
+    return [("/auth/resetpassword", {
+        "headers": {"Authorization": f"Bearer {token}"}, "json": {"password": SEED_PASSWORD},
+    }) for token in tokens]
+
+def run_endpoint(app, counter, calls, concurrency):
+    """Drives `calls` with `concurrency` threads, each with its own test client."""
+    local = threading.local()
+    latencies, queries, statuses = [], [], Counter()
+    lock = threading.Lock()
+
+    def call(item):
+        path, kwargs = item
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        counter.reset()
+        started = time.perf_counter()
+        response = client.post(path, **kwargs)
+        latency = time.perf_counter() - started
+        with lock:
+            latencies.append(latency)
+            queries.append(counter.count)
+            statuses[str(response.status_code)] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, calls))
+    return summarise(latencies, time.perf_counter() - started, queries, dict(statuses))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="sqlite", help="'sqlite', 'postgres' or a database URI.")
+    parser.add_argument("--users", type=int, default=1000, help="Users seeded before the run.")
+    parser.add_argument("--revoked", type=int, default=1000, help="Revoked tokens seeded before the run.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent client threads.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint.")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma-separated endpoints to run.")
+    parser.add_argument("--hash-workers", type=int, default=0, help="HASH_POOL_WORKERS for the run.")
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    args = parser.parse_args(argv)
+
+    app = build_app(args.db, HASH_POOL_WORKERS=args.hash_workers)
+    emails = seed(app, users=args.users, revoked=args.revoked)
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+
+    results = {}
+    for endpoint in args.endpoints.split(","):
+        calls = _requests(app, endpoint, emails, args.requests)
+        results[endpoint] = run_endpoint(app, counter, calls, args.concurrency)
+        print(f"{endpoint:>15}: {results[endpoint]}")
+
+    save_results(args.output, "load", results, db=args.db, users=args.users, revoked=args.revoked,
+                 concurrency=args.concurrency, requests=args.requests, hash_workers=args.hash_workers)
+
+if __name__ == "__main__":
+    main()
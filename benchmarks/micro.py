@@ -0,0 +1,167 @@
+"""
+Micro-benchmarks of the hot paths behind the /auth endpoints.
+
+Example:
+    python -m benchmarks.micro --output micro.json
+"""
+
+import argparse
+import itertools
+import os
+import timeit
+
+from flask import jsonify
+from flask.json.provider import DefaultJSONProvider
+
+from user_authenticator.auth.validation import (
+    CreateForgotPasswordSchema, CreateLoginInputSchema, CreateResetPasswordSchema, CreateSignupInputSchema,
+    forgot_password_validator, login_validator, reset_password_validator, signup_validator,
+)
+from user_authenticator.auth.error_handling import Unauthorized
+from user_authenticator.models import BlacklistToken, User, claims_cache, revocation_cache, token_expiry, token_jti
+from user_authenticator.serialization import OrjsonProvider, error_bodies, json_response
+
+from .common import build_app, save_results, seed
+
+def measure(fn, number):
+    """Returns the best per-call time in microseconds over a few repeats."""
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return round(best / number * 1e6, 3)
+
+def bench_tokens(app, number):
+    with app.test_request_context():
+        user = User.query.first()
+        token = user.encode_auth_token(user.id)
+        payload = User.decode_auth_payload(token)
+        jti, expires_at = token_jti(payload, token), token_expiry(payload)
+        revoked = BlacklistToken.query.first()
+
+        def decode_uncached():
+            claims_cache.clear()
+            User.decode_auth_payload(token)
+
+        results = {
+            "encode_auth_token": measure(lambda: user.encode_auth_token(user.id), number),
+            "decode_auth_payload_uncached": measure(decode_uncached, number),
+            "decode_auth_payload_cached": measure(lambda: User.decode_auth_payload(token), number),
+            "decode_auth_token": measure(lambda: User.decode_auth_token(token), number),
+            "check_blacklist_not_revoked": measure(lambda: BlacklistToken.check_blacklist(jti, expires_at), number),
+            "check_blacklist_revoked": measure(
+                lambda: BlacklistToken.check_blacklist(revoked.jti, revoked.expires_at), number
+            ),
+        }
+        enabled = revocation_cache.enabled
+        revocation_cache.enabled = False
+        try:
+            results["check_blacklist_not_revoked_db"] = measure(lambda: BlacklistToken.check_blacklist(jti, expires_at), number)
+            results["check_blacklist_unknown_db"] = measure(
+                lambda: BlacklistToken.check_blacklist(os.urandom(16), expires_at), number
+            )
+        finally:
+            revocation_cache.enabled = enabled
+    return results
+
+def bench_introspection(app, number, batch):
+    """Compares `batch` single verifications with one batch verification, with and without the revocation cache."""
+    with app.test_request_context():
+        users = User.query.limit(batch).all()
+        tokens = [user.encode_auth_token(user.id) for user, _ in zip(itertools.cycle(users), range(batch))]
+        # Warm the claims cache so both variants measure the revocation lookups
+        User.verify_auth_tokens(tokens)
+
+        def single():
+            for token in tokens:
+                try:
+                    User.verify_auth_token(token)
+                except Unauthorized:
+                    pass
+
+        results = {}
+        enabled = revocation_cache.enabled
+        try:
+            for cache in (True, False):
+                revocation_cache.enabled = cache
+                suffix = "" if cache else "_db"
+                results[f"introspect_{batch}_single{suffix}"] = measure(single, number)
+                results[f"introspect_{batch}_batch{suffix}"] = measure(lambda: User.verify_auth_tokens(tokens), number)
+        finally:
+            revocation_cache.enabled = enabled
+    return results
+
+def bench_validation(number):
+    """Compares a schema built per request, a shared schema and the compiled validator."""
+    payloads = {
+        "signup": (CreateSignupInputSchema, signup_validator,
+                   {"firstname": "Bench", "lastname": "Mark", "email": "bench@example.com", "password": "password123"}),
+        "login": (CreateLoginInputSchema, login_validator, {"email": "bench@example.com", "password": "password123"}),
+        "forgot_password": (CreateForgotPasswordSchema, forgot_password_validator, {"email": "bench@example.com"}),
+        "reset_password": (CreateResetPasswordSchema, reset_password_validator, {"password": "password123"}),
+    }
+    results = {}
+    for name, (schema_class, validator, payload) in payloads.items():
+        results[f"{name}_schema_per_request"] = measure(lambda: schema_class().validate(payload), number)
+        results[f"{name}_schema_shared"] = measure(lambda: validator.schema.validate(payload), number)
+        results[f"{name}_validator"] = measure(lambda: validator.validate(payload), number)
+    return results
+
+def bench_responses(app, number):
+    """Compares `jsonify` with the response factory, with Flask's and the orjson JSON provider."""
+    with app.test_request_context():
+        user = User.query.first()
+        login = {
+            "auth_token": user.encode_auth_token(user.id), "refresh_token": os.urandom(32).hex(), "expires_in": 900,
+            "firstname": user.firstname, "lastname": user.lastname, "email": user.email,
+        }
+        sessions = {"sessions": [{
+            "id": os.urandom(16).hex(), "user_agent": "Mozilla/5.0 (X11; Linux x86_64)", "ip_address": "203.0.113.7",
+            "created_at": "2024-01-01T00:00:00Z", "last_used_at": "2024-01-01T00:00:00Z",
+            "expires_at": "2024-01-31T00:00:00Z", "current": False,
+        } for _ in range(10)]}
+        error = {"message": "Invalid email or password. Try again.", "status_code": 401}
+
+        def jsonify_response(payload, status_code):
+            response = jsonify(payload)
+            response.status_code = status_code
+            return response
+
+        results = {}
+        provider = app.json
+        try:
+            for name, app.json in (("default", DefaultJSONProvider(app)), ("orjson", OrjsonProvider(app))):
+                for kind, payload in (("login", login), ("sessions", sessions)):
+                    results[f"response_{kind}_jsonify_{name}"] = measure(lambda: jsonify_response(payload, 200), number)
+                    results[f"response_{kind}_factory_{name}"] = measure(lambda: json_response(payload, 200), number)
+                results[f"response_error_jsonify_{name}"] = measure(lambda: jsonify_response(error, 401), number)
+                results[f"response_error_cached_{name}"] = measure(lambda: app.response_class(
+                    error_bodies.get(401, error["message"]), status=401, mimetype=app.json.mimetype,
+                ), number)
+        finally:
+            app.json = provider
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="sqlite", help="'sqlite', 'postgres' or a database URI.")
+    parser.add_argument("--revoked", type=int, default=10000, help="Revoked tokens seeded before the run.")
+    parser.add_argument("--number", type=int, default=2000, help="Calls per measurement.")
+    parser.add_argument("--batch", type=int, default=50, help="Tokens per introspection batch.")
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    args = parser.parse_args(argv)
+
+    app = build_app(args.db)
+    seed(app, users=args.batch, revoked=args.revoked)
+
+    results = {}
+    results.update(bench_tokens(app, args.number))
+    results.update(bench_introspection(app, max(args.number // args.batch, 1), args.batch))
+    results.update(bench_validation(args.number))
+    results.update(bench_responses(app, args.number))
+    for name, value in results.items():
+        print(f"{name:>35}: {value:10.3f} us")
+
+    # Values are microseconds per call
+    save_results(args.output, "micro", {name: {"us_per_call": value} for name, value in results.items()},
+                 db=args.db, revoked=args.revoked, number=args.number)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Cold start time of the WSGI entry point.
+
+Runs `import wsgi` in fresh interpreters with `-X importtime` and reports the
+median process time, the time to import the package and build the app, and
+the cumulative import time of the slowest modules, so new import-time work
+shows up in `benchmarks.compare`.
+
+Example:
+    python -m benchmarks.startup --profile production --runs 10 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from .common import database_uri, save_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; the import builds the app (see wsgi.py)
+PROBE = """
+import json, time
+started = time.perf_counter()
+import user_authenticator
+imported = time.perf_counter()
+import wsgi
+print(json.dumps({"import_ms": (imported - started) * 1000, "create_app_ms": (time.perf_counter() - imported) * 1000}))
+"""
+
+def parse_importtime(stderr):
+    """Returns the cumulative import time in microseconds of every module in `-X importtime` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+def run_once(profile, target):
+    env = dict(
+        os.environ,
+        APP_CONFIG=profile,
+        SQLALCHEMY_DATABASE_URI=database_uri(target),
+        SECRET_KEY=os.environ.get("SECRET_KEY", "benchmark-secret-key-of-decent-length"),
+    )
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    process_ms = (time.perf_counter() - started) * 1000
+    timings = json.loads(process.stdout.strip().splitlines()[-1])
+    timings["process_ms"] = process_ms
+    return timings, parse_importtime(process.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", default="production", help="APP_CONFIG of the started app.")
+    parser.add_argument("--db", default="sqlite", help="'sqlite', 'postgres' or a database URI.")
+    parser.add_argument("--runs", type=int, default=10, help="Interpreters started.")
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules reported.")
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    args = parser.parse_args(argv)
+
+    timings, modules = defaultdict(list), defaultdict(list)
+    for _ in range(args.runs):
+        run_timings, run_modules = run_once(args.profile, args.db)
+        for name, value in run_timings.items():
+            timings[name].append(value)
+        for name, value in run_modules.items():
+            modules[name].append(value)
+
+    results = {"startup": {name: round(statistics.median(values), 2) for name, values in timings.items()}}
+    slowest = sorted(modules.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, values in slowest[:args.top]:
+        results[f"import:{name}"] = {"cumulative_ms": round(statistics.median(values) / 1000, 2)}
+    for name, metrics in results.items():
+        print(f"{name:>45}: {metrics}")
+
+    save_results(args.output, "startup", results, profile=args.profile, db=args.db, runs=args.runs)
+
+if __name__ == "__main__":
+    main()
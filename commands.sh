@@ -1,5 +1,7 @@
 #!/bin/bash
 
 flask db upgrade head
+# Alembic migrates the default database, this brings the users table of the other shards up to date
+flask init-user-shards
 
-flask run --host=0.0.0.0 --port=5001
\ No newline at end of file
+exec gunicorn -c gunicorn.conf.py wsgi:app
@@ -0,0 +1,34 @@
+import multiprocessing
+import os
+
+# Gunicorn settings for the production profile: `gunicorn -c gunicorn.conf.py wsgi:app`
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5001')
+
+# Worker processes serve requests in parallel; threads let each one overlap database and network waits
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# With GUNICORN_WORKER_CLASS=gevent each worker serves up to this many connections on greenlets instead
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# Restart workers periodically (with jitter so they do not restart together) to bound memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+def on_starting(server):
+    # Metric snapshots of a previous run would otherwise be added to this one's counters
+    from user_authenticator.metrics import clear_multiprocess_dir
+    clear_multiprocess_dir(os.environ.get('METRICS_MULTIPROCESS_DIR', '/dev/shm/user_authenticator_metrics'))
+
+def post_worker_init(worker):
+    # gevent workers are monkey-patched by now; make the PostgreSQL driver wait cooperatively too
+    if worker_class == 'gevent':
+        from user_authenticator.cooperative import make_psycopg_cooperative
+        make_psycopg_cooperative()
@@ -0,0 +1,106 @@
+"""Revoke by jti and expiry
+
+Revision ID: 4b8e2f6a9c31
+Revises: dc15126deb8c
+Create Date: 2026-10-18 09:12:04.118230
+
+"""
+import base64
+import datetime
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8e2f6a9c31'
+down_revision = 'dc15126deb8c'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+# Tokens were issued for 3 days; `blacklisted_on` was local time, so allow one more day of offset
+EXPIRED_AFTER = datetime.timedelta(days=4)
+
+
+def _legacy_claims(token):
+    """Returns the revocation key and expiry of a token stored by the previous schema."""
+    # Must match `models.token_jti`: tokens without a `jti` claim are keyed by a digest of the token
+    jti = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    try:
+        segment = token.split('.')[1]
+        payload = json.loads(base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4)))
+        expires_at = datetime.datetime.utcfromtimestamp(payload['exp'])
+    except (IndexError, KeyError, ValueError):
+        # Unreadable rows can never match a valid token; treat them as expired
+        expires_at = datetime.datetime(1970, 1, 1)
+    return jti, expires_at
+
+
+def upgrade():
+    with op.batch_alter_table('blacklist_tokens', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('jti', sa.LargeBinary(length=16), nullable=True))
+        batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=True))
+
+    conn = op.get_bind()
+    table = sa.table(
+        'blacklist_tokens',
+        sa.column('id', sa.String),
+        sa.column('token', sa.String),
+        sa.column('jti', sa.LargeBinary),
+        sa.column('expires_at', sa.DateTime),
+        sa.column('blacklisted_on', sa.DateTime),
+    )
+    now = datetime.datetime.utcnow()
+    # Tokens revoked longer ago than they could live have expired; drop them without decoding them
+    conn.execute(table.delete().where(table.c.blacklisted_on < now - EXPIRED_AFTER))
+
+    # Backfill the rest in bounded batches, one UPDATE executed for the whole batch
+    update = (
+        table.update()
+        .where(table.c.id == sa.bindparam('row_id'))
+        .values(jti=sa.bindparam('new_jti'), expires_at=sa.bindparam('new_expires_at'))
+    )
+    while True:
+        rows = conn.execute(
+            sa.select(table.c.id, table.c.token).where(table.c.jti.is_(None)).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        expired, params = [], []
+        for row_id, token in rows:
+            jti, expires_at = _legacy_claims(token)
+            if expires_at <= now:
+                expired.append(row_id)
+            else:
+                params.append({'row_id': row_id, 'new_jti': jti, 'new_expires_at': expires_at})
+        if expired:
+            conn.execute(table.delete().where(table.c.id.in_(expired)))
+        if params:
+            conn.execute(update, params)
+
+    with op.batch_alter_table('blacklist_tokens', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_blacklist_tokens_token', type_='unique')
+        batch_op.drop_constraint('uq_blacklist_tokens_id', type_='unique')
+        batch_op.drop_constraint('pk_blacklist_tokens', type_='primary')
+        batch_op.drop_column('token')
+        batch_op.drop_column('id')
+        batch_op.alter_column('jti', existing_type=sa.LargeBinary(length=16), nullable=False)
+        batch_op.alter_column('expires_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_primary_key('pk_blacklist_tokens', ['jti'])
+
+
+def downgrade():
+    # Revoked tokens cannot be reconstructed from their ids, so the revocation list is emptied
+    op.execute('DELETE FROM blacklist_tokens')
+    with op.batch_alter_table('blacklist_tokens', schema=None) as batch_op:
+        batch_op.drop_constraint('pk_blacklist_tokens', type_='primary')
+        batch_op.drop_column('expires_at')
+        batch_op.drop_column('jti')
+        batch_op.add_column(sa.Column('id', sa.String(length=32), nullable=False))
+        batch_op.add_column(sa.Column('token', sa.String(length=500), nullable=False))
+        batch_op.create_primary_key('pk_blacklist_tokens', ['id'])
+        batch_op.create_unique_constraint('uq_blacklist_tokens_id', ['id'])
+        batch_op.create_unique_constraint('uq_blacklist_tokens_token', ['token'])
@@ -0,0 +1,84 @@
+"""Index and partition blacklist_tokens by expiry
+
+Revision ID: 7d1c5a0e3f82
+Revises: 4b8e2f6a9c31
+Create Date: 2026-10-18 10:41:37.502114
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d1c5a0e3f82'
+down_revision = '4b8e2f6a9c31'
+branch_labels = None
+depends_on = None
+
+# Tokens live for 3 days, keep one spare day of partitions ahead
+DAYS_AHEAD = 4
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        # Same primary key as the partitioned table, so the model matches every database
+        with op.batch_alter_table('blacklist_tokens', schema=None) as batch_op:
+            batch_op.drop_constraint('pk_blacklist_tokens', type_='primary')
+            batch_op.create_primary_key('pk_blacklist_tokens', ['jti', 'expires_at'])
+            batch_op.create_index('ix_blacklist_tokens_expires_at', ['expires_at'], unique=False)
+        return
+
+    # On PostgreSQL rebuild the table as daily range partitions on `expires_at` so the
+    # purge job can drop whole days; the partition key has to be part of the primary key,
+    # so a jti is only unique per expiry and lookups pass both to hit a single partition.
+    op.rename_table('blacklist_tokens', 'blacklist_tokens_unpartitioned')
+    op.execute('ALTER TABLE blacklist_tokens_unpartitioned RENAME CONSTRAINT pk_blacklist_tokens TO pk_blacklist_tokens_unpartitioned')
+    op.execute(
+        'CREATE TABLE blacklist_tokens ('
+        'jti BYTEA NOT NULL, '
+        'expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, '
+        'blacklisted_on TIMESTAMP WITHOUT TIME ZONE NOT NULL, '
+        'CONSTRAINT pk_blacklist_tokens PRIMARY KEY (jti, expires_at)'
+        ') PARTITION BY RANGE (expires_at)'
+    )
+    op.execute('CREATE TABLE blacklist_tokens_default PARTITION OF blacklist_tokens DEFAULT')
+    today = datetime.datetime.utcnow().date()
+    for offset in range(DAYS_AHEAD + 1):
+        day = today + datetime.timedelta(days=offset)
+        op.execute(
+            f"CREATE TABLE blacklist_tokens_p{day:%Y%m%d} PARTITION OF blacklist_tokens "
+            f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + datetime.timedelta(days=1)).isoformat()}')"
+        )
+    op.create_index('ix_blacklist_tokens_expires_at', 'blacklist_tokens', ['expires_at'], unique=False)
+    # Expired rows are not worth carrying over
+    op.execute(
+        'INSERT INTO blacklist_tokens (jti, expires_at, blacklisted_on) '
+        "SELECT jti, expires_at, blacklisted_on FROM blacklist_tokens_unpartitioned WHERE expires_at > (now() AT TIME ZONE 'utc')"
+    )
+    op.drop_table('blacklist_tokens_unpartitioned')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('blacklist_tokens', schema=None) as batch_op:
+            batch_op.drop_index('ix_blacklist_tokens_expires_at')
+            batch_op.drop_constraint('pk_blacklist_tokens', type_='primary')
+            batch_op.create_primary_key('pk_blacklist_tokens', ['jti'])
+        return
+
+    op.rename_table('blacklist_tokens', 'blacklist_tokens_partitioned')
+    op.execute('ALTER TABLE blacklist_tokens_partitioned RENAME CONSTRAINT pk_blacklist_tokens TO pk_blacklist_tokens_partitioned')
+    op.create_table('blacklist_tokens',
+    sa.Column('jti', sa.LargeBinary(length=16), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('blacklisted_on', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('jti', name='pk_blacklist_tokens')
+    )
+    op.execute(
+        'INSERT INTO blacklist_tokens (jti, expires_at, blacklisted_on) '
+        'SELECT jti, expires_at, blacklisted_on FROM blacklist_tokens_partitioned'
+    )
+    # Dropping the parent drops every partition and the partitioned index with it
+    op.drop_table('blacklist_tokens_partitioned')
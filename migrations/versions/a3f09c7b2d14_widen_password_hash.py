@@ -0,0 +1,33 @@
+"""Widen users.password for scrypt and argon2 hashes
+
+Revision ID: a3f09c7b2d14
+Revises: 7d1c5a0e3f82
+Create Date: 2026-10-18 12:03:55.730941
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f09c7b2d14'
+down_revision = '7d1c5a0e3f82'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=72),
+               type_=sa.String(length=255),
+               existing_nullable=False)
+
+
+def downgrade():
+    # Hashes longer than 72 characters (scrypt, argon2) must be reset before downgrading
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=72),
+               existing_nullable=False)
@@ -0,0 +1,29 @@
+"""Case-insensitive unique index on users.email
+
+Revision ID: e2b7c40d9f18
+Revises: c5e81d4f6a27
+Create Date: 2026-10-18 14:47:21.903652
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7c40d9f18'
+down_revision = 'c5e81d4f6a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Fails if two accounts differ only by the case of their email; merge those first
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_users_email', type_='unique')
+    op.create_index('uq_users_email_lower', 'users', [sa.text('lower(email)')], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_users_email_lower', table_name='users')
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_users_email', ['email'])
@@ -1,14 +1,16 @@
 from user_authenticator import create_app, db
+from user_authenticator.sharding import user_shards
 
 # The entry point of the Flask application
 if __name__ == "__main__":
     # Create an instance of the Flask application using the factory function
     app = create_app()
     
-    # Ensure the application context is active for database operations
-    with app.app_context():
-        # Create all database tables defined in the models
-        db.create_all()
+    # Create all database tables defined in the models, in development only (see CREATE_SCHEMA_ON_START)
+    if app.config.get('CREATE_SCHEMA_ON_START'):
+        with app.app_context():
+            db.create_all()
+            user_shards.create_tables()
     
     # Run the Flask application in debug mode
     app.run(debug=True)
@@ -0,0 +1,58 @@
+import pytest
+
+from user_authenticator import create_app, db
+from user_authenticator.config import ApplicationConfig
+
+class TestingConfig(ApplicationConfig):
+    TESTING = True
+    DEBUG = False
+    SECRET_KEY = 'testing-secret-key-that-is-long-enough'
+    SQLALCHEMY_ECHO = False
+    SQLALCHEMY_BINDS = {}
+    USER_SHARDS = ['default']
+    USER_SHARDS_PREVIOUS = []
+    READ_REPLICAS = {}
+    BCRYPT_LOG_ROUNDS = 4  # Cheapest cost bcrypt accepts
+    PASSWORD_HASH_TARGET_MS = None
+    HASH_POOL_WORKERS = 0  # Hash on the request thread
+    RATELIMIT_ENABLED = False
+    METRICS_MULTIPROCESS_DIR = None
+    MAIL_SUPPRESS_SEND = True
+    JWT_SIGNING_KEYS = []
+    JWT_VERIFICATION_KEYS = []
+    INTROSPECTION_CLIENTS = {'gateway': 'gateway-secret'}
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Returns a factory of apps on a fresh SQLite database, with config overrides as keyword arguments."""
+    def make(**overrides):
+        config = type('Config', (TestingConfig,), {
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.sqlite'}", **overrides,
+        })
+        app = create_app(config)
+        with app.app_context():
+            db.create_all()
+        return app
+    return make
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def register(client, email='ann@example.com', password='secret1'):
+    response = client.post('/auth/register', json={
+        'firstname': 'Ann', 'lastname': 'Bee', 'email': email, 'password': password,
+    })
+    assert response.status_code == 201, response.get_json()
+
+def login(client, email='ann@example.com', password='secret1'):
+    response = client.post('/auth/login', json={'email': email, 'password': password})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def bearer(token):
+    return {'Authorization': f"Bearer {token}"}
@@ -0,0 +1,15 @@
+from conftest import register
+from user_authenticator.models import OutboundEmail
+
+def forgot(client, email):
+    return client.post('/auth/forgotpassword', json={'email': email})
+
+def test_unknown_emails_get_the_same_response(app, client):
+    register(client)
+    known = forgot(client, 'ann@example.com')
+    unknown = forgot(client, 'nobody@example.com')
+    assert known.status_code == unknown.status_code == 200
+    assert known.get_data() == unknown.get_data()
+    # Only the registered address gets an email
+    with app.app_context():
+        assert [message.recipients for message in OutboundEmail.query.all()] == ['ann@example.com']
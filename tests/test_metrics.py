@@ -0,0 +1,20 @@
+from user_authenticator.config import ProductionConfig
+
+def test_metrics_are_open_without_clients(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert b'# TYPE' in response.get_data()
+
+def test_metrics_clients_authenticate(make_app):
+    client = make_app(METRICS_CLIENTS={'prometheus': 'scrape-secret'}).test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', auth=('prometheus', 'wrong')).status_code == 401
+    # Introspection clients are not scrapers
+    assert client.get('/metrics', auth=('gateway', 'gateway-secret')).status_code == 401
+    assert client.get('/metrics', auth=('prometheus', 'scrape-secret')).status_code == 200
+
+def test_metrics_can_be_disabled(make_app):
+    assert make_app(METRICS_ENABLED=False).test_client().get('/metrics').status_code == 404
+
+def test_production_disables_metrics_by_default():
+    assert ProductionConfig.METRICS_ENABLED is False
@@ -0,0 +1,122 @@
+import pytest
+
+from user_authenticator.ratelimit import MemoryStore, RateLimiter, RedisStore, SharedMemoryStore, rate_limiter
+
+class FakePipeline:
+    """The part of a redis-py pipeline `RedisStore` uses, executed against a dict."""
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def get(self, key):
+        self.commands.append(('get', key))
+
+    def incr(self, key):
+        self.commands.append(('incr', key))
+
+    def expire(self, key, seconds):
+        self.commands.append(('expire', key, seconds))
+
+    def execute(self):
+        results = [getattr(self.client, f"_{command}")(*args) for command, *args in self.commands]
+        self.commands = []
+        return results
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def _get(self, key):
+        value = self.values.get(key)
+        return None if value is None else str(value).encode()
+
+    def _incr(self, key):
+        self.values[key] = self.values.get(key, 0) + 1
+        return self.values[key]
+
+    def _expire(self, key, seconds):
+        self.ttls[key] = seconds
+        return True
+
+def limiter(store):
+    checker = RateLimiter()
+    checker.enabled = True
+    checker.store = store
+    return checker
+
+@pytest.fixture(params=['memory', 'shared', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStore()
+    if request.param == 'shared':
+        return SharedMemoryStore(str(tmp_path / 'ratelimit.shm'), slots=1024)
+    return RedisStore(FakeRedis())
+
+def test_allows_up_to_the_limit(store):
+    checker = limiter(store)
+    limits = {'ip': (3, 60)}
+    start = 6000.0  # Start of a window
+    results = [checker.hit('login', limits, {'ip': '10.0.0.1'}, now=start + i) for i in range(4)]
+    assert results[:3] == [0, 0, 0]
+    assert results[3] == 60 - 3  # Until the window the attempts were counted in has passed
+
+def test_identities_are_counted_separately(store):
+    checker = limiter(store)
+    limits = {'ip': (1, 60), 'email': (1, 60)}
+    assert checker.hit('login', limits, {'ip': '10.0.0.1', 'email': 'a@example.com'}, now=6000.0) == 0
+    assert checker.hit('login', limits, {'ip': '10.0.0.2', 'email': 'b@example.com'}, now=6001.0) == 0
+    assert checker.hit('login', limits, {'ip': '10.0.0.1', 'email': 'c@example.com'}, now=6002.0) > 0
+    # Missing identities, e.g. no email in the body, are not limited
+    assert checker.hit('login', limits, {'ip': '10.0.0.3', 'email': None}, now=6003.0) == 0
+
+def test_sliding_window_weighs_the_previous_window(store):
+    checker = limiter(store)
+    limits = {'ip': (4, 60)}
+    identities = {'ip': '10.0.0.1'}
+    for i in range(4):
+        assert checker.hit('login', limits, identities, now=6000.0 + i) == 0
+    # A quarter into the next window, 3/4 of the previous 4 attempts still count: 3 + 1 and 3 + 2
+    assert checker.hit('login', limits, identities, now=6075.0) == 0
+    assert checker.hit('login', limits, identities, now=6075.0) == 45
+    # Once a whole window has passed without attempts the previous one no longer counts
+    assert checker.hit('login', limits, identities, now=6180.0) == 0
+
+def test_redis_store_pipeline():
+    client = FakeRedis()
+    store = RedisStore(client)
+    assert store.hit('rl:current', 'rl:previous', 120) == (0, 1)
+    assert store.hit('rl:current', 'rl:previous', 120) == (0, 2)
+    client.values['rl:previous'] = 7
+    assert store.hit('rl:current', 'rl:previous', 120) == (7, 3)
+    assert client.ttls['rl:current'] == 120
+
+def test_keys_do_not_contain_identities():
+    client = FakeRedis()
+    limiter(RedisStore(client)).hit('login', {'email': (5, 60)}, {'email': 'ann@example.com'}, now=6000.0)
+    assert client.values
+    assert not any('ann@example.com' in key for key in client.values)
+
+def test_login_is_throttled_with_retry_after(make_app):
+    app = make_app(RATELIMIT_ENABLED=True, RATELIMIT_LOGIN={'ip': (2, 60)})
+    client = app.test_client()
+    body = {'email': 'nobody@example.com', 'password': 'wrong-password'}
+    assert [client.post('/auth/login', json=body).status_code for _ in range(2)] == [401, 401]
+    response = client.post('/auth/login', json=body)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+def test_store_failures_let_requests_through(make_app):
+    app = make_app(RATELIMIT_ENABLED=True, RATELIMIT_LOGIN={'ip': (1, 60)})
+
+    class BrokenStore:
+        def hit(self, current_key, previous_key, ttl):
+            raise ConnectionError("store down")
+
+    rate_limiter.store = BrokenStore()
+    client = app.test_client()
+    body = {'email': 'nobody@example.com', 'password': 'wrong-password'}
+    assert [client.post('/auth/login', json=body).status_code for _ in range(3)] == [401, 401, 401]
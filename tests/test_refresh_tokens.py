@@ -0,0 +1,39 @@
+from conftest import bearer, login, register
+
+def refresh(client, refresh_token):
+    return client.post('/auth/refresh', json={'refresh_token': refresh_token})
+
+def test_refresh_rotates_both_tokens(client):
+    register(client)
+    tokens = login(client)
+    response = refresh(client, tokens['refresh_token'])
+    assert response.status_code == 200
+    rotated = response.get_json()
+    assert rotated['refresh_token'] != tokens['refresh_token']
+    assert rotated['auth_token'] != tokens['auth_token']
+    assert client.get('/auth/sessions', headers=bearer(rotated['auth_token'])).status_code == 200
+    # The successor can be used in turn
+    assert refresh(client, rotated['refresh_token']).status_code == 200
+
+def test_reuse_revokes_the_whole_family(client):
+    register(client)
+    tokens = login(client)
+    rotated = refresh(client, tokens['refresh_token']).get_json()
+
+    response = refresh(client, tokens['refresh_token'])
+    assert response.status_code == 401
+    assert response.get_json()['message'] == "Refresh token reuse detected. Please log in again."
+    # The legitimate successor dies with its family, whoever holds it
+    assert refresh(client, rotated['refresh_token']).status_code == 401
+
+def test_reuse_leaves_other_sessions_alone(client):
+    register(client)
+    first = login(client)
+    second = login(client)
+    refresh(client, first['refresh_token'])
+    assert refresh(client, first['refresh_token']).status_code == 401
+    assert refresh(client, second['refresh_token']).status_code == 200
+
+def test_unknown_refresh_token(client):
+    assert refresh(client, 'not-a-refresh-token').status_code == 401
+    assert refresh(client, '').status_code == 400
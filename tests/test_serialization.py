@@ -0,0 +1,95 @@
+import datetime
+import decimal
+import enum
+import uuid
+
+import pytest
+from flask import jsonify
+from flask.json.provider import DefaultJSONProvider
+
+from user_authenticator.auth.error_handling import BadRequest
+from user_authenticator.serialization import OrjsonProvider, error_bodies, json_response
+
+pytest.importorskip('orjson')
+
+class Colour(str, enum.Enum):
+    RED = 'red'
+
+class Plain(enum.Enum):
+    ONE = 1
+
+DOCUMENTS = [
+    {'message': 'ok', 'status_code': 200},
+    {'b': 1, 'a': [1, 2, {'d': None, 'c': True}], 'e': (3, 'x')},
+    {'floats': [0.1, 1.5, 1e16, 1e-7, 123456789.123, -0.0, 1.0]},
+    {'nan': float('nan'), 'inf': float('inf')},
+    {'name': 'Zoë', 'city': '東京', 'emoji': '🙂', 'escaped': 'line\nbreak "quoted" \\ </script>'},
+    {'big': 2 ** 70, 'negative': -(2 ** 63) - 1},
+    {2: 'integer keys', 1: True},
+    {'colour': Colour.RED},
+    {'when': datetime.datetime(2024, 6, 1, 12, 30, tzinfo=datetime.timezone.utc), 'day': datetime.date(2024, 6, 1)},
+    {'id': uuid.UUID('12345678123456781234567812345678'), 'amount': decimal.Decimal('1.10')},
+    {'tokens': [{'active': True, 'status': 'active', 'sub': 'abc', 'exp': 1717243200}] * 3},
+    [],
+    {},
+]
+
+def reference_body(app, obj):
+    """The body `jsonify` sends with Flask's own provider."""
+    return DefaultJSONProvider(app).response(obj).get_data()
+
+@pytest.mark.parametrize('debug', [False, True])
+@pytest.mark.parametrize('obj', DOCUMENTS, ids=range(len(DOCUMENTS)))
+def test_responses_match_default_provider(app, obj, debug):
+    app.debug = debug
+    assert isinstance(app.json, OrjsonProvider)
+    with app.test_request_context():
+        expected = reference_body(app, obj)
+        assert json_response(obj).get_data() == expected
+        assert jsonify(obj).get_data() == expected
+
+def test_unserialisable_values_fail_the_same_way(app):
+    with app.test_request_context():
+        with pytest.raises(TypeError):
+            reference_body(app, {'value': Plain.ONE})
+        with pytest.raises(TypeError):
+            json_response({'value': Plain.ONE})
+
+def test_ensure_ascii_disabled_matches(app):
+    app.json.ensure_ascii = False
+    obj = {'name': 'Zoë', 'city': '東京'}
+    reference = DefaultJSONProvider(app)
+    reference.ensure_ascii = False
+    with app.test_request_context():
+        assert json_response(obj).get_data() == reference.response(obj).get_data()
+
+def test_dumps_matches_for_other_arguments(app):
+    obj = {'b': 1.5, 'a': 'Zoë'}
+    assert app.json.dumps(obj) == DefaultJSONProvider(app).dumps(obj)
+    assert app.json.dumps(obj, separators=(',', ':')) == DefaultJSONProvider(app).dumps(obj, separators=(',', ':'))
+
+@pytest.mark.parametrize('debug', [False, True])
+def test_error_bodies_match_jsonify(app, debug):
+    app.debug = debug
+    with app.test_request_context():
+        for _ in range(2):  # Encoded once, then served from the cache
+            body = error_bodies.get(400, 'User already exists. Please log in.')
+            assert body == reference_body(app, {'message': 'User already exists. Please log in.', 'status_code': 400})
+        errors = {'email': ['Not a valid email address.']}
+        assert error_bodies.get(400, errors) == reference_body(app, {'message': errors, 'status_code': 400})
+
+def test_error_handler_body(app):
+    @app.route('/fail')
+    def fail():
+        raise BadRequest("Broken")
+
+    response = app.test_client().get('/fail')
+    assert response.status_code == 400
+    with app.test_request_context():
+        assert response.get_data() == reference_body(app, {'message': 'Broken', 'status_code': 400})
+
+def test_default_provider_can_be_selected(make_app):
+    app = make_app(JSON_PROVIDER='default')
+    assert not isinstance(app.json, OrjsonProvider)
+    with app.test_request_context():
+        assert json_response({'b': 1, 'a': 0.1}).get_data() == reference_body(app, {'b': 1, 'a': 0.1})
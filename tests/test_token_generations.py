@@ -0,0 +1,60 @@
+import jwt
+
+from conftest import bearer, login, register
+from user_authenticator.models import User
+
+REVOKED = {'message': 'Session revoked. Please log in again.', 'status_code': 401}
+
+def generation(token):
+    return jwt.decode(token, options={'verify_signature': False}).get('gen')
+
+def introspect(client, tokens):
+    response = client.post('/auth/introspect', json={'tokens': tokens}, auth=('gateway', 'gateway-secret'))
+    assert response.status_code == 200
+    return [entry['status'] for entry in response.get_json()['tokens']]
+
+def test_logout_all_revokes_every_token(client):
+    register(client)
+    sessions = [login(client) for _ in range(3)]
+    assert {generation(tokens['auth_token']) for tokens in sessions} == {0}
+
+    response = client.post('/auth/logout/all', headers=bearer(sessions[0]['auth_token']))
+    assert response.status_code == 200
+
+    for tokens in sessions:
+        response = client.get('/auth/sessions', headers=bearer(tokens['auth_token']))
+        assert response.get_json() == REVOKED
+        assert client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']}).status_code == 401
+    assert introspect(client, [tokens['auth_token'] for tokens in sessions]) == ['revoked'] * 3
+
+    # Tokens issued afterwards belong to the new generation
+    fresh = login(client)
+    assert generation(fresh['auth_token']) == 1
+    assert client.get('/auth/sessions', headers=bearer(fresh['auth_token'])).status_code == 200
+    refreshed = client.post('/auth/refresh', json={'refresh_token': fresh['refresh_token']}).get_json()
+    assert generation(refreshed['auth_token']) == 1
+    assert introspect(client, [fresh['auth_token'], refreshed['auth_token']]) == ['active', 'active']
+
+def test_password_reset_revokes_every_token(app, client):
+    register(client)
+    before = login(client)
+    with app.app_context():
+        reset_token = User.find_by_email('ann@example.com').encode_reset_token()
+
+    response = client.post('/auth/resetpassword', json={'password': 'new-secret'}, headers=bearer(reset_token))
+    assert response.status_code == 201
+
+    assert client.get('/auth/sessions', headers=bearer(before['auth_token'])).get_json() == REVOKED
+    assert client.post('/auth/refresh', json={'refresh_token': before['refresh_token']}).status_code == 401
+    assert client.post('/auth/login', json={'email': 'ann@example.com', 'password': 'secret1'}).status_code == 401
+    after = login(client, password='new-secret')
+    assert generation(after['auth_token']) == 1
+    assert client.get('/auth/sessions', headers=bearer(after['auth_token'])).status_code == 200
+
+def test_generations_are_per_user(client):
+    register(client, email='ann@example.com')
+    register(client, email='bob@example.com')
+    ann = login(client, email='ann@example.com')
+    bob = login(client, email='bob@example.com')
+    client.post('/auth/logout/all', headers=bearer(ann['auth_token']))
+    assert introspect(client, [ann['auth_token'], bob['auth_token']]) == ['revoked', 'active']
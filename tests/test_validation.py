@@ -0,0 +1,73 @@
+import pytest
+from marshmallow import Schema, ValidationError, fields, validate, validates
+
+from user_authenticator.auth.error_handling import BadRequest
+from user_authenticator.auth.validation import (
+    CompiledValidator, CreateForgotPasswordSchema, CreateIntrospectSchema, CreateLoginInputSchema,
+    CreateRefreshTokenSchema, CreateResetPasswordSchema, CreateSignupInputSchema, validate_input,
+)
+
+SIGNUP = {'firstname': 'Ann', 'lastname': 'Bee', 'email': 'ann@example.com', 'password': 'secret1'}
+
+PAYLOADS = [
+    SIGNUP,
+    {**SIGNUP, 'firstname': 'A'},
+    {**SIGNUP, 'email': 'not-an-email'},
+    {**SIGNUP, 'email': 'ann@localhost'},
+    {**SIGNUP, 'password': 'short'},
+    {**SIGNUP, 'password': None},
+    {**SIGNUP, 'password': 123456},
+    {**SIGNUP, 'password': b'secret1'},
+    {**SIGNUP, 'extra': 'field'},
+    {'email': 'ann@example.com', 'password': 'secret1'},
+    {'email': 'ann@example.com'},
+    {'password': 'secret1'},
+    {'refresh_token': ''},
+    {'refresh_token': 'abc'},
+    {'tokens': []},
+    {'tokens': ['a', 'b']},
+    {'tokens': 'a'},
+    {'tokens': ['a'] * 101},
+    {},
+]
+
+SCHEMAS = [
+    CreateSignupInputSchema, CreateLoginInputSchema, CreateForgotPasswordSchema, CreateResetPasswordSchema,
+    CreateRefreshTokenSchema, CreateIntrospectSchema,
+]
+
+@pytest.mark.parametrize('schema_class', SCHEMAS)
+@pytest.mark.parametrize('payload', PAYLOADS, ids=range(len(PAYLOADS)))
+def test_errors_match_marshmallow(schema_class, payload):
+    assert CompiledValidator(schema_class()).validate(payload) == schema_class().validate(payload)
+
+def test_string_schemas_take_the_fast_path():
+    validator = CompiledValidator(CreateSignupInputSchema())
+    assert validator.checks is not None
+    assert validator._passes(SIGNUP)
+
+def test_other_schemas_fall_back_to_marshmallow():
+    assert CompiledValidator(CreateIntrospectSchema()).checks is None
+
+    class WithHook(Schema):
+        name = fields.Str(required=True, validate=validate.Length(min=2))
+
+        @validates('name')
+        def no_admin(self, value, **kwargs):
+            if value == 'admin':
+                raise ValidationError("Reserved name.")
+
+    validator = CompiledValidator(WithHook())
+    assert validator.checks is None
+    assert validator.validate({'name': 'admin'}) == {'name': ['Reserved name.']}
+
+@pytest.mark.parametrize('data', [None, [], 'text', 1])
+def test_non_object_bodies_are_rejected(data):
+    with pytest.raises(BadRequest) as error:
+        validate_input(CompiledValidator(CreateLoginInputSchema()), data)
+    assert error.value.message == {'_schema': ['Invalid input type.']}
+
+def test_validate_input_reports_marshmallow_errors():
+    with pytest.raises(BadRequest) as error:
+        validate_input(CompiledValidator(CreateLoginInputSchema()), {'email': 'x'})
+    assert error.value.message == CreateLoginInputSchema().validate({'email': 'x'})
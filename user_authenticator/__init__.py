@@ -1,11 +1,10 @@
+import click
 from flask import Flask
-from flask_bcrypt import Bcrypt
-from flask_migrate import Migrate
-from flask_mail import Mail
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import MetaData
 
-from .config import ApplicationConfig
+from .config import get_config
+from .hashing import PasswordHasher
 
 # Define a naming convention for database constraints to maintain consistency and avoid naming conflicts
 convention = {
@@ -21,40 +20,84 @@ metadata = MetaData(naming_convention=convention)
 
 # Initialize SQLAlchemy with custom metadata
 db = SQLAlchemy(metadata=metadata)
-# Initialize Bcrypt for hashing passwords
-bcrypt = Bcrypt()
-# Initialize Flask-Migrate for handling database migrations
-migrate = Migrate(db, render_as_batch=True)
-# Initialize Flask-Mail for sending emails
-mail = Mail()
-
-def create_app(config=ApplicationConfig):
+# Flask-Migrate is set up by `create_app` for CLI commands only and Flask-Mail by the mail worker,
+# so a web worker never imports Alembic or opens an SMTP connection it does not need
+# Initialize the worker pool that hashes and verifies passwords off the request thread
+hasher = PasswordHasher()
+
+def create_app(config=None):
     """
     Factory function to create and configure the Flask application.
 
     Args:
-        config (obj): Configuration object for the Flask app.
+        config (obj): Configuration object for the Flask app. Defaults to the
+            profile named by the APP_CONFIG environment variable (development).
 
     Returns:
         app (Flask): Configured Flask application instance.
     """
     app = Flask(__name__)
     # Load configuration from the specified config object
-    app.config.from_object(config)
+    app.config.from_object(config or get_config())
     
     # Initialize extensions with the Flask app instance
     db.init_app(app)
-    bcrypt.init_app(app)
-    migrate.init_app(app, db)
-    mail.init_app(app)
+    hasher.init_app(app)
+    # Initialize Flask-Migrate for the `flask db` commands, the only place migrations run
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db, render_as_batch=True)
+    # Route user queries to the shard of an email or user id
+    from user_authenticator.sharding import user_shards
+    user_shards.init_app(app)
+    # Send lookup-only queries to read replicas
+    from user_authenticator.replicas import read_replicas
+    read_replicas.init_app(app)
+    # Parse the token signing keys once
+    from user_authenticator.keys import keyring
+    keyring.init_app(app)
 
     # Import and register the authentication blueprint and error handlers
     from user_authenticator.auth.views import auth_blueprint
     from user_authenticator.auth.error_handling import register_error_handlers
+    from user_authenticator.metrics import register_metrics_endpoint
+    from user_authenticator.instrumentation import register_instrumentation
+    from user_authenticator.serialization import register_json_provider
 
     # Register the authentication blueprint with a URL prefix
     app.register_blueprint(auth_blueprint, url_prefix='/auth')
     # Register custom error handlers
     register_error_handlers(app)
+    # Encode JSON responses with orjson when it is installed
+    register_json_provider(app)
+    # Expose Prometheus-format metrics
+    register_metrics_endpoint(app)
+    # Break request time down into SQL, hashing, JWT and mail phases
+    register_instrumentation(app)
+
+    # Warm the in-process revocation cache from the blacklist table
+    from user_authenticator.models import claims_cache, revocation_cache
+    revocation_cache.init_app(app)
+    # Size the cache of verified token claims
+    claims_cache.init_app(app)
+    # Size the cache of authenticated users
+    from user_authenticator.auth.principal import principal_loader
+    principal_loader.init_app(app)
+    # Select the store of the login and password reset rate limits
+    from user_authenticator.ratelimit import rate_limiter
+    rate_limiter.init_app(app)
+
+    # Register the CLI commands and the optional background purge of expired revocations
+    from user_authenticator.cli import register_commands
+    from user_authenticator.maintenance import PurgeScheduler
+    register_commands(app)
+    app.extensions['revocation_purge'] = PurgeScheduler(app)
+    app.extensions['revocation_purge'].start()
+
+    # Optionally deliver queued emails from a background thread of this process
+    if app.config.get('MAIL_OUTBOX_WORKER'):
+        from user_authenticator.mailer import MailWorker
+        app.extensions['mail_worker'] = MailWorker(app)
+        app.extensions['mail_worker'].start()
 
     return app
@@ -4,7 +4,9 @@ for them that produce the errors in the format the user is expecting.
 For more information, visit: https://flask.palletsprojects.com/en/1.1.x/patterns/apierrors/
 """
 
-from flask import jsonify
+from flask import current_app
+
+from ..serialization import error_bodies, json_response
 
 class BadRequest(Exception):
     """Custom Exception to be thrown when a local error occurs."""
@@ -38,6 +40,15 @@ class ResourceNotFound(Exception):
         self.status_code = status_code
         self.payload = payload
 
+class TooManyRequests(Exception):
+    """Custom Exception to be thrown when a client exceeds a rate limit."""
+    def __init__(self, message, status_code=429, payload=None, retry_after=None):
+        Exception.__init__(self)
+        self.message = message
+        self.status_code = status_code
+        self.payload = payload
+        self.retry_after = retry_after
+
 class InternalServerError(Exception):
     """Custom Exception to be thrown for unexpected server-side errors."""
     def __init__(self, message, status_code=500, payload=None):
@@ -46,6 +57,14 @@ class InternalServerError(Exception):
         self.status_code = status_code
         self.payload = payload
 
+class ServiceUnavailable(Exception):
+    """Custom Exception to be thrown when the server is temporarily overloaded."""
+    def __init__(self, message, status_code=503, payload=None):
+        Exception.__init__(self)
+        self.message = message
+        self.status_code = status_code
+        self.payload = payload
+
 def register_error_handlers(app):
     """
     Registers error handlers for custom exceptions with the Flask application.
@@ -57,7 +76,9 @@ def register_error_handlers(app):
     @app.errorhandler(Unauthorized)
     @app.errorhandler(Forbidden)
     @app.errorhandler(ResourceNotFound)
+    @app.errorhandler(TooManyRequests)
     @app.errorhandler(InternalServerError)
+    @app.errorhandler(ServiceUnavailable)
     def handle_exception(error):
         """
         Handles the custom exceptions and returns a JSON response.
@@ -68,7 +89,16 @@ def register_error_handlers(app):
         Returns:
             response (Response): A JSON response with the error details and status code.
         """
-        payload = dict(error.payload or ())
+        headers = {}
+        if getattr(error, 'retry_after', None):
+            headers['Retry-After'] = str(error.retry_after)
+        if not error.payload:
+            # Messages are mostly constants, so their bodies are encoded once and reused
+            body = error_bodies.get(error.status_code, error.message)
+            return current_app.response_class(
+                body, status=error.status_code, headers=headers, mimetype=current_app.json.mimetype
+            )
+        payload = dict(error.payload)
         payload['status_code'] = error.status_code
         payload['message'] = error.message
-        return jsonify(payload), error.status_code
+        return json_response(payload, error.status_code, headers)
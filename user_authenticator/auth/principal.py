@@ -0,0 +1,160 @@
+"""
+This module resolves the authenticated user of a request.
+
+Protected endpoints call `authenticate` with the Authorization header; it
+verifies the bearer token and returns a lightweight, immutable `Principal`
+from a TTL cache keyed by user id, so the common case costs no queries.
+
+Principals are read from the primary of their shard, never from a read
+replica: they carry the token generation that revokes tokens, and a lagging
+replica would put a generation from before a "log out everywhere" in the cache
+for `PRINCIPAL_CACHE_TTL_SECONDS`.
+"""
+
+import hmac
+
+from flask import current_app
+from sqlalchemy import event, select
+from .error_handling import BadRequest, Unauthorized
+from ..cache import TTLCache
+from ..models import User
+from ..sharding import user_shards
+
+class Principal:
+    """Read-only snapshot of the user a token was issued to."""
+    __slots__ = ('id', 'firstname', 'lastname', 'email', 'generation')
+
+    def __init__(self, id, firstname, lastname, email, generation=0):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'firstname', firstname)
+        object.__setattr__(self, 'lastname', lastname)
+        object.__setattr__(self, 'email', email)
+        object.__setattr__(self, 'generation', generation)  # Token generation, see `User.bump_generation`
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Principal is immutable")
+
+    def __repr__(self):
+        return f"Principal('{self.id}', '{self.email}')"
+
+# Columns of `users` a principal is built from, in the order of `Principal`
+_COLUMNS = (User.id, User.firstname, User.lastname, User.email, User.token_generation)
+
+class PrincipalLoader:
+    """Loads `Principal` records by user id through a bounded TTL cache."""
+    def __init__(self):
+        self.cache = TTLCache(0, 0)
+
+    def init_app(self, app):
+        self.cache = TTLCache(
+            app.config.get('PRINCIPAL_CACHE_SIZE', 10000),
+            app.config.get('PRINCIPAL_CACHE_TTL_SECONDS', 60),
+        )
+
+    def load(self, user_id):
+        """Returns the principal for `user_id`, or None if the user does not exist."""
+        principal = self.cache.get(user_id)
+        if principal is not None:
+            return principal
+        shard = user_shards.shard_for_id(user_id)
+        if shard is None:
+            return None
+        row = user_shards.execute(shard, select(*_COLUMNS).where(User.id == user_id)).first()
+        if row is None:
+            return None
+        principal = Principal(*row)
+        self.cache.set(user_id, principal)
+        return principal
+
+    def load_many(self, user_ids):
+        """
+        Returns the principals of `user_ids`, with one query per shard for the users not in the cache.
+
+        Returns:
+            principals (dict): User id to principal, for the users that exist.
+        """
+        principals = {}
+        missing = []
+        for user_id in set(user_ids):
+            principal = self.cache.get(user_id)
+            if principal is not None:
+                principals[user_id] = principal
+            else:
+                missing.append(user_id)
+        if not missing:
+            return principals
+        for shard, ids in user_shards.shards_for_ids(missing).items():
+            for row in user_shards.execute(shard, select(*_COLUMNS).where(User.id.in_(ids))):
+                principal = Principal(*row)
+                self.cache.set(principal.id, principal)
+                principals[principal.id] = principal
+        return principals
+
+    def invalidate(self, user_id):
+        """Drops the cached principal after the user was written."""
+        self.cache.pop(user_id)
+
+# Shared principal loader, configured by `create_app`
+principal_loader = PrincipalLoader()
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_principal(mapper, connection, target):
+    principal_loader.invalidate(target.id)
+
+def get_bearer_token(auth_header):
+    """Extracts the token from an `Authorization: Bearer <token>` header."""
+    if not auth_header:
+        raise BadRequest("Token is required!")
+    try:
+        return auth_header.split(" ")[1]
+    except IndexError:
+        raise BadRequest("Bearer token malformed")
+
+def authenticate_client(authorization, clients=None):
+    """
+    Checks the HTTP Basic credentials of a client such as an API gateway against `INTROSPECTION_CLIENTS`.
+
+    Args:
+        authorization (Authorization): The parsed Authorization header of the request, or None.
+        clients (dict): Allowed 'client_id: secret' pairs, `INTROSPECTION_CLIENTS` by default.
+
+    Returns:
+        client_id (str): The authenticated client.
+    """
+    if authorization is None or authorization.type != 'basic' or not authorization.username:
+        raise Unauthorized("Client authentication is required.")
+    if clients is None:
+        clients = current_app.config.get('INTROSPECTION_CLIENTS') or {}
+    secret = clients.get(authorization.username)
+    # Compare against a placeholder for unknown clients so both take the same time
+    matches = hmac.compare_digest((secret or '').encode(), (authorization.password or '').encode())
+    if secret is None or not matches:
+        raise Unauthorized("Invalid client credentials.")
+    return authorization.username
+
+def is_current_generation(principal, payload):
+    """Returns True if the token `payload` was issued in the current token generation of its user."""
+    # Tokens from before the claim existed belong to generation 0
+    return payload.get('gen', 0) == principal.generation
+
+def authenticate(auth_header):
+    """
+    Verifies the bearer token of a request and returns its principal.
+
+    Invalid, expired and revoked tokens are rejected before any user lookup;
+    tokens of an older token generation are rejected against the cached
+    principal, so "log out everywhere" takes effect in other processes within
+    `PRINCIPAL_CACHE_TTL_SECONDS`.
+
+    Returns:
+        (principal, auth_token, payload): The user, the raw token and its claims.
+    """
+    auth_token = get_bearer_token(auth_header)
+    payload = User.verify_auth_token(auth_token)
+    principal = principal_loader.load(payload['sub'])
+    if principal is None:
+        raise Unauthorized("User no longer exists. Please log in again.")
+    if not is_current_generation(principal, payload):
+        raise Unauthorized("Session revoked. Please log in again.")
+    return principal, auth_token, payload
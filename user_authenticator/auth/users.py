@@ -1,11 +1,17 @@
 import os
-from flask import jsonify
-from flask_mail import Message
+from flask import current_app
 from sqlalchemy import exc
-from user_authenticator import db, bcrypt, mail
-from .error_handling import BadRequest, ResourceNotFound, Unauthorized, InternalServerError
-from .validation import CreateSignupInputSchema, CreateLoginInputSchema, CreateForgotPasswordSchema, CreateResetPasswordSchema
-from ..models import User, BlacklistToken
+from user_authenticator import db, hasher
+from .error_handling import BadRequest, ResourceNotFound, Unauthorized, InternalServerError, ServiceUnavailable
+from .principal import authenticate, authenticate_client, get_bearer_token, is_current_generation, principal_loader
+from .validation import (
+    forgot_password_validator, introspect_validator, login_validator, refresh_token_validator, reset_password_validator,
+    signup_validator, validate_input,
+)
+from ..mailer import enqueue_email
+from ..models import User, BlacklistToken, RefreshToken, UserSession, revocation_cache
+from ..replicas import read_replicas
+from ..serialization import json_response
 
 def create_user(request, post_data):
     """
@@ -18,27 +24,24 @@ def create_user(request, post_data):
     Returns:
         response (Response): JSON response with a success message and status code.
     """
-    signupschema = CreateSignupInputSchema()
-    errors = signupschema.validate(post_data)
-    if errors:
-        raise BadRequest(errors)
-    
-    user = User.query.filter_by(email=post_data.get("email")).first()
-    if user:
-        raise BadRequest("User already exists. Please log in.")
+    validate_input(signup_validator, post_data)
     
     try:
         user = User(**post_data)
-        db.session.add(user)
+        # A single INSERT ... ON CONFLICT DO NOTHING reports an existing email as no inserted row
+        inserted = User.insert_new([user])
         db.session.commit()
-        responseObject = {'message': 'User registered successfully.'}
-        response = jsonify(responseObject)
-        response.status_code = 201
-        return response
-    except exc.IntegrityError as uq:
-        raise BadRequest("User already exists. Please log in.")
+        read_replicas.mark_written()
+    except ServiceUnavailable:
+        raise
     except Exception as e:
+        db.session.rollback()
         raise InternalServerError("Something went wrong! Our bad :(")
+    if not inserted:
+        raise BadRequest("User already exists. Please log in.")
+
+    responseObject = {'message': 'User registered successfully.'}
+    return json_response(responseObject, 201)
 
 def login_user(request, post_data):
     """
@@ -51,31 +54,109 @@ def login_user(request, post_data):
     Returns:
         response (Response): JSON response with user details and auth token, or an error message.
     """
-    login_schema = CreateLoginInputSchema()
-    errors = login_schema.validate(post_data)
-    if errors:
-        raise BadRequest(errors)
+    validate_input(login_validator, post_data)
     
-    user = User.query.filter_by(email=post_data.get('email')).first()
-    if not user:
-        raise ResourceNotFound("User does not exist. Please create an account.")
-    if not bcrypt.check_password_hash(user.password, post_data.get('password')):
-        raise Unauthorized("Invalid password. Try again.")
+    user = User.find_by_email(post_data.get('email'))
+    # Unknown emails cost a verification too and get the same answer, so logins do not reveal who has an account
+    if user is None:
+        hasher.check_dummy_hash(post_data.get('password'))
+        raise Unauthorized("Invalid email or password. Try again.")
+    if not hasher.check_password_hash(user.password, post_data.get('password')):
+        raise Unauthorized("Invalid email or password. Try again.")
+
+    # Move the stored hash to the current scheme and cost while the plaintext is at hand
+    upgraded_hash = hasher.upgrade(user.password, post_data.get('password'))
+    if upgraded_hash:
+        try:
+            User.update_password(user.id, upgraded_hash, user.password)
+            db.session.commit()
+        except exc.SQLAlchemyError:
+            db.session.rollback()
     
     try:
-        auth_token = user.encode_auth_token(user.id)
+        # A short-lived access token plus a refresh token that starts a new family
+        refresh_token, row = RefreshToken.issue(
+            user.id, user_agent=request.user_agent.string, ip_address=request.remote_addr
+        )
+        db.session.commit()
+        # The user may come from a replica, take the generation from the primary like `authenticate` does
+        principal = principal_loader.load(user.id)
+        generation = principal.generation if principal is not None else user.token_generation
+        auth_token = user.encode_access_token(user.id, row.family_id, generation)
         responseObject = {
             'auth_token': str(auth_token),
+            'refresh_token': refresh_token,
+            'expires_in': current_app.config.get('ACCESS_TOKEN_TTL_SECONDS', 900),
             'firstname': user.firstname,
             'lastname': user.lastname,
             'email': user.email,
         }
-        response = jsonify(responseObject)
-        response.status_code = 200
-        return response               
+        return json_response(responseObject, 200)
     except Exception as e:
+        db.session.rollback()
         raise InternalServerError("Something went wrong! Our bad :(")
 
+def refresh_access_token(request, post_data):
+    """
+    Exchanges a refresh token for a new access token and refresh token.
+    
+    Args:
+        request (Request): The HTTP request object.
+        post_data (dict): The JSON data from the request containing the refresh token.
+        
+    Returns:
+        response (Response): JSON response with the new tokens.
+    """
+    validate_input(refresh_token_validator, post_data)
+
+    # Raises Unauthorized for unknown, expired, revoked or reused tokens
+    refresh_token, row = RefreshToken.rotate(post_data.get('refresh_token'))
+    principal = principal_loader.load(row.user_id)
+    if principal is None:
+        raise Unauthorized("User no longer exists. Please log in again.")
+    auth_token = User.encode_access_token(row.user_id, row.family_id, principal.generation)
+    responseObject = {
+        'auth_token': str(auth_token),
+        'refresh_token': refresh_token,
+        'expires_in': current_app.config.get('ACCESS_TOKEN_TTL_SECONDS', 900),
+    }
+    return json_response(responseObject, 200)
+
+def introspect_tokens(request, post_data):
+    """
+    Reports the status of a batch of tokens to an API gateway, authenticated
+    as one of `INTROSPECTION_CLIENTS` (RFC 7662 section 2.1).
+    
+    Signatures are verified one by one; revocation of the whole batch is
+    resolved with a single query, and the token generations of its users
+    with one query per shard for the users not cached.
+    
+    Args:
+        request (Request): The HTTP request object.
+        post_data (dict): The JSON data from the request containing the tokens.
+        
+    Returns:
+        response (Response): JSON response with the status, subject and expiry of every token, in order.
+    """
+    authenticate_client(request.authorization)
+    validate_input(introspect_validator, post_data)
+
+    verified = User.verify_auth_tokens(post_data.get('tokens'))
+    principals = principal_loader.load_many({payload['sub'] for status, payload in verified if status == 'active'})
+    results = []
+    for status, payload in verified:
+        if status == 'active':
+            principal = principals.get(payload['sub'])
+            if principal is None or not is_current_generation(principal, payload):
+                status = 'revoked'
+        result = {'active': status == 'active', 'status': status}
+        if payload is not None:
+            result['sub'] = payload['sub']
+            result['exp'] = payload['exp']
+        results.append(result)
+    responseObject = {'tokens': results}
+    return json_response(responseObject, 200)
+
 def logout_user(request, auth_header):
     """
     Logs out a user by blacklisting the JWT token.
@@ -87,54 +168,133 @@ def logout_user(request, auth_header):
     Returns:
         response (Response): JSON response with a success message.
     """
-    if auth_header:
-        try:
-            auth_token = auth_header.split(" ")[1]
-        except IndexError:
-            raise BadRequest("Bearer token malformed")
-    else:
-        auth_token = ''
-    
-    if auth_token:
-        response = User.decode_auth_token(auth_token)
-        user = User.query.filter_by(id=response).first()
-        if not user:
-            raise Unauthorized(response)
-        
-        blacklist_token = BlacklistToken(token=auth_token)
-        try:
+    principal, auth_token, payload = authenticate(auth_header)
+
+    try:
+        if payload.get('typ') == 'access':
+            # Revoke the login's refresh tokens; the access token lapses within minutes
+            RefreshToken.revoke_family(payload.get('fam'))
+            db.session.commit()
+            read_replicas.mark_written()
+        else:
+            blacklist_token = BlacklistToken(token=auth_token, payload=payload)
+            jti = blacklist_token.jti
             db.session.add(blacklist_token)
             db.session.commit()
-            responseObject = {'message': 'Successfully logged out'}
-            response = jsonify(responseObject)
-            response.status_code = 200
-            return response
-        except Exception as e:
-            raise InternalServerError("Something went wrong! Our bad :(")
+            read_replicas.mark_written()
+            revocation_cache.add(jti)
+        responseObject = {'message': 'Successfully logged out'}
+        return json_response(responseObject, 200)
+    except Exception as e:
+        raise InternalServerError("Something went wrong! Our bad :(")
 
-def send_reset_password_email(request, user):
+def logout_all(request, auth_header):
     """
-    Sends a password reset email to the user.
+    Logs a user out of every session.
+    
+    Bumps the token generation of the user, which rejects every token issued
+    so far without blacklisting any of them, and revokes all refresh tokens.
     
     Args:
         request (Request): The HTTP request object.
-        user (User): The user object.
+        auth_header (str): The authorization header containing the JWT token.
+        
+    Returns:
+        response (Response): JSON response with a success message.
+    """
+    principal, auth_token, payload = authenticate(auth_header)
+
+    try:
+        User.bump_generation(principal.id)
+        RefreshToken.revoke_user(principal.id)
+        db.session.commit()
+        read_replicas.mark_written()
+        principal_loader.invalidate(principal.id)
+        responseObject = {'message': 'Successfully logged out of all sessions'}
+        return json_response(responseObject, 200)
+    except ServiceUnavailable:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        raise InternalServerError("Something went wrong! Our bad :(")
+
+def list_sessions(request, auth_header):
+    """
+    Lists the active sessions (logins) of the authenticated user.
+    
+    Args:
+        request (Request): The HTTP request object.
+        auth_header (str): The authorization header containing the JWT token.
         
     Returns:
-        token (str): The JWT token generated for password reset.
+        response (Response): JSON response with the sessions, most recently used first.
+    """
+    principal, auth_token, payload = authenticate(auth_header)
+
+    sessions = []
+    for session in UserSession.active(principal.id):
+        sessions.append({
+            'id': session.id,
+            'user_agent': session.user_agent,
+            'ip_address': session.ip_address,
+            'created_at': session.created_at.isoformat() + 'Z',
+            'last_used_at': session.last_used_at.isoformat() + 'Z',
+            'expires_at': session.expires_at.isoformat() + 'Z',
+            'current': session.id == payload.get('fam'),
+        })
+    responseObject = {'sessions': sessions}
+    return json_response(responseObject, 200)
+
+def revoke_session(request, auth_header, session_id):
+    """
+    Ends one session of the authenticated user.
+    
+    Its refresh tokens are revoked; access tokens already issued to it remain
+    valid until they expire, as after a logout.
+    
+    Args:
+        request (Request): The HTTP request object.
+        auth_header (str): The authorization header containing the JWT token.
+        session_id (str): The id of the session to end.
+        
+    Returns:
+        response (Response): JSON response with a success message.
+    """
+    principal, auth_token, payload = authenticate(auth_header)
+
+    session = db.session.get(UserSession, session_id)
+    if session is None or session.user_id != principal.id:
+        raise ResourceNotFound("Session does not exist.")
+    try:
+        RefreshToken.revoke_family(session.id)
+        db.session.commit()
+        read_replicas.mark_written()
+        responseObject = {'message': 'Session revoked'}
+        return json_response(responseObject, 200)
+    except Exception as e:
+        db.session.rollback()
+        raise InternalServerError("Something went wrong! Our bad :(")
+
+def send_reset_password_email(request, user):
+    """
+    Queues a password reset email for the user.
+    
+    The email is delivered by the outbox worker, so the request does not wait
+    for the SMTP server. The link carries a short-lived reset token bound to
+    the current password, so it only works once.
+    
+    Args:
+        request (Request): The HTTP request object.
+        user (User): The user object.
     """
     mail_subject = "Reset Your Password"
     domain = request.base_url
     uid = user.id
-    token = user.encode_auth_token(uid)
-    message = Message(
-        mail_subject, sender=os.environ.get("EMAIL_HOST_USER"), recipients=[user.email]
-    )
-    message.html = f"Please click on the link to reset your password, {domain}/pages/auth/reset-password/{uid}/{token}"
+    token = user.encode_reset_token()
+    html = f"Please click on the link to reset your password, {domain}/pages/auth/reset-password/{uid}/{token}"
     
     try:
-        mail.send(message)
-        return token
+        enqueue_email(mail_subject, [user.email], sender=os.environ.get("EMAIL_HOST_USER"), html=html)
     except Exception as e:
         raise InternalServerError("Something went wrong!")
 
@@ -147,32 +307,32 @@ def forgot_password(request, post_data):
         post_data (dict): The JSON data from the request containing the user's email.
         
     Returns:
-        response (Response): JSON response with a success message and auth token.
+        response (Response): JSON response with a success message, whether or not the email is registered;
+            the reset token is only sent by email.
     """
-    forgot_password_schema = CreateForgotPasswordSchema()
-    errors = forgot_password_schema.validate(post_data)
-    if errors:
-        raise BadRequest(errors)
+    validate_input(forgot_password_validator, post_data)
     
-    user = User.query.filter_by(email=post_data.get("email")).first()
+    user = User.find_by_email(post_data.get("email"))
+    responseObject = {
+        'message': 'Link to reset password successfully sent'
+    }
     if not user:
-        raise BadRequest("User does not exist. Please create an account.")
+        # Same answer as for a registered email, so the endpoint does not reveal who has an account
+        return json_response(responseObject, 200)
     
     try:
-        auth_token = send_reset_password_email(request, user)
-        responseObject = {
-            'auth_token': str(auth_token),
-            'message': 'Link to reset password successfully sent'
-        }
-        response = jsonify(responseObject)
-        response.status_code = 200
-        return response
+        send_reset_password_email(request, user)
+        return json_response(responseObject, 200)
     except Exception as e:
         raise InternalServerError("Something went wrong! Check your network connection then try again.")
 
 def reset_password(request, input_data, auth_header):
     """
-    Resets the user's password using the token provided in the authorization header.
+    Resets the user's password using the reset token provided in the authorization header.
+    
+    The password change itself spends the token: the update only applies while
+    the password is still the one the token was issued for, and the new hash
+    no longer matches its fingerprint, so no revocation row is written.
     
     Args:
         request (Request): The HTTP request object.
@@ -182,34 +342,26 @@ def reset_password(request, input_data, auth_header):
     Returns:
         response (Response): JSON response with a success message.
     """
-    reset_password_schema = CreateResetPasswordSchema()
-    errors = reset_password_schema.validate(input_data)
-    if errors:
-        raise BadRequest(errors)
-    
-    if auth_header:
-        try:
-            auth_token = auth_header.split(" ")[1]
-        except IndexError:
-            raise BadRequest("Bearer token malformed")
-    else:
-        raise BadRequest("Token is required!")
-    
-    response = User.decode_auth_token(auth_token)
-    user = User.query.filter_by(id=response).first()
-    if not user:
-        raise Unauthorized(response)
+    validate_input(reset_password_validator, input_data)
     
+    user, payload = User.verify_reset_token(get_bearer_token(auth_header))
+    current_password = user.password
+
     try:
-        password = bcrypt.generate_password_hash(input_data.get('password'))
-        user.password = password.decode()
-        # Blacklist auth token after it has been used to reset the user's password
-        blacklist_token = BlacklistToken(token=auth_token)
-        db.session.add(blacklist_token)
+        password = hasher.generate_password_hash(input_data.get('password'))
+        # Conditional on the old hash, so concurrent requests with the same token cannot both succeed
+        if not User.update_password(user.id, password, current_password):
+            db.session.rollback()
+            raise Unauthorized("Reset link is no longer valid. Please request a new one.")
+        # Sign out every session of the user, and reject every token issued so far
+        RefreshToken.revoke_user(user.id)
+        User.bump_generation(user.id)
         db.session.commit()
+        read_replicas.mark_written()
+        principal_loader.invalidate(user.id)
         responseObject = {'message': 'Password has been reset successfully'}
-        response = jsonify(responseObject)
-        response.status_code = 201
-        return response
+        return json_response(responseObject, 201)
+    except (ServiceUnavailable, Unauthorized):
+        raise
     except Exception as e:
         raise InternalServerError("Something went wrong! Our bad :(")
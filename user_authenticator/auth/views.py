@@ -1,7 +1,12 @@
-from flask import Blueprint, request
+from flask import Blueprint, Response, current_app, request
 from flask.views import MethodView
 
-from .users import create_user, login_user, logout_user, forgot_password, reset_password
+from ..keys import keyring
+from ..ratelimit import rate_limit
+from .users import (
+    create_user, login_user, logout_user, logout_all, forgot_password, reset_password, refresh_access_token,
+    introspect_tokens, list_sessions, revoke_session,
+)
 
 # Define a blueprint for authentication-related routes
 auth_blueprint = Blueprint('auth', __name__)
@@ -13,7 +18,7 @@ class RegisterAPI(MethodView):
     Handles POST requests to create a new user.
     """
     def post(self):
-        post_data = request.get_json()  # Get JSON data from the request
+        post_data = request.get_json(silent=True)  # Get JSON data from the request, None if it is missing or malformed
         response = create_user(request, post_data)  # Call the create_user function
         return response
 
@@ -31,8 +36,10 @@ class LoginAPI(MethodView):
     Sets up the Login route for a registered user.
     Handles POST requests to authenticate a user.
     """
+    decorators = [rate_limit('login')]  # Throttle credential stuffing before any DB or hashing work
+
     def post(self):
-        post_data = request.get_json()  # Get JSON data from the request
+        post_data = request.get_json(silent=True)  # Get JSON data from the request, None if it is missing or malformed
         response = login_user(request, post_data)  # Call the login_user function
         return response
 
@@ -63,14 +70,65 @@ auth_blueprint.add_url_rule(
     methods=['POST']
 )
 
+# Class-based view for logging out of every session
+class LogoutAllAPI(MethodView):
+    """
+    Sets up the Logout All route.
+    Handles POST requests to revoke every token and session of a user.
+    """
+    def post(self):
+        auth_header = request.headers.get('Authorization')  # Get the Authorization header
+        response = logout_all(request, auth_header)  # Call the logout_all function
+        return response
+
+# Create a view function for the LogoutAllAPI and add it to the blueprint
+logout_all_view = LogoutAllAPI.as_view('logout_all_api')
+auth_blueprint.add_url_rule(
+    '/logout/all',
+    view_func=logout_all_view,
+    methods=['POST']
+)
+
+# Class-based view for the sessions of a user
+class SessionsAPI(MethodView):
+    """
+    Sets up the Sessions routes.
+    Handles GET requests to list the active sessions of a user and
+    DELETE requests to end one of them.
+    """
+    def get(self):
+        auth_header = request.headers.get('Authorization')  # Get the Authorization header
+        response = list_sessions(request, auth_header)  # Call the list_sessions function
+        return response
+
+    def delete(self, session_id):
+        auth_header = request.headers.get('Authorization')  # Get the Authorization header
+        response = revoke_session(request, auth_header, session_id)  # Call the revoke_session function
+        return response
+
+# Create a view function for the SessionsAPI and add it to the blueprint
+sessions_view = SessionsAPI.as_view('sessions_api')
+auth_blueprint.add_url_rule(
+    '/sessions',
+    view_func=sessions_view,
+    methods=['GET']
+)
+auth_blueprint.add_url_rule(
+    '/sessions/<session_id>',
+    view_func=sessions_view,
+    methods=['DELETE']
+)
+
 # Class-based view for forgot password functionality
 class ForgotPasswordAPI(MethodView):
     """
     Sets up the Forgot Password route.
     Handles POST requests to initiate a password reset.
     """
+    decorators = [rate_limit('forgot_password')]  # Throttle reset emails per address and client
+
     def post(self):
-        post_data = request.get_json()  # Get JSON data from the request
+        post_data = request.get_json(silent=True)  # Get JSON data from the request, None if it is missing or malformed
         response = forgot_password(request, post_data)  # Call the forgot_password function
         return response
 
@@ -90,7 +148,7 @@ class ResetPasswordAPI(MethodView):
     """
     def post(self):
         auth_header = request.headers.get('Authorization')  # Get the Authorization header
-        input_data = request.get_json()  # Get JSON data from the request
+        input_data = request.get_json(silent=True)  # Get JSON data from the request, None if it is missing or malformed
         response = reset_password(request, input_data, auth_header)  # Call the reset_password function
         return response
 
@@ -101,3 +159,66 @@ auth_blueprint.add_url_rule(
     view_func=resetpassword_view,
     methods=['POST']
 )
+
+
+# Class-based view for refreshing access tokens
+class RefreshAPI(MethodView):
+    """
+    Sets up the Refresh route.
+    Handles POST requests to exchange a refresh token for new tokens.
+    """
+    def post(self):
+        post_data = request.get_json(silent=True)  # Get JSON data from the request, None if it is missing or malformed
+        response = refresh_access_token(request, post_data)  # Call the refresh_access_token function
+        return response
+
+# Create a view function for the RefreshAPI and add it to the blueprint
+refresh_view = RefreshAPI.as_view('refresh_api')
+auth_blueprint.add_url_rule(
+    '/refresh',
+    view_func=refresh_view,
+    methods=['POST']
+)
+
+# Class-based view for batch token introspection
+class IntrospectAPI(MethodView):
+    """
+    Sets up the Introspect route.
+    Handles POST requests to check a batch of tokens at once.
+    """
+    decorators = [rate_limit('introspect')]  # Throttle credential guessing and runaway callers per address
+
+    def post(self):
+        post_data = request.get_json(silent=True)  # Get JSON data from the request, None if it is missing or malformed
+        response = introspect_tokens(request, post_data)  # Call the introspect_tokens function
+        return response
+
+# Create a view function for the IntrospectAPI and add it to the blueprint
+introspect_view = IntrospectAPI.as_view('introspect_api')
+auth_blueprint.add_url_rule(
+    '/introspect',
+    view_func=introspect_view,
+    methods=['POST']
+)
+
+# Class-based view for the public signing keys
+class JWKSAPI(MethodView):
+    """
+    Sets up the JSON Web Key Set route.
+    Handles GET requests for the public keys that verify auth tokens.
+    """
+    def get(self):
+        response = Response(keyring.jwks, mimetype='application/jwk-set+json')
+        # Keys change only on rotation, let consumers and proxies cache them
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config.get('JWKS_MAX_AGE_SECONDS', 3600)
+        response.add_etag()
+        return response.make_conditional(request)
+
+# Create a view function for the JWKSAPI and add it to the blueprint
+jwks_view = JWKSAPI.as_view('jwks_api')
+auth_blueprint.add_url_rule(
+    '/.well-known/jwks.json',
+    view_func=jwks_view,
+    methods=['GET']
+)
\ No newline at end of file
@@ -0,0 +1,135 @@
+"""
+This module registers the custom `flask` CLI commands of the application.
+"""
+
+import click
+
+def register_commands(app):
+    """
+    Registers the custom CLI commands with the Flask application.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+    @app.cli.command("purge-revocations")
+    @click.option("--batch-size", type=int, default=None, help="Rows deleted per transaction.")
+    @click.option("--max-batches", type=int, default=None, help="Stop after this many batches.")
+    def purge_revocations(batch_size, max_batches):
+        """Delete revocations and refresh tokens that have already expired."""
+        from .maintenance import purge_expired_revocations
+
+        report = purge_expired_revocations(
+            batch_size=batch_size or app.config.get('REVOCATION_PURGE_BATCH_SIZE', 1000),
+            max_batches=max_batches if max_batches is not None else app.config.get('REVOCATION_PURGE_MAX_BATCHES'),
+            days_ahead=app.config.get('REVOCATION_PARTITION_DAYS_AHEAD', 4),
+        )
+        click.echo(
+            f"Deleted {report['deleted']} expired revocations, {report['refresh_tokens_deleted']} "
+            f"expired refresh tokens and {report['sessions_deleted']} expired sessions in {report['batches']} batches "
+            f"({report['elapsed_ms']} ms)"
+        )
+        if report['dropped_partitions']:
+            click.echo(f"Dropped partitions: {', '.join(report['dropped_partitions'])}")
+        if report['created_partitions']:
+            click.echo(f"Created partitions: {', '.join(report['created_partitions'])}")
+
+    @app.cli.command("calibrate-hash")
+    @click.option("--target-ms", type=int, default=None, help="Verification time to calibrate for (PASSWORD_HASH_TARGET_MS).")
+    def calibrate_hash(target_ms):
+        """Measure the password hash cost for this host and store it for every worker."""
+        from .hashing import calibrated_cost, cost_file
+
+        target_ms = target_ms or app.config.get('PASSWORD_HASH_TARGET_MS')
+        if not target_ms:
+            raise click.UsageError("Pass --target-ms or set PASSWORD_HASH_TARGET_MS")
+        scheme = app.config.get('PASSWORD_HASH_SCHEME', 'bcrypt')
+        path = cost_file(app)
+        cost = calibrated_cost(
+            path, scheme, target_ms, app.config.get('BCRYPT_HANDLE_LONG_PASSWORDS', False), recalibrate=True
+        )
+        click.echo(f"Stored {scheme} cost {cost} for a {target_ms}ms target in {path}")
+
+    @app.cli.command("init-user-shards")
+    def init_user_shards():
+        """Create the users table on every user shard, or bring it up to date with the model."""
+        from .sharding import user_shards
+
+        for shard, change in user_shards.create_tables():
+            click.echo(f"Created {change} on {shard}")
+        click.echo(f"The users table is up to date on {', '.join(user_shards.locations())}")
+
+    @app.cli.command("rebalance-users")
+    @click.option("--batch-size", type=int, default=500, help="Users read per query.")
+    def rebalance_users(batch_size):
+        """Move users to the shards of USER_SHARDS and fill in the user directory."""
+        from .sharding import user_shards
+
+        report = user_shards.rebalance(batch_size=batch_size)
+        click.echo(
+            f"Scanned {report['scanned']} users, moved {report['moved']} "
+            f"({report['retried']} copied again after concurrent changes)"
+        )
+        if report['conflicts']:
+            click.echo(f"{report['conflicts']} users were left in place: their email is registered on the target shard")
+
+    @app.cli.command("reconcile-users")
+    @click.option("--batch-size", type=int, default=500, help="Users and directory entries read per query.")
+    @click.option("--grace-seconds", type=int, default=60, help="Leave users registered this recently alone.")
+    def reconcile_users(batch_size, grace_seconds):
+        """Repair user directory entries left inconsistent by partially committed writes."""
+        from .sharding import user_shards
+
+        report = user_shards.reconcile(batch_size=batch_size, grace_seconds=grace_seconds)
+        click.echo(
+            f"Scanned {report['users']} users and {report['entries']} directory entries: added {report['added']}, "
+            f"repointed {report['repointed']} and removed {report['removed']} entries"
+        )
+
+    @app.cli.command("send-mail")
+    @click.option("--once", is_flag=True, help="Deliver what is due and exit instead of polling.")
+    def send_mail(once):
+        """Deliver queued emails from the outbox."""
+        from .mailer import MailWorker
+
+        worker = MailWorker(app)
+        if once:
+            try:
+                click.echo(f"Delivered {worker.run_once()} emails")
+            finally:
+                worker.disconnect()
+        else:
+            worker.run_forever()
+
+    @app.cli.command("import-users")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default=None,
+                  help="Input format, guessed from the file extension by default.")
+    @click.option("--batch-size", type=int, default=1000, help="Users hashed and inserted per transaction.")
+    def import_users_command(path, fmt, batch_size):
+        """Register users in bulk from a CSV or JSON Lines file."""
+        from .importer import import_users, read_rows
+
+        fmt = fmt or ("csv" if path.endswith(".csv") else "jsonl")
+
+        def report_error(line, row, errors):
+            click.echo(f"Skipping record {line} ({row.get('email')}): {errors}", err=True)
+
+        with open(path, newline="", encoding="utf-8") as stream:
+            report = import_users(read_rows(stream, fmt), batch_size=batch_size, on_error=report_error)
+        click.echo(
+            f"Imported {report['inserted']} users, {report['existing']} already existed, "
+            f"{report['invalid']} invalid ({report['elapsed_ms']} ms)"
+        )
+
+    @app.cli.command("generate-signing-key")
+    @click.argument("path", type=click.Path(dir_okay=False))
+    @click.option("--algorithm", type=click.Choice(["ES256", "EdDSA"]), default="ES256", help="Signature algorithm of the key.")
+    def generate_signing_key(path, algorithm):
+        """Write a new private key for signing auth tokens."""
+        import os
+        from .keys import SigningKey, generate_private_pem
+
+        pem = generate_private_pem(algorithm)
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as f:
+            f.write(pem)
+        click.echo(f"Wrote {algorithm} key {SigningKey.from_private_pem(pem).kid} to {path}")
@@ -1,8 +1,26 @@
-from dotenv import load_dotenv
 import os
 
-# Load environment variables from the .env file
-load_dotenv()
+from sqlalchemy.engine import make_url
+
+# Load environment variables from the .env file in development; deployments set them in the
+# environment, so production processes skip the lookup (LOAD_DOTENV=true forces it)
+_default_load_dotenv = 'true' if os.environ.get('APP_CONFIG', 'development') == 'development' else 'false'
+if os.environ.get('LOAD_DOTENV', _default_load_dotenv).lower() == 'true':
+    from dotenv import load_dotenv
+    load_dotenv()
+
+def _replica_map(value):
+    """Parses 'database:replica' pairs separated by commas into {database: [replicas]}."""
+    replicas = {}
+    for pair in value.split(','):
+        if pair:
+            database, replica = pair.split(':', 1)
+            replicas.setdefault(database, []).append(replica)
+    return replicas
+
+def _client_map(value):
+    """Parses 'client_id:secret' pairs separated by commas into {client_id: secret}."""
+    return dict(pair.split(':', 1) for pair in value.split(',') if pair)
 
 class ApplicationConfig:
     # Secret key for protecting against CSRF attacks and session tampering
@@ -17,12 +35,69 @@ class ApplicationConfig:
     # Database URI, which should be set in the environment variable
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI')
 
+    # Additional databases as 'name=uri' pairs separated by commas, e.g. the user shards
+    SQLALCHEMY_BINDS = dict(pair.split('=', 1) for pair in os.environ.get('SQLALCHEMY_BINDS', '').split(',') if pair)
+
+    # Users are spread over these databases by email ('default' is SQLALCHEMY_DATABASE_URI)
+    USER_SHARDS = [name for name in os.environ.get('USER_SHARDS', 'default').split(',') if name]
+    USER_SHARDS_PREVIOUS = [name for name in os.environ.get('USER_SHARDS_PREVIOUS', '').split(',') if name]  # Until `flask rebalance-users` has run
+    USER_SHARD_REPLICAS = 100  # Points per shard on the hash ring, more spreads users more evenly
+
+    # Lookup-only queries go to read replicas of a database ('default' or a user shard), 'database:bind' pairs separated by commas
+    READ_REPLICAS = _replica_map(os.environ.get('READ_REPLICAS', ''))
+    REPLICA_MAX_LAG_SECONDS = 1.0  # Replicas further behind are skipped
+    REPLICA_LAG_CHECK_SECONDS = 1.0  # How often the lag of each replica is measured
+    REPLICA_LAG_QUERY = os.environ.get('REPLICA_LAG_QUERY')  # SQL returning the lag in seconds, PostgreSQL's replay delay by default
+    REPLICA_RETRY_SECONDS = 10  # A replica that failed is skipped this long
+    REPLICA_STICKY_SECONDS = 5  # Clients read from the primary this long after a write
+
     # Set the complexity of the encryption (12 rounds is a common choice)
     BCRYPT_LOG_ROUNDS = 12
 
+    # Scheme for new password hashes: 'bcrypt', 'scrypt' or 'argon2' (requires argon2-cffi)
+    PASSWORD_HASH_SCHEME = os.environ.get('PASSWORD_HASH_SCHEME', 'bcrypt')
+    SCRYPT_LOG_N = 15  # scrypt cost, N = 2 ** SCRYPT_LOG_N
+    ARGON2_TIME_COST = 3  # argon2 iterations
+    # Pick the cost meeting this verification latency on the current CPU (unset keeps the costs above); measured once
+    # by the first process to start, or by `flask calibrate-hash`, and reused by the others
+    PASSWORD_HASH_TARGET_MS = int(os.environ['PASSWORD_HASH_TARGET_MS']) if os.environ.get('PASSWORD_HASH_TARGET_MS') else None
+    PASSWORD_HASH_COST_FILE = os.environ.get('PASSWORD_HASH_COST_FILE')  # Calibrated cost shared by every process, instance/password_hash_cost.json by default
+
+    # Worker pool that runs bcrypt off the request thread
+    HASH_POOL_WORKERS = os.cpu_count() or 1  # Worker processes (0 hashes inline on the request thread)
+    HASH_POOL_MAX_PENDING = None  # Hash operations admitted at once before failing with 503 (None means 4 per worker)
+    HASH_POOL_TIMEOUT_SECONDS = 10  # Longest a request waits for a hash result
+
+    # Expose Prometheus-format metrics
+    METRICS_ENABLED = True
+    METRICS_PATH = '/metrics'
+    METRICS_CLIENTS = _client_map(os.environ.get('METRICS_CLIENTS', ''))  # Scrapers allowed with HTTP Basic auth, 'client_id:secret' pairs separated by commas (unset leaves it open)
+    METRICS_MULTIPROCESS_DIR = os.environ.get('METRICS_MULTIPROCESS_DIR')  # Share values between worker processes through files here
+    METRICS_FLUSH_SECONDS = 1.0  # How often each process writes its values there
+
+    # Per-request SQL, hashing, JWT and mail timings
+    INSTRUMENTATION_ENABLED = True
+    SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'true').lower() == 'true'  # Return them in a Server-Timing header
+
+    # Throttle login, password reset and introspection attempts, limits map a key to (attempts, window seconds)
+    RATELIMIT_ENABLED = True
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', 'memory://')  # memory://, shared://<path> or redis://host:port/db
+    RATELIMIT_LOGIN = {'ip': (100, 60), 'email': (20, 900), 'ip_email': (10, 300)}
+    RATELIMIT_FORGOT_PASSWORD = {'ip': (20, 3600), 'email': (3, 3600), 'ip_email': (3, 3600)}
+    RATELIMIT_INTROSPECT = {'ip': (600, 60)}  # Gateways call from few addresses, in batches of up to 100 tokens
+
+    # Clients allowed to call /auth/introspect with HTTP Basic auth, 'client_id:secret' pairs separated by commas
+    INTROSPECTION_CLIENTS = _client_map(os.environ.get('INTROSPECTION_CLIENTS', ''))
+
+    # Encode JSON responses with 'orjson' (when installed) or Flask's 'default' provider, the bytes are the same
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'orjson')
+
     # Enable debugging mode for the Flask application
     DEBUG = True
 
+    # `python run.py` creates missing tables on boot; deployments run `flask db upgrade` instead
+    CREATE_SCHEMA_ON_START = True
+
     # Configuration for the email server
     MAIL_SERVER = "smtp.gmail.com"  # Example: Gmail SMTP server
     MAIL_PORT = 587  # TLS port for SMTP
@@ -31,4 +106,115 @@ class ApplicationConfig:
     MAIL_USE_TLS = True  # Use TLS for secure communication with the SMTP server
     MAIL_USE_SSL = False  # Do not use SSL (TLS should be used instead)
 
+    # Outbound mail queue, delivered by `flask send-mail` or the in-process worker
+    MAIL_OUTBOX_WORKER = False  # Start a delivery thread in every process that creates the app
+    MAIL_OUTBOX_BATCH_SIZE = 50  # Emails sent per batch
+    MAIL_OUTBOX_POLL_SECONDS = 2  # Delay between polls when the outbox is empty
+    MAIL_OUTBOX_MAX_ATTEMPTS = 8  # Attempts before a message is marked as failed
+    MAIL_OUTBOX_BACKOFF_SECONDS = 30  # First retry delay, doubled on every failure
+    MAIL_OUTBOX_IDLE_DISCONNECT_SECONDS = 30  # Close the SMTP session after this long without work
+
+    # In-process revocation cache in front of the blacklist table
+    REVOCATION_CACHE_ENABLED = True
+    REVOCATION_CACHE_CAPACITY = 100000  # Smallest filter size; rebuilds size it for twice the rows in the table
+    REVOCATION_CACHE_ERROR_RATE = 0.001  # Bloom filter false positive rate at capacity
+    REVOCATION_CACHE_LRU_SIZE = 10000  # Confirmed revocations kept in memory
+    REVOCATION_CACHE_REFRESH_SECONDS = 5  # How often to pull revocations made by other workers
+    REVOCATION_CACHE_SYNC_OVERLAP_SECONDS = 60  # Each pull re-reads revocations this much older than the newest seen, for late commits
+    REVOCATION_CACHE_REBUILD_SECONDS = 3600  # Reload the whole table this often in the background (0 disables it)
+    REVOCATION_CACHE_WARM_IN_BACKGROUND = False  # Serve requests while the cache loads, checking the table meanwhile
+
+    # Login issues a short-lived access token, verified without any lookup, and a rotating refresh token
+    ACCESS_TOKEN_TTL_SECONDS = 900
+    REFRESH_TOKEN_TTL_DAYS = 30
+    PASSWORD_RESET_TOKEN_TTL_MINUTES = 15  # Reset links also stop working once the password has changed
+
+    # Asymmetric token signing, PEM paths separated by commas; without signing keys tokens are HS256 with SECRET_KEY
+    JWT_SIGNING_KEYS = [path for path in os.environ.get('JWT_SIGNING_KEYS', '').split(',') if path]  # Private keys, the first one signs
+    JWT_VERIFICATION_KEYS = [path for path in os.environ.get('JWT_VERIFICATION_KEYS', '').split(',') if path]  # Public keys of retired signers
+    JWT_ACCEPT_HS256 = os.environ.get('JWT_ACCEPT_HS256', 'true').lower() == 'true'  # Keep accepting HS256 tokens after switching
+    JWKS_MAX_AGE_SECONDS = 3600  # How long consumers may cache the published keys
+
+    # Verified token claims kept in memory so repeat presentations skip signature verification (0 disables)
+    TOKEN_CACHE_SIZE = 10000
+
+    # Authenticated users kept in memory by id so protected endpoints skip the user lookup
+    PRINCIPAL_CACHE_SIZE = 10000
+    PRINCIPAL_CACHE_TTL_SECONDS = 60  # Upper bound on staleness of changes made by other workers
+
+    # Purging of revocations whose token has expired
+    REVOCATION_PURGE_INTERVAL_SECONDS = 0  # Run the in-process purge scheduler every N seconds (0 disables it)
+    REVOCATION_PURGE_BATCH_SIZE = 1000  # Rows deleted per transaction
+    REVOCATION_PURGE_MAX_BATCHES = None  # Upper bound on batches per run (None means until done)
+    REVOCATION_PARTITION_DAYS_AHEAD = 4  # Daily partitions kept ahead of time on PostgreSQL
+
     # Additional configurations can be added as needed
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def _engine_options(uri):
+    """Connection pool settings for the production profiles, for the dialect of `uri`."""
+    options = {'pool_pre_ping': True}  # Detect connections dropped by the server before using them
+    if uri and make_url(uri).get_backend_name() == 'postgresql':
+        from user_authenticator.pool import TimedQueuePool
+        options.update({
+            'poolclass': TimedQueuePool,  # Reports checkout wait time as a metric
+            'pool_size': _env_int('DB_POOL_SIZE', 10),  # Connections kept open per worker process
+            'max_overflow': _env_int('DB_POOL_MAX_OVERFLOW', 10),  # Extra connections allowed under bursts
+            'pool_timeout': _env_int('DB_POOL_TIMEOUT', 5),  # Seconds to wait for a free connection
+            'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),  # Replace connections older than this
+            # Abort statements that run longer than this (milliseconds)
+            'connect_args': {'options': f"-c statement_timeout={_env_int('DB_STATEMENT_TIMEOUT_MS', 5000)}"},
+        })
+    return options
+
+def _bind_options(binds):
+    """Gives every bind the pool settings of its own dialect; SQLALCHEMY_ENGINE_OPTIONS only reaches the default engine."""
+    return {name: {'url': uri, **_engine_options(uri)} for name, uri in binds.items()}
+
+class DevelopmentConfig(ApplicationConfig):
+    """Local development: debug mode and SQL echo, as configured above."""
+
+class ProductionConfig(ApplicationConfig):
+    """Multi-worker deployment behind gunicorn."""
+    DEBUG = False
+    SQLALCHEMY_ECHO = False
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(ApplicationConfig.SQLALCHEMY_DATABASE_URI)
+    SQLALCHEMY_BINDS = _bind_options(ApplicationConfig.SQLALCHEMY_BINDS)
+    # Timings reveal internals to clients, only send them when asked to
+    SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'false').lower() == 'true'
+
+    # Start taking traffic as soon as possible: no schema creation, revocation cache loaded in the background
+    CREATE_SCHEMA_ON_START = False
+    REVOCATION_CACHE_WARM_IN_BACKGROUND = True
+
+    # Every gunicorn worker owns a hashing pool, keep their sum close to the CPU count
+    HASH_POOL_WORKERS = _env_int('HASH_POOL_WORKERS', 2)
+    # gevent workers admit many more concurrent requests than gthread ones, raise this with them
+    HASH_POOL_MAX_PENDING = _env_int('HASH_POOL_MAX_PENDING', 0) or None
+
+    # Share rate limit counters between the gunicorn workers of the host
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', 'shared:///dev/shm/user_authenticator_ratelimit')
+    # The metrics reveal internals; enable them together with METRICS_CLIENTS
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false').lower() == 'true'
+    # Any worker answers a scrape with the metrics of all of them
+    METRICS_MULTIPROCESS_DIR = os.environ.get('METRICS_MULTIPROCESS_DIR', '/dev/shm/user_authenticator_metrics')
+
+class BenchmarkConfig(ProductionConfig):
+    """Production settings with a cheap, fixed hash cost so runs are comparable."""
+    BCRYPT_LOG_ROUNDS = 4
+    PASSWORD_HASH_TARGET_MS = None
+    HASH_POOL_WORKERS = _env_int('HASH_POOL_WORKERS', 0)
+    # Load tests replay many logins from one client
+    RATELIMIT_ENABLED = False
+
+config_by_name = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'benchmark': BenchmarkConfig,
+}
+
+def get_config(name=None):
+    """Returns the config profile called `name`, or the one named by the APP_CONFIG environment variable."""
+    return config_by_name[name or os.environ.get('APP_CONFIG', 'development')]
@@ -0,0 +1,35 @@
+"""
+This module supports serving the app from gevent workers.
+
+With `GUNICORN_WORKER_CLASS=gevent` every request runs on a greenlet: while
+one waits on PostgreSQL or another socket the worker serves the others, so
+concurrency is bounded by memory (a few KB per greenlet) rather than by the
+number of threads. Handlers and business logic are the same in both modes;
+only the waits change:
+
+- psycopg2 waits for the server through a callback that gevent can switch on.
+- Password hashing runs on native threads (bcrypt, scrypt and argon2 release
+  the GIL) instead of a process pool, which does not mix with monkey-patching.
+"""
+
+def gevent_active():
+    """Returns True when the process has been monkey-patched by gevent."""
+    try:
+        from gevent import monkey
+    except ImportError:  # gevent is optional
+        return False
+    return monkey.is_module_patched('socket')
+
+def make_psycopg_cooperative():
+    """Lets psycopg2 yield to other greenlets while it waits for PostgreSQL."""
+    import psycopg2.extensions
+    import psycopg2.extras
+
+    # wait_select polls through `select`, which gevent has made cooperative
+    psycopg2.extensions.set_wait_callback(psycopg2.extras.wait_select)
+
+def hash_executor(workers):
+    """Returns an executor running hash operations on `workers` native threads."""
+    from gevent.threadpool import ThreadPoolExecutor
+
+    return ThreadPoolExecutor(max_workers=workers)
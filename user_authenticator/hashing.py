@@ -0,0 +1,364 @@
+"""
+This module moves password hashing off the request thread.
+
+bcrypt is CPU-bound and holds the GIL, so hashes and verifications are run on
+a bounded process pool. Admission control rejects work with a 503 as soon as
+too many operations are pending instead of letting requests pile up.
+
+Stored hashes are recognised by their prefix, so bcrypt (`$2b$`), scrypt
+(`$scrypt$`) and, when argon2-cffi is installed, argon2 (`$argon2id$`) hashes
+can coexist while users are moved to the configured scheme and cost on login
+(hashes are never moved to a lower cost).
+
+Logins for unknown emails verify the password against a dummy hash created at
+startup with the same scheme and cost, through the same pool, so they take as
+long as a wrong password for a real account and do not reveal which emails are
+registered.
+"""
+
+import base64
+import fcntl
+import hashlib
+import hmac
+import json
+import math
+import multiprocessing
+import os
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, TimeoutError
+
+import bcrypt as _bcrypt
+
+try:
+    import argon2
+except ImportError:  # argon2 is optional
+    argon2 = None
+
+from .auth.error_handling import ServiceUnavailable
+from .cooperative import gevent_active, hash_executor
+from .instrumentation import record
+from .metrics import Counter, Gauge, Histogram
+
+HASH_QUEUE_DEPTH = Gauge(
+    "password_hash_queue_depth", "Password hash operations admitted and not yet finished."
+)
+HASH_DURATION = Histogram(
+    "password_hash_duration_seconds", "Time to hash or verify a password, including queueing.", ["operation"]
+)
+HASH_COST = Gauge(
+    "password_hash_cost", "Cost factor new password hashes are created with.", ["scheme"], multiprocess_mode='max'
+)
+HASH_UPGRADES = Counter(
+    "password_hash_upgrades_total", "Stored hashes rewritten at login to the target scheme and cost.", ["scheme"]
+)
+HASH_REJECTED = Counter(
+    "password_hash_rejected_total", "Password hash operations rejected by admission control.", ["reason"]
+)
+
+BUSY_MESSAGE = "Server is busy. Please try again shortly."
+
+def _prepare(password, handle_long_passwords):
+    if isinstance(password, str):
+        password = password.encode('utf-8')
+    if handle_long_passwords:
+        # Same pre-hash Flask-Bcrypt applies when BCRYPT_HANDLE_LONG_PASSWORDS is set
+        password = hashlib.sha256(password).hexdigest().encode('utf-8')
+    # bcrypt only uses the first 72 bytes; versions before 4.1 drop the rest silently, later ones raise
+    return password[:72]
+
+def _b64encode(data):
+    return base64.b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(data):
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+def _scrypt(password, salt, log_n, r, p):
+    n = 1 << log_n
+    return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p, maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=32)
+
+def hash_password(password, scheme, cost, handle_long_passwords=False):
+    """
+    Returns the hash of `password` for `scheme`. Runs inside the worker processes.
+
+    `cost` is the bcrypt log rounds, the scrypt log2(N) or the argon2 time cost.
+    """
+    if scheme == 'scrypt':
+        salt = os.urandom(16)
+        digest = _scrypt(password.encode('utf-8'), salt, cost, 8, 1)
+        return f"$scrypt$ln={cost},r=8,p=1${_b64encode(salt)}${_b64encode(digest)}"
+    if scheme == 'argon2':
+        return argon2.PasswordHasher(time_cost=cost).hash(password)
+    password = _prepare(password, handle_long_passwords)
+    return _bcrypt.hashpw(password, _bcrypt.gensalt(cost)).decode('utf-8')
+
+def verify_password(pw_hash, password, handle_long_passwords=False):
+    """Checks `password` against a hash of any supported scheme. Runs inside the worker processes."""
+    if pw_hash.startswith('$scrypt$'):
+        _, _, params, salt, digest = pw_hash.split('$')
+        params = dict(item.split('=') for item in params.split(','))
+        candidate = _scrypt(password.encode('utf-8'), _b64decode(salt), int(params['ln']), int(params['r']), int(params['p']))
+        return hmac.compare_digest(candidate, _b64decode(digest))
+    if pw_hash.startswith('$argon2'):
+        if argon2 is None:
+            raise RuntimeError("Found an argon2 password hash but argon2-cffi is not installed")
+        try:
+            return argon2.PasswordHasher().verify(pw_hash, password)
+        except argon2.exceptions.VerificationError:
+            return False
+    pw_hash = pw_hash.encode('utf-8')
+    password = _prepare(password, handle_long_passwords)
+    return hmac.compare_digest(_bcrypt.hashpw(password, pw_hash), pw_hash)
+
+def identify(pw_hash):
+    """Returns the (scheme, cost) a stored hash was created with."""
+    if pw_hash.startswith('$scrypt$'):
+        return 'scrypt', int(re.search(r'ln=(\d+)', pw_hash).group(1))
+    if pw_hash.startswith('$argon2'):
+        return 'argon2', int(re.search(r't=(\d+)', pw_hash).group(1))
+    return 'bcrypt', int(pw_hash.split('$')[2])
+
+# Accepted cost range per scheme; calibration never goes below the floor
+COST_LIMITS = {'bcrypt': (10, 31), 'scrypt': (14, 22), 'argon2': (2, 20)}
+
+def calibrate(scheme, target_ms, handle_long_passwords=False):
+    """
+    Returns the highest cost whose verification takes at most `target_ms` on this CPU.
+
+    bcrypt and scrypt double in cost per step, so a single measurement at the
+    floor is extrapolated and then confirmed; argon2 grows linearly with its
+    time cost.
+    """
+    low, high = COST_LIMITS[scheme]
+    sample = "calibration-password"
+
+    def measure(cost):
+        pw_hash = hash_password(sample, scheme, cost, handle_long_passwords)
+        started = time.perf_counter()
+        verify_password(pw_hash, sample, handle_long_passwords)
+        return (time.perf_counter() - started) * 1000
+
+    elapsed = measure(low)
+    if elapsed >= target_ms:
+        return low
+    if scheme == 'argon2':
+        cost = int(low * target_ms / elapsed)
+    else:
+        cost = low + int(math.log2(target_ms / elapsed))
+    cost = min(cost, high)
+    # Step down if the extrapolation overshot
+    while cost > low and measure(cost) > target_ms:
+        cost -= 1
+    return cost
+
+def calibrated_cost(path, scheme, target_ms, handle_long_passwords=False, recalibrate=False):
+    """
+    Returns the cost stored in `path` for `scheme` and `target_ms`, calibrating and storing it when there is none.
+
+    The file is locked while calibrating, so the workers of a server starting
+    together calibrate once, on an otherwise idle CPU, and all use the same cost.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", 'a') as lock_file:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(path) as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                stored = {}
+            entry = stored.get(scheme)
+            if not recalibrate and entry and entry.get('target_ms') == target_ms:
+                return entry['cost']
+            cost = calibrate(scheme, target_ms, handle_long_passwords)
+            stored[scheme] = {'target_ms': target_ms, 'cost': cost}
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(stored, f)
+            os.replace(tmp_path, path)
+            return cost
+        finally:
+            fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+def cost_file(app):
+    """Returns the file the calibrated cost of `app` is kept in."""
+    return app.config.get('PASSWORD_HASH_COST_FILE') or os.path.join(app.instance_path, 'password_hash_cost.json')
+
+class PasswordHasher:
+    """
+    Runs password hashing on a bounded worker pool.
+
+    Configuration:
+        PASSWORD_HASH_SCHEME: 'bcrypt', 'scrypt' or 'argon2' for new hashes.
+        PASSWORD_HASH_TARGET_MS: Calibrate the cost to this verification time, once per host (see `calibrated_cost`).
+        PASSWORD_HASH_COST_FILE: Where the calibrated cost is kept (the instance folder by default).
+        BCRYPT_LOG_ROUNDS / SCRYPT_LOG_N / ARGON2_TIME_COST: Cost used when not calibrating.
+        HASH_POOL_WORKERS: Worker processes (0 hashes inline on the request thread).
+        HASH_POOL_MAX_PENDING: Operations admitted at once, running or queued.
+        HASH_POOL_TIMEOUT_SECONDS: Longest a request waits for its result.
+        HASH_POOL_START_METHOD: multiprocessing start method of the workers.
+    """
+    def __init__(self, app=None):
+        self.workers = 0
+        self.max_pending = 1
+        self.timeout = None
+        self.scheme = 'bcrypt'
+        self.cost = 12
+        self.handle_long_passwords = False
+        self.dummy_hash = None
+        self._slots = threading.BoundedSemaphore(1)
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.workers = app.config.get('HASH_POOL_WORKERS', os.cpu_count() or 1)
+        self.max_pending = app.config.get('HASH_POOL_MAX_PENDING') or max(self.workers, 1) * 4
+        self.timeout = app.config.get('HASH_POOL_TIMEOUT_SECONDS', 10)
+        self.start_method = app.config.get('HASH_POOL_START_METHOD', 'spawn')
+        self.handle_long_passwords = app.config.get('BCRYPT_HANDLE_LONG_PASSWORDS', False)
+        self.scheme = app.config.get('PASSWORD_HASH_SCHEME', 'bcrypt')
+        if self.scheme == 'argon2' and argon2 is None:
+            raise RuntimeError("PASSWORD_HASH_SCHEME is 'argon2' but argon2-cffi is not installed")
+        self.cost = app.config.get({
+            'bcrypt': 'BCRYPT_LOG_ROUNDS', 'scrypt': 'SCRYPT_LOG_N', 'argon2': 'ARGON2_TIME_COST',
+        }[self.scheme])
+        target_ms = app.config.get('PASSWORD_HASH_TARGET_MS')
+        if target_ms:
+            self.cost = calibrated_cost(cost_file(app), self.scheme, target_ms, self.handle_long_passwords)
+            app.logger.info("Using %s cost %s for a %sms target", self.scheme, self.cost, target_ms)
+            if self.scheme == 'bcrypt':
+                app.config['BCRYPT_LOG_ROUNDS'] = self.cost
+        HASH_COST.set(self.cost, scheme=self.scheme)
+        # Hash of a random password nobody knows, verified for logins of unknown emails
+        self.dummy_hash = hash_password(secrets.token_urlsafe(16), self.scheme, self.cost, self.handle_long_passwords)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        app.extensions['password_hasher'] = self
+
+    def _get_executor(self):
+        # Pools do not survive a fork (e.g. gunicorn --preload), so they are created per process on first use
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._executor_lock:
+                if self._executor is None or self._executor_pid != pid:
+                    if gevent_active():
+                        # Native threads keep hashing off the event loop of a gevent worker
+                        self._executor = hash_executor(self.workers)
+                    else:
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            mp_context=multiprocessing.get_context(self.start_method),
+                        )
+                    self._executor_pid = pid
+        return self._executor
+
+    def _discard_executor(self, executor):
+        # A worker died (e.g. killed by the OOM killer), the next operation starts a new pool
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, future=None):
+        HASH_QUEUE_DEPTH.dec()
+        self._slots.release()
+
+    def _run(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            HASH_REJECTED.inc(reason="queue_full")
+            raise ServiceUnavailable(BUSY_MESSAGE)
+        HASH_QUEUE_DEPTH.inc()
+        started = time.perf_counter()
+        executor = None
+        try:
+            if self.workers <= 0:
+                try:
+                    return fn(*args)
+                finally:
+                    self._release()
+            try:
+                executor = self._get_executor()
+                future = executor.submit(fn, *args)
+            except BaseException:
+                self._release()
+                raise
+            # The slot stays taken until the pool is done with the operation, not just until this request gives up,
+            # so timed out work still counts against HASH_POOL_MAX_PENDING
+            future.add_done_callback(self._release)
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                future.cancel()  # Only possible while it is still queued
+                HASH_REJECTED.inc(reason="timeout")
+                raise ServiceUnavailable(BUSY_MESSAGE)
+        except BrokenExecutor:
+            self._discard_executor(executor)
+            HASH_REJECTED.inc(reason="broken_pool")
+            raise ServiceUnavailable(BUSY_MESSAGE)
+        finally:
+            elapsed = time.perf_counter() - started
+            HASH_DURATION.observe(elapsed, operation=operation)
+            record("hash", elapsed)
+
+    def generate_password_hash(self, password):
+        """Returns the hash of `password` with the configured scheme and cost."""
+        return self._run("hash", hash_password, password, self.scheme, self.cost, self.handle_long_passwords)
+
+    def generate_password_hashes(self, passwords, chunksize=16):
+        """
+        Hashes many passwords in parallel across the whole pool.
+
+        Meant for offline jobs such as bulk imports, so it bypasses admission control.
+        """
+        args = [(password, self.scheme, self.cost, self.handle_long_passwords) for password in passwords]
+        if self.workers <= 0:
+            return [hash_password(*arg) for arg in args]
+        return list(self._get_executor().map(hash_password, *zip(*args), chunksize=chunksize)) if args else []
+
+    def check_password_hash(self, pw_hash, password):
+        """Returns True if `password` matches `pw_hash`, whatever scheme created it."""
+        return self._run("verify", verify_password, pw_hash, password, self.handle_long_passwords)
+
+    def check_dummy_hash(self, password):
+        """
+        Verifies `password` against the dummy hash and returns False.
+
+        Used when no user has the email, so the login does the same work, and is
+        subject to the same admission control, as one with a wrong password.
+        """
+        self._run("verify", verify_password, self.dummy_hash, password, self.handle_long_passwords)
+        return False
+
+    def needs_rehash(self, pw_hash):
+        """Returns True if `pw_hash` was not created with the current scheme, or with a lower cost."""
+        try:
+            scheme, cost = identify(pw_hash)
+        except (IndexError, ValueError, AttributeError):
+            return True
+        # Never lower the cost, processes configured differently would rewrite the same hashes back and forth
+        return scheme != self.scheme or cost < self.cost
+
+    def upgrade(self, pw_hash, password):
+        """
+        Returns a new hash for `password` if `pw_hash` is outdated, otherwise None.
+
+        Called after a successful verification; skipped rather than failing the
+        login when the pool is saturated, the upgrade is retried on a later login.
+        """
+        if not self.needs_rehash(pw_hash):
+            return None
+        try:
+            new_hash = self.generate_password_hash(password)
+        except ServiceUnavailable:
+            return None
+        HASH_UPGRADES.inc(scheme=self.scheme)
+        return new_hash
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,111 @@
+"""
+This module breaks the time of each request down into phases.
+
+SQL statements are timed through SQLAlchemy cursor events; password hashing,
+JWT encoding/decoding and mail dispatch wrap their work in `timed(phase)`.
+The totals of a request are recorded as Prometheus histograms when it ends
+and, when `SERVER_TIMING_HEADER` is set, returned in a `Server-Timing` header.
+Phases may overlap (queueing an email runs SQL), so they need not add up to
+the request time.
+"""
+
+import time
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .metrics import Histogram
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to handle a request.", ["endpoint", "status"]
+)
+REQUEST_PHASE_DURATION = Histogram(
+    "http_request_phase_duration_seconds", "Time a request spent in each phase.", ["endpoint", "phase"]
+)
+REQUEST_PHASE_CALLS = Histogram(
+    "http_request_phase_calls", "Operations of each phase run by a request, e.g. SQL statements.",
+    ["endpoint", "phase"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34),
+)
+
+def _current():
+    # Phase totals of the running request, None outside instrumented requests
+    return g.get('_phases') if has_app_context() else None
+
+def record(phase, seconds):
+    """Adds one operation of `seconds` to `phase` of the current request."""
+    phases = _current()
+    if phases is not None:
+        entry = phases.get(phase)
+        if entry is None:
+            phases[phase] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+class timed:
+    """Context manager that records the time of its block under `phase`."""
+    __slots__ = ('phase', 'started')
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.phase, time.perf_counter() - self.started)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is not None:
+        record('sql', time.perf_counter() - started)
+
+def _server_timing(phases, total):
+    metrics = [
+        f'{phase};dur={seconds * 1000:.2f};desc="{count} calls"'
+        for phase, (count, seconds) in phases.items()
+    ]
+    metrics.append(f'total;dur={total * 1000:.2f}')
+    return ", ".join(metrics)
+
+def register_instrumentation(app):
+    """
+    Records per-request phase timings when `INSTRUMENTATION_ENABLED` is set.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+    if not app.config.get('INSTRUMENTATION_ENABLED', True):
+        return
+    server_timing = app.config.get('SERVER_TIMING_HEADER', False)
+    metrics_endpoint = 'metrics'
+
+    @app.before_request
+    def start_timing():
+        g._phases = {}
+        g._request_started = time.perf_counter()
+
+    @app.after_request
+    def finish_timing(response):
+        phases = g.pop('_phases', None)
+        if phases is None or request.endpoint == metrics_endpoint:
+            return response
+        total = time.perf_counter() - g._request_started
+        # Report zero queries too, so the per-request distribution is complete
+        phases.setdefault('sql', [0, 0.0])
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_DURATION.observe(total, endpoint=endpoint, status=response.status_code)
+        for phase, (count, seconds) in phases.items():
+            REQUEST_PHASE_DURATION.observe(seconds, endpoint=endpoint, phase=phase)
+            REQUEST_PHASE_CALLS.observe(count, endpoint=endpoint, phase=phase)
+        if server_timing:
+            response.headers['Server-Timing'] = _server_timing(phases, total)
+        return response
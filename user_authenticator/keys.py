@@ -0,0 +1,123 @@
+"""
+This module holds the keys tokens are signed and verified with.
+
+With `JWT_SIGNING_KEYS` set, tokens are signed with the first private key
+(ES256 for P-256 keys, EdDSA for Ed25519 keys) and carry its `kid`, so other
+services can verify them locally with the public keys published at
+`/auth/.well-known/jwks.json`. Keys listed after the first, and the public
+keys in `JWT_VERIFICATION_KEYS`, still verify tokens, which lets a key be
+rotated out once the tokens it signed have expired. Without signing keys
+tokens are HS256-signed with `SECRET_KEY`.
+
+Keys are parsed once by `init_app`.
+"""
+
+import base64
+import hashlib
+import json
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+class SigningKey:
+    """A parsed key, with the algorithm and public JWK derived from it."""
+    __slots__ = ('kid', 'algorithm', 'private_key', 'public_key', 'jwk')
+
+    def __init__(self, private_key=None, public_key=None):
+        self.private_key = private_key
+        self.public_key = public_key or private_key.public_key()
+        self.algorithm, self.jwk = self._describe(self.public_key)
+        # RFC 7638 thumbprint, every process derives the same kid for the same key
+        thumbprint_input = {name: self.jwk[name] for name in sorted(self.jwk)}
+        self.kid = _b64(hashlib.sha256(json.dumps(thumbprint_input, separators=(',', ':')).encode()).digest())
+        self.jwk = dict(self.jwk, kid=self.kid, alg=self.algorithm, use='sig')
+
+    @staticmethod
+    def _describe(public_key):
+        if isinstance(public_key, ec.EllipticCurvePublicKey) and public_key.curve.name == 'secp256r1':
+            numbers = public_key.public_numbers()
+            return 'ES256', {
+                'crv': 'P-256', 'kty': 'EC',
+                'x': _b64(numbers.x.to_bytes(32, 'big')), 'y': _b64(numbers.y.to_bytes(32, 'big')),
+            }
+        if isinstance(public_key, ed25519.Ed25519PublicKey):
+            raw = public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+            return 'EdDSA', {'crv': 'Ed25519', 'kty': 'OKP', 'x': _b64(raw)}
+        raise ValueError("Signing keys must be P-256 (ES256) or Ed25519 (EdDSA) keys")
+
+    @classmethod
+    def from_private_pem(cls, pem):
+        return cls(private_key=serialization.load_pem_private_key(pem, password=None))
+
+    @classmethod
+    def from_public_pem(cls, pem):
+        return cls(public_key=serialization.load_pem_public_key(pem))
+
+class Keyring:
+    """Signs tokens with the active key and verifies them with any known key."""
+    def __init__(self):
+        self.secret = None
+        self.active = None
+        self.keys = {}
+        self.accept_hs256 = True
+        self.jwks = b'{"keys":[]}'
+
+    def init_app(self, app):
+        self.secret = app.config.get('SECRET_KEY')
+        self.accept_hs256 = app.config.get('JWT_ACCEPT_HS256', True)
+        signing_paths = app.config.get('JWT_SIGNING_KEYS') or []
+        verification_paths = app.config.get('JWT_VERIFICATION_KEYS') or []
+        keys = [SigningKey.from_private_pem(_read(path)) for path in signing_paths]
+        keys += [SigningKey.from_public_pem(_read(path)) for path in verification_paths]
+        self.keys = {key.kid: key for key in keys}
+        self.active = keys[0] if signing_paths else None
+        # Serialised once, the endpoint only returns these bytes
+        self.jwks = json.dumps({'keys': [key.jwk for key in keys]}, separators=(',', ':')).encode()
+
+    def sign(self, payload):
+        """Returns `payload` signed with the active key, or HS256 with `SECRET_KEY` without one."""
+        if self.active is None:
+            return jwt.encode(payload, self.secret, algorithm='HS256')
+        return jwt.encode(
+            payload, self.active.private_key, algorithm=self.active.algorithm, headers={'kid': self.active.kid}
+        )
+
+    def verify(self, token):
+        """
+        Returns the verified claims of `token`.
+
+        The key and its single algorithm are chosen by the `kid` header, so a
+        token cannot pick its own algorithm. Raises the `jwt` exceptions.
+        """
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is None:
+            if self.active is not None and not self.accept_hs256:
+                raise jwt.InvalidTokenError("Token is not signed with a known key")
+            return jwt.decode(token, self.secret, algorithms=['HS256'])
+        key = self.keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError("Token is not signed with a known key")
+        return jwt.decode(token, key.public_key, algorithms=[key.algorithm])
+
+# Shared keyring, configured by `create_app`
+keyring = Keyring()
+
+def generate_private_pem(algorithm):
+    """Returns a new PKCS#8 PEM private key for `algorithm` (ES256 or EdDSA)."""
+    if algorithm == 'ES256':
+        private_key = ec.generate_private_key(ec.SECP256R1())
+    elif algorithm == 'EdDSA':
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        raise ValueError(f"Unsupported algorithm: {algorithm}")
+    return private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
@@ -0,0 +1,169 @@
+"""
+This module implements the outbound mail queue.
+
+Request handlers only insert a row into the `mail_outbox` table; a worker
+delivers due messages in batches over a persistent SMTP connection and
+retries failures with exponential backoff.
+"""
+
+import datetime
+import random
+import smtplib
+import threading
+import time
+
+from sqlalchemy import select
+from user_authenticator import db
+from .instrumentation import timed
+from .metrics import Counter, Histogram
+from .models import OutboundEmail
+
+MAIL_SENT = Counter("mail_outbox_sent_total", "Emails delivered by the outbox worker.")
+MAIL_FAILED = Counter("mail_outbox_failed_total", "Outbox delivery attempts that failed.", ["final"])
+MAIL_SEND_DURATION = Histogram("mail_outbox_send_duration_seconds", "Time to hand one email to the SMTP server.")
+
+def enqueue_email(subject, recipients, sender=None, html=None, body=None):
+    """
+    Adds an email to the outbox and commits it.
+
+    Returns:
+        outbound_email (OutboundEmail): The queued message.
+    """
+    with timed("mail"):
+        outbound_email = OutboundEmail(subject, recipients, sender=sender, html=html, body=body)
+        db.session.add(outbound_email)
+        db.session.commit()
+    return outbound_email
+
+def _backoff(attempts, base_seconds):
+    # Exponential backoff capped at one hour, with jitter so retries do not align
+    delay = min(base_seconds * (2 ** (attempts - 1)), 3600)
+    return datetime.timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+class MailWorker:
+    """
+    Delivers queued emails in batches over one SMTP connection.
+
+    The connection stays open while there is work and is closed after
+    `MAIL_OUTBOX_IDLE_DISCONNECT_SECONDS` without any message to send.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.batch_size = app.config.get('MAIL_OUTBOX_BATCH_SIZE', 50)
+        self.poll_interval = app.config.get('MAIL_OUTBOX_POLL_SECONDS', 2)
+        self.max_attempts = app.config.get('MAIL_OUTBOX_MAX_ATTEMPTS', 8)
+        self.backoff_seconds = app.config.get('MAIL_OUTBOX_BACKOFF_SECONDS', 30)
+        self.idle_disconnect = app.config.get('MAIL_OUTBOX_IDLE_DISCONNECT_SECONDS', 30)
+        self._mail = None
+        self._connection = None
+        self._last_used = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        if self._mail is None:
+            # Flask-Mail is only imported by processes that deliver mail
+            from flask_mail import Mail
+            self._mail = Mail(self.app)
+        if self._connection is None:
+            # Flask-Mail opens the SMTP session (and STARTTLS/login) when the connection is entered
+            self._connection = self._mail.connect().__enter__()
+        return self._connection
+
+    def disconnect(self):
+        if self._connection is not None:
+            try:
+                self._connection.__exit__(None, None, None)
+            except smtplib.SMTPException:
+                pass
+            self._connection = None
+
+    def _send(self, outbound_email):
+        from flask_mail import Message
+
+        message = Message(
+            outbound_email.subject,
+            sender=outbound_email.sender,
+            recipients=outbound_email.recipients.split(","),
+            html=outbound_email.html,
+            body=outbound_email.body,
+        )
+        started = time.perf_counter()
+        try:
+            self._connect().send(message)
+        except smtplib.SMTPServerDisconnected:
+            # The server closed an idle session; reconnect once and retry
+            self._connection = None
+            self._connect().send(message)
+        MAIL_SEND_DURATION.observe(time.perf_counter() - started)
+        self._last_used = time.monotonic()
+
+    def deliver_batch(self):
+        """
+        Sends one batch of due messages.
+
+        Returns:
+            sent (int): Number of messages delivered.
+        """
+        now = datetime.datetime.utcnow()
+        outbound_emails = db.session.execute(
+            select(OutboundEmail)
+            .where(OutboundEmail.status == "pending", OutboundEmail.next_attempt_at <= now)
+            .order_by(OutboundEmail.next_attempt_at)
+            .limit(self.batch_size)
+            # Lets several workers share the outbox on PostgreSQL
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+
+        sent = 0
+        for outbound_email in outbound_emails:
+            outbound_email.attempts += 1
+            try:
+                self._send(outbound_email)
+            except Exception as e:
+                self.disconnect()
+                outbound_email.last_error = str(e)[:1000]
+                if outbound_email.attempts >= self.max_attempts:
+                    outbound_email.status = "failed"
+                    MAIL_FAILED.inc(final="true")
+                else:
+                    outbound_email.next_attempt_at = now + _backoff(outbound_email.attempts, self.backoff_seconds)
+                    MAIL_FAILED.inc(final="false")
+                continue
+            outbound_email.status = "sent"
+            outbound_email.sent_on = datetime.datetime.utcnow()
+            sent += 1
+            MAIL_SENT.inc()
+        db.session.commit()
+        return sent
+
+    def run_once(self):
+        """Delivers batches until no message is due. Returns the number delivered."""
+        total = 0
+        while True:
+            sent = self.deliver_batch()
+            total += sent
+            if sent < self.batch_size:
+                return total
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.run_once()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception("Mail outbox delivery failed")
+            if self._connection is not None and time.monotonic() - self._last_used > self.idle_disconnect:
+                self.disconnect()
+            self._stop.wait(self.poll_interval)
+        self.disconnect()
+
+    def start(self):
+        """Runs the worker on a daemon thread of this process."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run_forever, name="mail-outbox", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,226 @@
+"""
+This module implements housekeeping jobs for the authentication tables:
+purging revocations and refresh tokens that have expired and, on PostgreSQL,
+managing the daily partitions of `blacklist_tokens` so old data is dropped
+rather than deleted.
+"""
+
+import datetime
+import threading
+import time
+
+from sqlalchemy import delete, select, text
+from user_authenticator import db
+from .metrics import Counter, Histogram
+from .models import BlacklistToken, RefreshToken, UserSession, revocation_cache
+
+PURGE_DELETED = Counter("revocation_purge_deleted_total", "Expired revocations removed by the purge job.")
+PURGE_REFRESH_DELETED = Counter("refresh_token_purge_deleted_total", "Expired refresh tokens removed by the purge job.")
+PURGE_SESSIONS_DELETED = Counter("user_session_purge_deleted_total", "Expired sessions removed by the purge job.")
+PURGE_DURATION = Histogram("revocation_purge_duration_seconds", "Duration of revocation purge runs.")
+
+# Partitions are named after the first day they cover, e.g. blacklist_tokens_p20240515
+PARTITION_PREFIX = "blacklist_tokens_p"
+# Catches tokens expiring on days without a partition
+DEFAULT_PARTITION = "blacklist_tokens_default"
+
+# Report of the most recent purge run in this process
+last_purge = {}
+
+def _is_postgres():
+    return db.engine.dialect.name == "postgresql"
+
+def _partition_name(day):
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+def _partition_names():
+    """Returns the names of every partition of `blacklist_tokens`, the default one included."""
+    rows = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'blacklist_tokens'"
+    ))
+    return [name for (name,) in rows]
+
+def _list_partitions():
+    """Returns the (name, first day) of every daily partition of `blacklist_tokens`."""
+    partitions = []
+    for name in _partition_names():
+        if name.startswith(PARTITION_PREFIX):
+            day = datetime.datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date()
+            partitions.append((name, day))
+    return partitions
+
+def ensure_partitions(days_ahead, today=None):
+    """
+    Creates the daily partitions needed for tokens expiring in the next `days_ahead` days.
+
+    PostgreSQL refuses to create a partition while the default partition holds
+    rows in its range, so the default partition is detached for the duration,
+    its rows for the new days are moved into the new partitions and it is
+    attached again, all in one transaction.
+
+    Returns:
+        created (list): Names of the partitions that were created.
+    """
+    if not _is_postgres():
+        return []
+    today = today or datetime.datetime.utcnow().date()
+    names = _partition_names()
+    existing = set(names)
+    missing = []
+    for offset in range(days_ahead + 1):
+        day = today + datetime.timedelta(days=offset)
+        if _partition_name(day) not in existing:
+            missing.append(day)
+    if not missing:
+        return []
+    has_default = DEFAULT_PARTITION in existing
+    if has_default:
+        db.session.execute(text(f"ALTER TABLE blacklist_tokens DETACH PARTITION {DEFAULT_PARTITION}"))
+    created = []
+    for day in missing:
+        name = _partition_name(day)
+        start, end = day.isoformat(), (day + datetime.timedelta(days=1)).isoformat()
+        db.session.execute(text(
+            f"CREATE TABLE {name} PARTITION OF blacklist_tokens FOR VALUES FROM ('{start}') TO ('{end}')"
+        ))
+        if has_default:
+            # Route the day's rows through the parent into the new partition
+            db.session.execute(text(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+                f"WHERE expires_at >= '{start}' AND expires_at < '{end}' RETURNING *) "
+                f"INSERT INTO blacklist_tokens (jti, expires_at, blacklisted_on) "
+                f"SELECT jti, expires_at, blacklisted_on FROM moved"
+            ))
+        created.append(name)
+    if has_default:
+        db.session.execute(text(f"ALTER TABLE blacklist_tokens ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    db.session.commit()
+    return created
+
+def _drop_expired_partitions(now):
+    """Drops every partition whose whole range lies in the past."""
+    dropped, deleted = [], 0
+    for name, day in _list_partitions():
+        if datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time()) > now:
+            continue
+        deleted += db.session.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+        db.session.execute(text(f"ALTER TABLE blacklist_tokens DETACH PARTITION {name}"))
+        db.session.execute(text(f"DROP TABLE {name}"))
+        db.session.commit()
+        dropped.append(name)
+    return dropped, deleted
+
+def _delete_expired(key, expires_at, now, batch_size, max_batches):
+    """Deletes rows whose `expires_at` is past in batches, committing after each. Returns (deleted, batches)."""
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        keys = db.session.execute(select(key).where(expires_at < now).limit(batch_size)).scalars().all()
+        if not keys:
+            break
+        result = db.session.execute(
+            delete(key.class_)
+            .where(key.in_(keys), expires_at < now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        deleted += result.rowcount
+        batches += 1
+    return deleted, batches
+
+def purge_expired_revocations(batch_size=1000, max_batches=None, days_ahead=4, now=None):
+    """
+    Removes revocations whose token has expired and can therefore never match again.
+
+    On PostgreSQL whole daily partitions are dropped first; any remaining
+    expired rows (e.g. in the default partition, or on other databases) are
+    deleted in batches of `batch_size`, committing after each batch. Expired
+    refresh tokens, rotated or not, and expired sessions are deleted the same way.
+
+    Returns:
+        report (dict): Rows deleted, partitions dropped/created, batches run and elapsed time.
+    """
+    started = time.perf_counter()
+    now = now or datetime.datetime.utcnow()
+    dropped, created, deleted = [], [], 0
+
+    if _is_postgres():
+        dropped, deleted = _drop_expired_partitions(now)
+        created = ensure_partitions(days_ahead, today=now.date())
+
+    batch_deleted, batches = _delete_expired(
+        BlacklistToken.jti, BlacklistToken.expires_at, now, batch_size, max_batches
+    )
+    deleted += batch_deleted
+    refresh_deleted, refresh_batches = _delete_expired(
+        RefreshToken.token_hash, RefreshToken.expires_at, now, batch_size, max_batches
+    )
+    batches += refresh_batches
+    sessions_deleted, session_batches = _delete_expired(
+        UserSession.id, UserSession.expires_at, now, batch_size, max_batches
+    )
+    batches += session_batches
+
+    elapsed = time.perf_counter() - started
+    PURGE_DELETED.inc(deleted)
+    PURGE_REFRESH_DELETED.inc(refresh_deleted)
+    PURGE_SESSIONS_DELETED.inc(sessions_deleted)
+    PURGE_DURATION.observe(elapsed)
+    report = {
+        'deleted': deleted,
+        'refresh_tokens_deleted': refresh_deleted,
+        'sessions_deleted': sessions_deleted,
+        'batches': batches,
+        'dropped_partitions': dropped,
+        'created_partitions': created,
+        'elapsed_ms': round(elapsed * 1000, 2),
+        'finished_at': datetime.datetime.utcnow().isoformat(),
+    }
+    last_purge.clear()
+    last_purge.update(report)
+    return report
+
+class PurgeScheduler:
+    """
+    Runs `purge_expired_revocations` periodically on a daemon thread.
+
+    Enabled by setting `REVOCATION_PURGE_INTERVAL_SECONDS`. Every process that
+    builds the app starts its own scheduler, so under a multi-worker server it
+    is usually enabled on a single process, or replaced by the
+    `flask purge-revocations` command run from cron.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config.get('REVOCATION_PURGE_INTERVAL_SECONDS', 0)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="revocation-purge", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    report = purge_expired_revocations(
+                        batch_size=self.app.config.get('REVOCATION_PURGE_BATCH_SIZE', 1000),
+                        max_batches=self.app.config.get('REVOCATION_PURGE_MAX_BATCHES'),
+                        days_ahead=self.app.config.get('REVOCATION_PARTITION_DAYS_AHEAD', 4),
+                    )
+                    self.app.logger.info(
+                        "Purged %s expired revocations in %sms", report['deleted'], report['elapsed_ms']
+                    )
+                    if report['deleted']:
+                        # Rebuild the filter so it stops carrying purged ids
+                        revocation_cache.warm()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception("Revocation purge failed")
@@ -0,0 +1,347 @@
+"""
+This module implements a small, dependency-free metrics registry and renders
+it in the Prometheus text exposition format.
+For more information, visit: https://prometheus.io/docs/instrumenting/exposition_formats/
+
+Under a multi-process server every worker has its own registry. With
+`METRICS_MULTIPROCESS_DIR` set, each process writes a snapshot of its values
+to a file in that directory every `METRICS_FLUSH_SECONDS`, and a scrape of any
+worker merges the files of all of them: counters and histograms are summed
+(including those of workers that have exited), gauges are combined per their
+`multiprocess_mode` across the live workers, and collector samples are
+reported per worker with a `pid` label.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import uuid
+
+from flask import Response, request
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def clear_multiprocess_dir(directory):
+    """Removes the snapshots of a previous server run, e.g. from gunicorn's `on_starting` hook."""
+    if not directory or not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            os.remove(os.path.join(directory, name))
+
+class Registry:
+    """Holds every metric of the process and the collectors that report external state."""
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+        self.directory = None
+        self.flush_interval = 1.0
+        self._snapshot_path = None
+        self._flusher_pid = None
+        self._stop = threading.Event()
+
+    def configure_multiprocess(self, directory, flush_interval=1.0):
+        """Shares the values of every process through snapshot files in `directory`."""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.flush_interval = flush_interval
+
+    def ensure_flusher(self):
+        """Starts the snapshot thread of this process; threads do not survive a fork, so this runs per process."""
+        pid = os.getpid()
+        if self.directory is None or self._flusher_pid == pid:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            # One file per process lifetime, so a reused pid never overwrites the counts of an exited worker
+            self._snapshot_path = os.path.join(self.directory, f"metrics-{pid}-{uuid.uuid4().hex[:8]}.json")
+            self._flusher_pid = pid
+        threading.Thread(target=self._flush_periodically, name="metrics-flush", daemon=True).start()
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def flush(self):
+        """Writes the values of this process to its snapshot file."""
+        if self._snapshot_path is None:
+            return
+        snapshot = {
+            'pid': os.getpid(),
+            'metrics': {name: metric.snapshot() for name, metric in list(self._metrics.items())},
+            'collectors': [list(sample) for collector in list(self._collectors.values()) for sample in collector()],
+        }
+        tmp_path = f"{self._snapshot_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self._snapshot_path)
+
+    def _load_snapshots(self):
+        """
+        Returns the snapshots of the live processes and the merged counts of the exited ones.
+
+        Snapshots of exited processes are folded into `archive.json` once, under
+        a lock, so the directory does not grow with worker restarts.
+        """
+        archive_path = os.path.join(self.directory, 'archive.json')
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(archive_path) as f:
+                        archive = json.load(f)
+                except (OSError, ValueError):
+                    archive = {'metrics': {}}
+                live, dead = [], []
+                for name in os.listdir(self.directory):
+                    if not (name.startswith('metrics-') and name.endswith('.json')):
+                        continue
+                    path = os.path.join(self.directory, name)
+                    try:
+                        with open(path) as f:
+                            snapshot = json.load(f)
+                    except (OSError, ValueError):
+                        continue
+                    if _pid_alive(snapshot['pid']):
+                        live.append(snapshot)
+                    else:
+                        dead.append((path, snapshot))
+                if dead:
+                    for _, snapshot in dead:
+                        archive['metrics'] = self._merge([archive['metrics'], snapshot['metrics']], gauges=False)
+                    tmp_path = f"{archive_path}.tmp"
+                    with open(tmp_path, 'w') as f:
+                        json.dump(archive, f)
+                    os.replace(tmp_path, archive_path)
+                    for path, _ in dead:
+                        os.remove(path)
+            finally:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+        return live, archive['metrics']
+
+    def _merge(self, snapshots, gauges=True):
+        """Combines per-process metric values into {name: [[labels, value], ...]}."""
+        merged = {}
+        for metrics in snapshots:
+            for name, samples in metrics.items():
+                metric = self._metrics.get(name)
+                if metric is None or (not gauges and metric.type == 'gauge'):
+                    continue
+                values = merged.setdefault(name, {})
+                for labels, value in samples:
+                    key = tuple(labels)
+                    values[key] = value if key not in values else metric.combine(values[key], value)
+        return {name: [[list(key), value] for key, value in values.items()] for name, values in merged.items()}
+
+    def register(self, metric):
+        """Registers a metric, metrics are declared once at module import."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+
+    def add_collector(self, name, collector):
+        """
+        Registers a callable that returns gauge samples at scrape time.
+
+        The callable returns an iterable of (metric name, help text, value).
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def render(self):
+        if self.directory is not None:
+            return self._render_multiprocess()
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for collector in list(self._collectors.values()):
+            for name, documentation, value in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _render_multiprocess(self):
+        # Include the latest values of the process serving the scrape
+        self.ensure_flusher()
+        self.flush()
+        live, archived = self._load_snapshots()
+        merged = self._merge([archived] + [snapshot['metrics'] for snapshot in live])
+        lines = []
+        for name, metric in list(self._metrics.items()):
+            values = {tuple(labels): value for labels, value in merged.get(name, ())}
+            lines.extend(metric.render(values))
+        documented = set()
+        for snapshot in sorted(live, key=lambda snapshot: snapshot['pid']):
+            for name, documentation, value in snapshot['collectors']:
+                if name not in documented:
+                    documented.add(name)
+                    lines.append(f"# HELP {name} {documentation}")
+                    lines.append(f"# TYPE {name} gauge")
+                lines.append(f'{name}{{pid="{snapshot["pid"]}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+# Process-wide registry
+registry = Registry()
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def snapshot(self):
+        """Returns the values as [[labels, value], ...] for the multiprocess snapshot file."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def combine(self, a, b):
+        """Combines the values of one label set from two processes."""
+        return a + b
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted((self._values if values is None else values).items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Counter(_Metric):
+    """Monotonically increasing value."""
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down.
+
+    `multiprocess_mode` combines the values of the live workers: 'sum' (e.g.
+    queue depths), 'max' or 'min'.
+    """
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), multiprocess_mode='sum'):
+        self.multiprocess_mode = multiprocess_mode
+        super().__init__(name, documentation, labelnames)
+
+    def combine(self, a, b):
+        if self.multiprocess_mode == 'max':
+            return max(a, b)
+        if self.multiprocess_mode == 'min':
+            return min(a, b)
+        return a + b
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+
+    def combine(self, a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, (counts, total, count) in sorted((self._values if values is None else values).items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+def register_metrics_endpoint(app):
+    """
+    Exposes the registry at `METRICS_PATH` (default `/metrics`) when `METRICS_ENABLED` is set.
+
+    When `METRICS_CLIENTS` is set, scrapers authenticate with HTTP Basic auth as one of them.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    directory = app.config.get('METRICS_MULTIPROCESS_DIR')
+    if directory:
+        registry.configure_multiprocess(directory, app.config.get('METRICS_FLUSH_SECONDS', 1.0))
+
+        @app.before_request
+        def start_metrics_flusher():
+            # Workers forked from a preloaded app start their own thread on their first request
+            registry.ensure_flusher()
+
+    # Imported here, the auth package imports the metrics declared in this module
+    from user_authenticator.auth.principal import authenticate_client
+    clients = app.config.get('METRICS_CLIENTS') or {}
+
+    def metrics():
+        if clients:
+            authenticate_client(request.authorization, clients)
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule(app.config.get('METRICS_PATH', '/metrics'), 'metrics', metrics, methods=['GET'])
@@ -1,16 +1,65 @@
+import base64
 import datetime
+import hashlib
+import hmac
+import math
+import os
+import threading
+import time
 import jwt
 
 from flask import current_app
-from sqlalchemy import Column, String, DateTime
-from user_authenticator import bcrypt, db
+from sqlalchemy import Column, String, DateTime, Integer, Index, LargeBinary, Text, exc, func, select, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from user_authenticator import db, hasher
 from uuid import uuid4
-from .auth.error_handling import InternalServerError
+from .auth.error_handling import InternalServerError, Unauthorized
+from .cache import BloomFilter, LRUCache
+from .instrumentation import record, timed
+from .keys import keyring
+from .metrics import Counter, registry
+from .replicas import read_replicas
+from .sharding import DEFAULT_SHARD, normalise_email, user_shards
 
 # Helper function to generate UUIDs
 def get_uuid():
     return uuid4().hex
 
+# Helper function to generate a compact, URL-safe token id (16 random bytes)
+def new_jti():
+    return base64.urlsafe_b64encode(os.urandom(16)).rstrip(b'=').decode()
+
+class utcnow(FunctionElement):
+    """Current UTC time on the database server, so rows from every app host share one clock."""
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already UTC
+    return "CURRENT_TIMESTAMP"
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+def token_jti(payload, auth_token):
+    """
+    Returns the 16-byte revocation key of a token.
+
+    Tokens issued before the `jti` claim existed are keyed by a digest of the
+    encoded token, the same value the migration backfilled for them.
+    """
+    jti = payload.get('jti')
+    if jti:
+        return base64.urlsafe_b64decode(jti + '=' * (-len(jti) % 4))
+    return hashlib.blake2b(str(auth_token).encode(), digest_size=16).digest()
+
+def token_expiry(payload):
+    """Returns the `exp` of a token as the naive UTC datetime stored with its revocation."""
+    return datetime.datetime.utcfromtimestamp(payload['exp'])
+
 class User(db.Model):
     """User model for storing user information"""
     __tablename__ = "users"
@@ -19,83 +68,888 @@ class User(db.Model):
     id = Column(String(32), unique=True, primary_key=True, nullable=False)
     firstname = Column(String(20), nullable=False)
     lastname = Column(String(20), nullable=False)
-    email = Column(String(345), unique=True, nullable=False)
-    password = Column(String(72), nullable=False)  # 72 characters for the hashed password
+    email = Column(String(345), nullable=False)
+    password = Column(String(255), nullable=False)  # Hashed password, its prefix identifies the scheme
     registered_on = Column(DateTime, nullable=False)
+    token_generation = Column(Integer, nullable=False, server_default='0')  # Bumped to revoke every token of the user
+
+    # Emails are unique regardless of case, and looked up through this index
+    __table_args__ = (Index('uq_users_email_lower', func.lower(email), unique=True),)
 
-    def __init__(self, firstname, lastname, email, password):
+    def __init__(self, firstname, lastname, email, password=None, password_hash=None):
         # Initialize user data
         self.id = get_uuid()  # Generate a unique UUID for the user
         self.firstname = firstname
         self.lastname = lastname
         self.email = email
-        # Hash the password using bcrypt with specified rounds
-        self.password = bcrypt.generate_password_hash(password, current_app.config.get('BCRYPT_LOG_ROUNDS')).decode()
+        # Hash the password with the configured scheme and cost on the hashing pool, unless already hashed
+        self.password = password_hash or hasher.generate_password_hash(password)
         self.registered_on = datetime.datetime.now()
+        self.token_generation = 0
 
     def __repr__(self):
         return f"User('{self.firstname}', '{self.lastname}', '{self.email}', '{self.registered_on}')"
 
-    def encode_auth_token(self, user_id):
-        """Generate JWT token for user authentication"""
+    def as_row(self):
+        """Returns the column values of the user for Core insert statements"""
+        return {column.name: getattr(self, column.name) for column in User.__table__.columns}
+
+    @staticmethod
+    def find_by_email(email):
+        """Returns the user registered with `email`, compared case-insensitively, from its shard"""
+        stmt = select(User).where(func.lower(User.email) == func.lower(email)).limit(1)
+        for shard in user_shards.shards_for_email(email):
+            user = read_replicas.read(shard, stmt, confirm_missing=True).scalar()
+            if user is not None:
+                return User._detached(user)
+        return None
+
+    @staticmethod
+    def find_by_id(user_id):
+        """Returns the user with id `user_id` from its shard"""
+        shard = user_shards.shard_for_id(user_id)
+        if shard is None:
+            return None
+        return User._detached(
+            read_replicas.read(shard, select(User).where(User.id == user_id), confirm_missing=True).scalar()
+        )
+
+    @staticmethod
+    def bump_generation(user_id):
+        """
+        Revokes every token issued to a user so far, with a single update.
+
+        Tokens carry the generation of their user in the `gen` claim and are
+        only accepted while it is still the current one.
+
+        Returns:
+            updated (bool): False if the user does not exist.
+        """
+        shard = user_shards.shard_for_id(user_id)
+        if shard is None:
+            return False
+        result = user_shards.execute(
+            shard,
+            update(User)
+            .where(User.id == user_id)
+            .values(token_generation=User.token_generation + 1)
+            .execution_options(synchronize_session=False),
+        )
+        return result.rowcount == 1
+
+    @staticmethod
+    def _detached(user):
+        # The session would reload expired attributes from the default database, and flush changes there;
+        # users read from a replica belong to no session already
+        if user is not None and user in db.session:
+            db.session.expunge(user)
+        return user
+
+    @staticmethod
+    def update_password(user_id, password_hash, current_hash):
+        """
+        Replaces the password hash of a user on its shard, if it is still `current_hash`.
+
+        Returns:
+            updated (bool): False if the user does not exist or the password changed meanwhile.
+        """
+        shard = user_shards.shard_for_id(user_id)
+        if shard is None:
+            return False
+        result = user_shards.execute(
+            shard,
+            update(User)
+            .where(User.id == user_id, User.password == current_hash)
+            .values(password=password_hash)
+            .execution_options(synchronize_session=False),
+        )
+        return result.rowcount == 1
+
+    @staticmethod
+    def insert_new(users):
+        """
+        Inserts users with one statement per shard, skipping any whose email is already registered.
+
+        Uses INSERT ... ON CONFLICT DO NOTHING where the database supports it, so
+        registration needs no prior lookup and cannot race with itself.
+
+        Returns:
+            inserted (set): Ids of the users that were inserted.
+        """
+        by_shard = {}
+        for user in users:
+            by_shard.setdefault(user_shards.ring.get(normalise_email(user.email)), []).append(user.as_row())
+        if user_shards.previous is not None:
+            by_shard = {shard: User._not_on_previous_shard(rows) for shard, rows in by_shard.items()}
+        inserted = set()
+        for shard, rows in by_shard.items():
+            shard_inserted = User._insert_rows(shard, rows)
+            if user_shards.sharded and shard_inserted:
+                db.session.execute(
+                    UserDirectory.__table__.insert(), [{'user_id': id, 'shard': shard} for id in shard_inserted]
+                )
+            inserted |= shard_inserted
+        return inserted
+
+    @staticmethod
+    def _not_on_previous_shard(rows):
+        """Drops rows whose email is still registered on its shard of the previous ring, while rebalancing"""
+        by_previous = {}
+        for row in rows:
+            shard = user_shards.previous.get(normalise_email(row['email']))
+            if shard != user_shards.ring.get(normalise_email(row['email'])):
+                by_previous.setdefault(shard, []).append(normalise_email(row['email']))
+        registered = set()
+        for shard, emails in by_previous.items():
+            registered.update(user_shards.execute(
+                shard, select(func.lower(User.email)).where(func.lower(User.email).in_(emails))
+            ).scalars())
+        return [row for row in rows if normalise_email(row['email']) not in registered]
+
+    @staticmethod
+    def _insert_rows(shard, rows):
+        """Inserts user rows into `shard`, see `insert_new`"""
+        if not rows:
+            return set()
+        dialect = user_shards.engine(shard).dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            # No upsert support, insert one by one and treat unique violations as conflicts
+            inserted = set()
+            for row in rows:
+                try:
+                    with db.session.begin_nested():
+                        user_shards.execute(shard, User.__table__.insert(), row)
+                    inserted.add(row['id'])
+                except exc.IntegrityError:
+                    pass
+            return inserted
+        stmt = insert(User).on_conflict_do_nothing().returning(User.id)
+        if len(rows) == 1:
+            return set(user_shards.execute(shard, stmt.values(rows[0])).scalars())
+        return set(user_shards.execute(shard, stmt, rows).scalars())
+
+    @staticmethod
+    def _sign(payload):
         try:
-            payload = {
-                'exp': datetime.datetime.utcnow() + datetime.timedelta(days=3),
-                'iat': datetime.datetime.utcnow(),
-                'sub': user_id
-            }
-            # Encode payload into JWT token using the application's secret key
-            auth_token = jwt.encode(
-                payload,
-                current_app.config.get('SECRET_KEY'),
-                algorithm='HS256'
-            )
-            return auth_token
+            # Sign the payload with the active key of the keyring
+            with timed('jwt'):
+                return keyring.sign(payload)
         except Exception as e:
             # Handle encoding errors
             raise InternalServerError("Something went wrong! Our bad :(")
 
+    def encode_auth_token(self, user_id):
+        """Generate a long-lived JWT token, checked against the blacklist on every use"""
+        payload = {
+            'exp': datetime.datetime.utcnow() + datetime.timedelta(days=3),
+            'iat': datetime.datetime.utcnow(),
+            'sub': user_id,
+            'jti': new_jti(),
+            'gen': self.token_generation,
+        }
+        return User._sign(payload)
+
+    def password_fingerprint(self):
+        """
+        Returns a short keyed digest of the stored password hash.
+
+        Reset tokens carry it, so they stop working once the password changes.
+        """
+        secret = hashlib.sha256(str(current_app.config.get('SECRET_KEY')).encode()).digest()
+        digest = hmac.new(secret, self.password.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:16]).rstrip(b'=').decode()
+
+    def encode_reset_token(self):
+        """
+        Generate a password reset token, valid for `PASSWORD_RESET_TOKEN_TTL_MINUTES`.
+
+        The token is bound to the current password hash instead of being
+        blacklisted after use; it cannot authenticate any other endpoint.
+        """
+        now = datetime.datetime.utcnow()
+        payload = {
+            'exp': now + datetime.timedelta(minutes=current_app.config.get('PASSWORD_RESET_TOKEN_TTL_MINUTES', 15)),
+            'iat': now,
+            'sub': self.id,
+            'jti': new_jti(),
+            'typ': 'reset',
+            'pwd': self.password_fingerprint(),
+        }
+        return User._sign(payload)
+
     @staticmethod
-    def decode_auth_token(auth_token):
-        """Decode JWT token for user authentication"""
+    def encode_access_token(user_id, family_id, generation=0):
+        """
+        Generate a short-lived access token for the refresh token family `family_id`.
+
+        Access tokens are never blacklisted, they are trusted until they expire
+        after `ACCESS_TOKEN_TTL_SECONDS`; revoking the family stops new ones,
+        bumping the token generation of the user rejects them at once.
+        """
+        now = datetime.datetime.utcnow()
+        payload = {
+            'exp': now + datetime.timedelta(seconds=current_app.config.get('ACCESS_TOKEN_TTL_SECONDS', 900)),
+            'iat': now,
+            'sub': user_id,
+            'jti': new_jti(),
+            'typ': 'access',
+            'fam': family_id,
+            'gen': generation,
+        }
+        return User._sign(payload)
+
+    @staticmethod
+    def decode_auth_payload(auth_token):
+        """
+        Returns the verified claims of a JWT token.
+
+        Tokens seen before are served from `claims_cache` without verifying the
+        signature again; raises the `jwt` exceptions for invalid or expired tokens.
+        """
+        payload = claims_cache.get(auth_token)
+        if payload is None:
+            started = time.perf_counter()
+            try:
+                # Verify the token with the key named by its `kid` header
+                payload = keyring.verify(auth_token)
+            finally:
+                record('jwt', time.perf_counter() - started)
+            claims_cache.set(auth_token, payload, time.perf_counter() - started)
+        return payload
+
+    @staticmethod
+    def verify_auth_token(auth_token):
+        """
+        Returns the claims of a valid, non-revoked JWT token.
+
+        Raises Unauthorized with a message for the user otherwise.
+        """
         try:
-            # Decode JWT token using the application's secret key
-            payload = jwt.decode(auth_token, current_app.config.get('SECRET_KEY'), algorithms=['HS256'])
-            # Check if the token is blacklisted
-            is_blacklisted_token = BlacklistToken.check_blacklist(auth_token)
-            if is_blacklisted_token:
-                return "Token blacklisted. Please log in again."
-            return payload['sub']
+            payload = User.decode_auth_payload(auth_token)
         except jwt.ExpiredSignatureError:
             # Handle expired token
-            return "Signature expired. Please log in again."
+            raise Unauthorized("Signature expired. Please log in again.")
         except jwt.InvalidTokenError:
             # Handle invalid token
-            return "Invalid token. Please log in again."
+            raise Unauthorized("Invalid token. Please log in again.")
+        # Reset tokens only ever reach `verify_reset_token`
+        if payload.get('typ') == 'reset':
+            raise Unauthorized("Invalid token. Please log in again.")
+        # Short-lived access tokens are stateless; only long-lived tokens can be blacklisted
+        if payload.get('typ') != 'access' and BlacklistToken.check_blacklist(
+            token_jti(payload, auth_token), token_expiry(payload)
+        ):
+            raise Unauthorized("Token blacklisted. Please log in again.")
+        return payload
+
+    @staticmethod
+    def verify_reset_token(reset_token):
+        """
+        Returns the user and claims of a valid password reset token.
+
+        The token is valid while it has not expired and the password it was
+        issued for is still the current one. Raises Unauthorized otherwise.
+        """
+        try:
+            payload = User.decode_auth_payload(reset_token)
+        except jwt.ExpiredSignatureError:
+            raise Unauthorized("Reset link expired. Please request a new one.")
+        except jwt.InvalidTokenError:
+            raise Unauthorized("Invalid reset link. Please request a new one.")
+        if payload.get('typ') != 'reset':
+            raise Unauthorized("Invalid reset link. Please request a new one.")
+        user = User.find_by_id(payload['sub'])
+        if user is None or not hmac.compare_digest(user.password_fingerprint(), payload.get('pwd', '')):
+            # Used already, or the password was changed since the link was sent
+            raise Unauthorized("Reset link is no longer valid. Please request a new one.")
+        return user, payload
+
+    @staticmethod
+    def verify_auth_tokens(auth_tokens):
+        """
+        Verifies a batch of JWT tokens, resolving their revocation with at most one query.
+
+        Returns:
+            results (list): A (status, payload) pair per token, in order; status is
+                'active', 'revoked', 'expired' or 'invalid' and payload is None
+                unless the signature was verified.
+        """
+        results, pending = [], {}
+        for i, auth_token in enumerate(auth_tokens):
+            try:
+                payload = User.decode_auth_payload(auth_token)
+            except jwt.ExpiredSignatureError:
+                results.append(('expired', None))
+                continue
+            except jwt.InvalidTokenError:
+                results.append(('invalid', None))
+                continue
+            if payload.get('typ') == 'reset':
+                results.append(('invalid', None))
+                continue
+            results.append(('active', payload))
+            # Same rule as `verify_auth_token`: only long-lived tokens can be blacklisted
+            if payload.get('typ') != 'access':
+                pending[i] = (token_jti(payload, auth_token), token_expiry(payload))
+        revoked = BlacklistToken.check_blacklist_many(pending.values())
+        for i, (jti, _) in pending.items():
+            if jti in revoked:
+                results[i] = ('revoked', results[i][1])
+        return results
+
+    @staticmethod
+    def decode_auth_token(auth_token):
+        """Decode JWT token for user authentication"""
+        try:
+            return User.verify_auth_token(auth_token)['sub']
+        except Unauthorized as e:
+            return e.message
+
+class UserDirectory(db.Model):
+    """Directory model mapping user ids to the shard holding the user"""
+    __tablename__ = "user_directory"
+
+    # Columns for directory data
+    user_id = Column(String(32), primary_key=True, nullable=False)
+    shard = Column(String(64), nullable=False)  # Key of SQLALCHEMY_BINDS, or 'default'
+
+    def __init__(self, user_id, shard=DEFAULT_SHARD):
+        self.user_id = user_id
+        self.shard = shard
+
+    def __repr__(self):
+        return f"<UserDirectory {self.user_id} on {self.shard}>"
 
 class BlacklistToken(db.Model):
-    """Token model for storing JWT tokens"""
+    """Token model for storing revoked JWT ids"""
     __tablename__ = "blacklist_tokens"
 
     # Columns for token data
-    id = Column(String(32), primary_key=True, unique=True, nullable=False)
-    token = Column(String(500), unique=True, nullable=False)  # Store JWT token
+    # On PostgreSQL the table is range partitioned on `expires_at`, which therefore has to be part of
+    # the primary key; a jti is only unique per expiry, which is all revocation needs since a token
+    # always carries the same `exp` and jtis are random
+    jti = Column(LargeBinary(16), primary_key=True, nullable=False)  # Revocation key of the token
+    expires_at = Column(DateTime, primary_key=True, nullable=False, index=True)  # `exp` of the token, the row is useless afterwards
     blacklisted_on = Column(DateTime, nullable=False)
 
-    def __init__(self, token):
-        # Initialize token data
-        self.id = get_uuid()  # Generate a unique UUID for the token
-        self.token = token
-        self.blacklisted_on = datetime.datetime.now()
+    def __init__(self, token, payload=None):
+        # The token has already been verified by `User.verify_auth_token`, only read its claims here
+        if payload is None:
+            payload = jwt.decode(token, options={'verify_signature': False})
+        self.jti = token_jti(payload, token)
+        self.expires_at = token_expiry(payload)
+        # Set by the database in the INSERT, the revocation caches of all workers sync on it
+        self.blacklisted_on = utcnow()
 
     @staticmethod
-    def check_blacklist(auth_token):
-        """Check whether a token has been blacklisted"""
-        # Query the database to check if the token exists
-        res = BlacklistToken.query.filter_by(token=str(auth_token)).first()
+    def check_blacklist(jti, expires_at):
+        """Check whether a token id has been blacklisted, `expires_at` being the `exp` of the token"""
+        # Most tokens were never revoked, let the cache answer those without a query
+        cached = revocation_cache.lookup(jti)
+        if cached is not None:
+            return cached
+        # Point lookup on the primary key; the expiry lets PostgreSQL look in a single partition
+        res = read_replicas.read(
+            DEFAULT_SHARD,
+            select(BlacklistToken.jti).where(BlacklistToken.jti == jti, BlacklistToken.expires_at == expires_at),
+        ).first()
+        revocation_cache.resolve(jti, bool(res))
         if res:
             return True  # Token is blacklisted
         return False  # Token is not blacklisted
 
+    @staticmethod
+    def check_blacklist_many(keys):
+        """Returns the set of token ids blacklisted among the given (jti, expires_at) pairs"""
+        revoked, unknown = set(), {}
+        for jti, expires_at in keys:
+            cached = revocation_cache.lookup(jti)
+            if cached is None:
+                unknown[jti] = expires_at
+            elif cached:
+                revoked.add(jti)
+        if unknown:
+            # One primary key IN (...) lookup for everything the cache could not rule out,
+            # restricted to the partitions of the expiries involved
+            rows = read_replicas.read(
+                DEFAULT_SHARD,
+                select(BlacklistToken.jti, BlacklistToken.expires_at).where(
+                    BlacklistToken.jti.in_(unknown), BlacklistToken.expires_at.in_(set(unknown.values()))
+                ),
+            )
+            found = {jti for jti, expires_at in rows if unknown.get(jti) == expires_at}
+            for jti in unknown:
+                revocation_cache.resolve(jti, jti in found)
+            revoked |= found
+        return revoked
+
+    def __repr__(self):
+        return '<jti: {} expires_at: {}>'.format(self.jti.hex(), self.expires_at)
+
+class RefreshToken(db.Model):
+    """Token model for storing hashed refresh tokens"""
+    __tablename__ = "refresh_tokens"
+
+    # Columns for token data
+    token_hash = Column(LargeBinary(32), primary_key=True, nullable=False)  # SHA-256 of the opaque token
+    family_id = Column(String(32), nullable=False, index=True)  # Shared by every rotation of one login
+    user_id = Column(String(32), nullable=False, index=True)
+    issued_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    used_at = Column(DateTime, nullable=True)  # Set when the token is rotated, it must never be presented again
+    revoked_at = Column(DateTime, nullable=True)
+
+    def __init__(self, token, user_id, family_id, expires_at):
+        # Initialize token data, only a digest of the token is stored
+        self.token_hash = RefreshToken.digest(token)
+        self.user_id = user_id
+        self.family_id = family_id
+        self.issued_at = datetime.datetime.utcnow()
+        self.expires_at = expires_at
+
+    @staticmethod
+    def digest(token):
+        # Refresh tokens carry 256 random bits, a fast hash is enough to protect them at rest
+        return hashlib.sha256(token.encode()).digest()
+
+    @staticmethod
+    def issue(user_id, family_id=None, user_agent=None, ip_address=None):
+        """
+        Adds a new refresh token to the session, starting a new family unless one is given.
+
+        A new family is a new login and gets a `UserSession` row; issuing into
+        an existing family extends its session.
+
+        Returns:
+            (token, refresh_token): The opaque token for the client and its row.
+        """
+        token = base64.urlsafe_b64encode(os.urandom(32)).rstrip(b'=').decode()
+        now = datetime.datetime.utcnow()
+        expires_at = now + datetime.timedelta(days=current_app.config.get('REFRESH_TOKEN_TTL_DAYS', 30))
+        if family_id is None:
+            family_id = get_uuid()
+            db.session.add(UserSession(family_id, user_id, expires_at, user_agent=user_agent, ip_address=ip_address))
+        else:
+            db.session.execute(
+                update(UserSession)
+                .where(UserSession.id == family_id)
+                .values(last_used_at=now, expires_at=expires_at)
+                .execution_options(synchronize_session=False)
+            )
+        refresh_token = RefreshToken(token, user_id, family_id, expires_at)
+        db.session.add(refresh_token)
+        return token, refresh_token
+
+    @staticmethod
+    def rotate(token):
+        """
+        Marks `token` as used and issues its successor in the same family.
+
+        Presenting a token that was already rotated means it leaked: the whole
+        family is revoked and the caller gets Unauthorized. Commits the session.
+
+        Returns:
+            (token, refresh_token): The successor token and its row.
+        """
+        now = datetime.datetime.utcnow()
+        refresh_token = db.session.get(RefreshToken, RefreshToken.digest(token))
+        if refresh_token is None or refresh_token.expires_at <= now:
+            raise Unauthorized("Invalid refresh token. Please log in again.")
+        if refresh_token.revoked_at is not None:
+            raise Unauthorized("Refresh token revoked. Please log in again.")
+        # Conditional update, so of two concurrent rotations only one succeeds
+        rotated = db.session.execute(
+            update(RefreshToken)
+            .where(RefreshToken.token_hash == refresh_token.token_hash, RefreshToken.used_at.is_(None))
+            .values(used_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not rotated:
+            RefreshToken.revoke_family(refresh_token.family_id)
+            db.session.commit()
+            raise Unauthorized("Refresh token reuse detected. Please log in again.")
+        successor = RefreshToken.issue(refresh_token.user_id, refresh_token.family_id)
+        db.session.commit()
+        return successor
+
+    @staticmethod
+    def revoke_family(family_id):
+        """Revokes every live token of a login and ends its session, e.g. on logout"""
+        now = datetime.datetime.utcnow()
+        db.session.execute(
+            update(RefreshToken)
+            .where(RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(UserSession)
+            .where(UserSession.id == family_id, UserSession.revoked_at.is_(None))
+            .values(revoked_at=now)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def revoke_user(user_id):
+        """Revokes every live token of a user and ends all their sessions, e.g. after a password reset"""
+        now = datetime.datetime.utcnow()
+        db.session.execute(
+            update(RefreshToken)
+            .where(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(UserSession)
+            .where(UserSession.user_id == user_id, UserSession.revoked_at.is_(None))
+            .values(revoked_at=now)
+            .execution_options(synchronize_session=False)
+        )
+
+    def __repr__(self):
+        return '<RefreshToken family: {} expires_at: {}>'.format(self.family_id, self.expires_at)
+
+class UserSession(db.Model):
+    """Session model for listing and revoking the logins of a user, one per refresh token family"""
+    __tablename__ = "user_sessions"
+
+    # Columns for session data
+    id = Column(String(32), primary_key=True, nullable=False)  # Refresh token family, the `fam` claim of access tokens
+    user_id = Column(String(32), nullable=False, index=True)
+    user_agent = Column(String(255), nullable=True)
+    ip_address = Column(String(45), nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    last_used_at = Column(DateTime, nullable=False)  # Login or most recent refresh
+    expires_at = Column(DateTime, nullable=False, index=True)  # Expiry of the current refresh token
+    revoked_at = Column(DateTime, nullable=True)
+
+    def __init__(self, id, user_id, expires_at, user_agent=None, ip_address=None):
+        # Initialize session data
+        self.id = id
+        self.user_id = user_id
+        self.user_agent = user_agent[:255] if user_agent else None
+        self.ip_address = ip_address
+        self.created_at = datetime.datetime.utcnow()
+        self.last_used_at = self.created_at
+        self.expires_at = expires_at
+
+    @staticmethod
+    def active(user_id):
+        """Returns the sessions of a user that can still be refreshed, most recently used first"""
+        return UserSession.query.filter(
+            UserSession.user_id == user_id,
+            UserSession.revoked_at.is_(None),
+            UserSession.expires_at > datetime.datetime.utcnow(),
+        ).order_by(UserSession.last_used_at.desc()).all()
+
+    def __repr__(self):
+        return f"<UserSession {self.id} of {self.user_id}>"
+
+class OutboundEmail(db.Model):
+    """Outbox model for emails waiting to be delivered by the mail worker"""
+    __tablename__ = "mail_outbox"
+
+    # Columns for outbox data
+    id = Column(String(32), primary_key=True, nullable=False)
+    sender = Column(String(345), nullable=True)
+    recipients = Column(Text, nullable=False)  # Comma-separated addresses
+    subject = Column(String(255), nullable=False)
+    html = Column(Text, nullable=True)
+    body = Column(Text, nullable=True)
+    status = Column(String(10), nullable=False)  # pending, sent or failed
+    attempts = Column(Integer, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_on = Column(DateTime, nullable=False)
+    sent_on = Column(DateTime, nullable=True)
+
+    # The worker polls for due, pending messages
+    __table_args__ = (Index('ix_mail_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),)
+
+    def __init__(self, subject, recipients, sender=None, html=None, body=None):
+        # Initialize outbox data
+        self.id = get_uuid()  # Generate a unique UUID for the message
+        self.subject = subject
+        self.recipients = ",".join(recipients)
+        self.sender = sender
+        self.html = html
+        self.body = body
+        self.status = "pending"
+        self.attempts = 0
+        self.created_on = datetime.datetime.utcnow()
+        self.next_attempt_at = self.created_on
+
     def __repr__(self):
-        return '<id: token: {}'.format(self.token)
+        return f"<OutboundEmail {self.id} to {self.recipients} ({self.status})>"
+
+class RevocationCache:
+    """
+    In-process front for `BlacklistToken.check_blacklist`.
+
+    A Bloom filter answers "definitely not revoked" without touching the
+    database and a bounded LRU remembers confirmed revocations. Each process
+    keeps its own copy, so revocations written by other workers are pulled
+    in every `REVOCATION_CACHE_REFRESH_SECONDS`: the rows stamped (by the
+    database) since the newest one seen, minus `REVOCATION_CACHE_SYNC_OVERLAP_SECONDS`
+    for transactions that committed after a later one. As a backstop for
+    anything committed even later, the filter is rebuilt from the whole
+    table every `REVOCATION_CACHE_REBUILD_SECONDS`. Full rebuilds (also when
+    the filter is overfull or could not be loaded) run on a background
+    thread, never on the request thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._rebuilding = False
+        self._added_while_rebuilding = None
+        self.app = None
+        self.enabled = False
+        self.ready = False
+        self.refresh_interval = 0
+        self.bloom = BloomFilter(1)
+        self.positives = LRUCache(0)
+        self._synced_until = None
+        self._next_refresh = 0.0
+        self._next_rebuild = math.inf
+        self.bloom_negatives = 0
+        self.lru_hits = 0
+        self.misses = 0
+        self.false_positives = 0
+
+    def init_app(self, app):
+        """Configure the cache from the app config and warm it from the table."""
+        self.app = app
+        self.enabled = app.config.get('REVOCATION_CACHE_ENABLED', True)
+        self.capacity = app.config.get('REVOCATION_CACHE_CAPACITY', 100000)
+        self.error_rate = app.config.get('REVOCATION_CACHE_ERROR_RATE', 0.001)
+        self.refresh_interval = app.config.get('REVOCATION_CACHE_REFRESH_SECONDS', 5)
+        self.sync_overlap = datetime.timedelta(seconds=app.config.get('REVOCATION_CACHE_SYNC_OVERLAP_SECONDS', 60))
+        self.rebuild_interval = app.config.get('REVOCATION_CACHE_REBUILD_SECONDS', 3600)
+        self.positives = LRUCache(app.config.get('REVOCATION_CACHE_LRU_SIZE', 10000))
+        self.ready = False
+        registry.add_collector('revocation_cache', self.collect)
+        if not self.enabled:
+            return
+        if app.config.get('REVOCATION_CACHE_WARM_IN_BACKGROUND', False):
+            # Lookups go to the database until the thread has loaded the table
+            self._next_refresh = math.inf
+            self._rebuild_in_background()
+        else:
+            with app.app_context():
+                self.warm()
+
+    def _warm_in_background(self):
+        with self.app.app_context():
+            try:
+                self.warm()
+            except Exception:
+                # Let a later lookup retry
+                self._next_refresh = 0.0
+                self.app.logger.exception("Warming the revocation cache failed")
+            finally:
+                self._rebuilding = False
+                db.session.remove()
+
+    def _rebuild_in_background(self):
+        """Starts `warm` on a daemon thread unless one is already running; lookups keep the current filter meanwhile."""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._warm_in_background, name="revocation-cache-warm", daemon=True).start()
+
+    def warm(self):
+        """Rebuild the filter from every row in `blacklist_tokens`."""
+        with self._rebuild_lock:
+            with self._lock:
+                # Revocations this process makes during the scan are carried over to the new filter
+                self._added_while_rebuilding = []
+            synced_until = None
+            try:
+                total = db.session.execute(select(func.count()).select_from(BlacklistToken)).scalar()
+                # Sized from the table, with headroom for the revocations made until the next rebuild
+                bloom = BloomFilter(max(self.capacity, total * 2), self.error_rate)
+                rows = db.session.execute(
+                    select(BlacklistToken.jti, BlacklistToken.blacklisted_on).execution_options(yield_per=10000)
+                )
+                for jti, blacklisted_on in rows:
+                    bloom.add(jti)
+                    if synced_until is None or blacklisted_on > synced_until:
+                        synced_until = blacklisted_on
+            except exc.SQLAlchemyError:
+                # The table may not exist yet (e.g. before `flask db upgrade`); retry on a later lookup
+                db.session.rollback()
+                with self._lock:
+                    self._added_while_rebuilding = None
+                self._next_refresh = time.monotonic() + self.refresh_interval
+                return False
+            with self._lock:
+                for jti in self._added_while_rebuilding:
+                    bloom.add(jti)
+                self._added_while_rebuilding = None
+                self.bloom = bloom
+                self._synced_until = synced_until
+                self._next_refresh = time.monotonic() + self.refresh_interval
+                self._next_rebuild = time.monotonic() + self.rebuild_interval if self.rebuild_interval else math.inf
+                self.ready = True
+            self.positives.clear()
+            return True
+
+    def _refresh(self):
+        """Pull revocations written by other processes since the last sync."""
+        now = time.monotonic()
+        if now < self._next_refresh:
+            return
+        if not self.ready or self.bloom.count > self.bloom.capacity or now >= self._next_rebuild:
+            # Rebuild when it could not be loaded, when overfull to keep the error rate bounded, and periodically
+            self._rebuild_in_background()
+            if not self.ready:
+                # Lookups go to the database until the rebuild has finished
+                self._next_refresh = now + self.refresh_interval
+                return
+        with self._lock:
+            if now < self._next_refresh:
+                return
+            self._next_refresh = now + self.refresh_interval
+            stmt = select(BlacklistToken.jti, BlacklistToken.blacklisted_on)
+            if self._synced_until is not None:
+                # Rows are stamped when inserted but become visible when committed, so re-read a window
+                # before the newest stamp seen; re-adding is harmless
+                stmt = stmt.where(BlacklistToken.blacklisted_on >= self._synced_until - self.sync_overlap)
+            for jti, blacklisted_on in db.session.execute(stmt):
+                self.bloom.add(jti)
+                if self._synced_until is None or blacklisted_on > self._synced_until:
+                    self._synced_until = blacklisted_on
+
+    def lookup(self, jti):
+        """
+        Returns True or False when the cache can answer on its own, or None
+        when the database has to be consulted.
+        """
+        if not self.enabled:
+            return None
+        self._refresh()
+        if not self.ready:
+            return None
+        if jti not in self.bloom:
+            self.bloom_negatives += 1
+            return False
+        if jti in self.positives:
+            self.lru_hits += 1
+            return True
+        self.misses += 1
+        return None
+
+    def resolve(self, jti, revoked):
+        """Record the database answer for a token the filter could not rule out."""
+        if not self.ready:
+            return
+        if revoked:
+            self.positives.set(jti, True)
+        else:
+            self.false_positives += 1
+
+    def add(self, jti):
+        """Record a revocation committed by this process."""
+        if self.ready:
+            with self._lock:
+                self.bloom.add(jti)
+                if self._added_while_rebuilding is not None:
+                    self._added_while_rebuilding.append(jti)
+            self.positives.set(jti, True)
+
+    def stats(self):
+        """Hit/miss counters used to size the filter and the LRU."""
+        return {
+            'bloom_negatives': self.bloom_negatives,
+            'lru_hits': self.lru_hits,
+            'misses': self.misses,
+            'false_positives': self.false_positives,
+            'bloom_items': self.bloom.count,
+            'bloom_bits': self.bloom.size,
+            'lru_size': len(self.positives),
+        }
+
+    def collect(self):
+        """Reports `stats()` to the metrics registry."""
+        for name, value in self.stats().items():
+            yield f"revocation_cache_{name}", f"Revocation cache {name.replace('_', ' ')}.", value
+
+# Shared revocation cache, configured by `create_app`
+revocation_cache = RevocationCache()
+
+TOKEN_CACHE_HITS = Counter("token_cache_hits_total", "Token verifications served from the claims cache.")
+TOKEN_CACHE_MISSES = Counter("token_cache_misses_total", "Token verifications that ran jwt.decode.")
+TOKEN_CACHE_SAVED = Counter(
+    "token_cache_saved_seconds_total", "Estimated jwt.decode time avoided by claims cache hits."
+)
+
+class ClaimsCache:
+    """
+    Bounded cache of verified token claims, keyed by a digest of the encoded token.
+
+    A hit means the exact same bytes were verified earlier by this process, so
+    signature verification and JSON parsing can be skipped. Entries are never
+    served past the token's `exp`; revocation is still checked by the caller.
+    """
+    def __init__(self):
+        self.entries = LRUCache(0)
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._decode_seconds = 0.0
+
+    def init_app(self, app):
+        self.entries = LRUCache(app.config.get('TOKEN_CACHE_SIZE', 10000))
+
+    @staticmethod
+    def _key(auth_token):
+        if isinstance(auth_token, str):
+            auth_token = auth_token.encode()
+        return hashlib.blake2b(auth_token, digest_size=32).digest()
+
+    def get(self, auth_token):
+        """Returns the cached claims, or None when the token has to be verified."""
+        if self.entries.maxsize <= 0:
+            return None
+        key = self._key(auth_token)
+        payload = self.entries.get(key)
+        if payload is not None and payload['exp'] > time.time():
+            self.hits += 1
+            # Credit the average cost of a full decode
+            self.saved_seconds += self._decode_seconds
+            TOKEN_CACHE_HITS.inc()
+            TOKEN_CACHE_SAVED.inc(self._decode_seconds)
+            return payload
+        if payload is not None:
+            self.entries.pop(key)
+        self.misses += 1
+        TOKEN_CACHE_MISSES.inc()
+        return None
+
+    def set(self, auth_token, payload, decode_seconds):
+        """Remembers the claims of a freshly verified token."""
+        # Exponential moving average of the jwt.decode time
+        self._decode_seconds = decode_seconds if not self._decode_seconds else 0.9 * self._decode_seconds + 0.1 * decode_seconds
+        if self.entries.maxsize > 0 and 'exp' in payload:
+            self.entries.set(self._key(auth_token), payload)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'saved_seconds': round(self.saved_seconds, 6),
+            'size': len(self.entries),
+        }
+
+# Shared claims cache, configured by `create_app`
+claims_cache = ClaimsCache()
@@ -0,0 +1,31 @@
+"""
+This module implements a connection pool that reports how long requests wait
+to check out a database connection.
+"""
+
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from .metrics import Counter, Histogram
+
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a connection from the pool.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total", "Connection checkouts that gave up after pool_timeout."
+)
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records checkout wait time; select it with `poolclass`."""
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
@@ -0,0 +1,226 @@
+"""
+This module throttles the authentication endpoints.
+
+Limits use a sliding window counter: the count of the current fixed window
+plus the count of the previous one, weighted by how much of it still overlaps
+the sliding window. Counters are kept in a pluggable store selected by
+`RATELIMIT_STORAGE_URI`:
+
+    memory://                   one process (default)
+    shared:///dev/shm/ratelimit  every gunicorn worker of one host, through a memory-mapped file
+    redis://host:6379/0         every host, needs the `redis` package
+
+Limited views are wrapped with `rate_limit(scope)`, so rejected requests never
+reach the database or the password hasher.
+"""
+
+import fcntl
+import functools
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from flask import current_app, request
+
+from .auth.error_handling import TooManyRequests
+from .metrics import Counter
+
+RATELIMIT_REJECTED = Counter(
+    "ratelimit_rejected_total", "Requests rejected by a rate limit.", ["scope", "key"]
+)
+RATELIMIT_ERRORS = Counter(
+    "ratelimit_store_errors_total", "Rate limit checks skipped because the store failed."
+)
+
+TOO_MANY_MESSAGE = "Too many attempts. Please try again later."
+
+class MemoryStore:
+    """Counters in a dict of this process."""
+    def __init__(self, sweep_every=10000):
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._sweep_every = sweep_every
+        self._writes = 0
+
+    def _sweep(self, now):
+        for key in [key for key, (expires, _) in self._counts.items() if expires <= now]:
+            del self._counts[key]
+
+    def hit(self, current_key, previous_key, ttl):
+        """Increments `current_key` and returns (previous count, current count)."""
+        now = time.time()
+        with self._lock:
+            self._writes += 1
+            if self._writes % self._sweep_every == 0:
+                self._sweep(now)
+            expires, previous = self._counts.get(previous_key, (0, 0))
+            if expires <= now:
+                previous = 0
+            expires, current = self._counts.get(current_key, (0, 0))
+            if expires <= now:
+                current = 0
+            self._counts[current_key] = (now + ttl, current + 1)
+        return previous, current + 1
+
+class SharedMemoryStore:
+    """
+    Counters in a fixed-size hash table in a memory-mapped file.
+
+    Processes on one host that open the same file share the counters. Each
+    slot holds a 64-bit key hash, an expiry time and a count; when the probed
+    slots are all live the one expiring first is recycled, so the table never
+    grows and old counters are forgotten first under pressure.
+    """
+    SLOT = struct.Struct('<Qdq')
+    PROBES = 8
+
+    def __init__(self, path, slots=65536):
+        self.slots = slots
+        size = slots * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # POSIX record locks exclude other processes, the thread lock other threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def _find(self, key_hash, now, create):
+        start = key_hash % self.slots
+        victim, victim_expires = None, math.inf
+        for i in range(self.PROBES):
+            offset = ((start + i) % self.slots) * self.SLOT.size
+            slot_hash, expires, count = self.SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, (count if expires > now else 0)
+            if expires < victim_expires:
+                victim, victim_expires = offset, expires
+        return (victim, 0) if create else (None, 0)
+
+    def hit(self, current_key, previous_key, ttl):
+        """Increments `current_key` and returns (previous count, current count)."""
+        now = time.time()
+        current_hash = self._hash(current_key)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                _, previous = self._find(self._hash(previous_key), now, create=False)
+                offset, current = self._find(current_hash, now, create=True)
+                self.SLOT.pack_into(self._map, offset, current_hash, now + ttl, current + 1)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return previous, current + 1
+
+class RedisStore:
+    """Counters in Redis, or any client with the same `pipeline` interface."""
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        import redis  # Optional dependency, only needed for this store
+        return cls(redis.Redis.from_url(url))
+
+    def hit(self, current_key, previous_key, ttl):
+        """Increments `current_key` and returns (previous count, current count)."""
+        pipe = self.client.pipeline()
+        pipe.get(previous_key)
+        pipe.incr(current_key)
+        pipe.expire(current_key, int(math.ceil(ttl)))
+        previous, current, _ = pipe.execute()
+        return int(previous or 0), int(current)
+
+def store_from_uri(uri):
+    """Builds the store named by `RATELIMIT_STORAGE_URI`."""
+    if uri.startswith('memory://'):
+        return MemoryStore()
+    if uri.startswith('shared://'):
+        return SharedMemoryStore(uri[len('shared://'):] or '/dev/shm/user_authenticator_ratelimit')
+    if uri.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore.from_url(uri)
+    raise ValueError(f"Unsupported RATELIMIT_STORAGE_URI: {uri}")
+
+class RateLimiter:
+    """Checks requests against the limits configured for each scope."""
+    def __init__(self):
+        self.enabled = False
+        self.store = None
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATELIMIT_ENABLED', True)
+        if self.enabled:
+            self.store = store_from_uri(app.config.get('RATELIMIT_STORAGE_URI', 'memory://'))
+
+    @staticmethod
+    def _digest(value):
+        # Keeps emails and addresses out of shared stores
+        return hashlib.blake2b(value.encode(), digest_size=12).hexdigest()
+
+    def hit(self, scope, limits, identities, now=None):
+        """
+        Counts one attempt against every limit of `scope`.
+
+        Args:
+            limits (dict): Maps an identity kind to (max attempts, window seconds).
+            identities (dict): Maps an identity kind to its value for this request.
+
+        Returns:
+            retry_after (int): Seconds until the attempt would be allowed, 0 if it is.
+        """
+        now = time.time() if now is None else now
+        retry_after = 0
+        for kind, (limit, window) in limits.items():
+            value = identities.get(kind)
+            if not value:
+                continue
+            index, elapsed = divmod(now, window)
+            key = f"rl:{scope}:{kind}:{self._digest(value)}"
+            previous, current = self.store.hit(f"{key}:{int(index)}", f"{key}:{int(index) - 1}", window * 2)
+            # Sliding window estimate of the attempts in the last `window` seconds
+            if previous * (window - elapsed) / window + current > limit:
+                RATELIMIT_REJECTED.inc(scope=scope, key=kind)
+                retry_after = max(retry_after, int(math.ceil(window - elapsed)))
+        return retry_after
+
+# Shared rate limiter, configured by `create_app`
+rate_limiter = RateLimiter()
+
+def _identities():
+    post_data = request.get_json(silent=True)
+    email = post_data.get('email') if isinstance(post_data, dict) else None
+    email = email.strip().lower() if isinstance(email, str) else None
+    ip = request.remote_addr
+    return {'ip': ip, 'email': email, 'ip_email': f"{ip}|{email}" if email else None}
+
+def rate_limit(scope):
+    """
+    Decorates a view so attempts over `RATELIMIT_<SCOPE>` are rejected with 429.
+
+    Limits are keyed by client address, by email and by the pair; store
+    failures let the request through rather than taking login down.
+    """
+    config_key = f"RATELIMIT_{scope.upper()}"
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            limits = current_app.config.get(config_key)
+            if rate_limiter.enabled and limits:
+                try:
+                    retry_after = rate_limiter.hit(scope, limits, _identities())
+                except Exception:
+                    RATELIMIT_ERRORS.inc()
+                    current_app.logger.exception("Rate limit store failed")
+                    retry_after = 0
+                if retry_after:
+                    raise TooManyRequests(TOO_MANY_MESSAGE, retry_after=retry_after)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
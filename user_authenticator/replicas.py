@@ -0,0 +1,187 @@
+"""
+This module sends lookup-only queries to read replicas.
+
+`READ_REPLICAS` maps a database (`default` or a user shard, see
+`user_authenticator.sharding`) to the binds replicating it. Lookups that only
+read, such as finding a user by email or id or checking a revoked token, run
+on a replica in a short transaction of their own, so the primary serves the
+writes and the reads that must see them:
+
+- Read-your-writes: once a request has written (signup, logout, password
+  reset), its later lookups go to the primary, and so do the client's for
+  `REPLICA_STICKY_SECONDS`, through a cookie set on the response.
+- Lag: the lag of a replica is measured at most every
+  `REPLICA_LAG_CHECK_SECONDS`; replicas further behind than
+  `REPLICA_MAX_LAG_SECONDS` are skipped.
+- Errors: a replica that fails is skipped for `REPLICA_RETRY_SECONDS` and the
+  lookup runs on the primary instead.
+
+Lookups outside a request (CLI commands, the background jobs) always use the
+primary. Routing decisions are counted in `db_reads_total` and the measured
+lag is exported as `db_replica_lag_seconds`.
+"""
+
+import itertools
+import math
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import exc, text
+from sqlalchemy.orm import Session
+
+from user_authenticator import db
+from .metrics import Counter, Gauge
+from .sharding import user_shards
+
+DB_READS = Counter(
+    "db_reads_total", "Lookups of databases with read replicas, by where they ran and why.",
+    ["database", "target", "reason"],
+)
+DB_REPLICA_LAG = Gauge(
+    "db_replica_lag_seconds", "Replication lag last measured on each read replica.", ["replica"], multiprocess_mode='max'
+)
+
+# Replay delay of a PostgreSQL standby, 0 while it has replayed everything it received
+POSTGRES_LAG_QUERY = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+class Replica:
+    """A read replica with its last measured lag and health."""
+    def __init__(self, name):
+        self.name = name
+        self.lag = 0.0
+        self.checked_at = -math.inf
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        return db.engines[self.name]
+
+    def current_lag(self, now, interval, query):
+        """Returns the lag in seconds, measured again when older than `interval`. Raises on connection errors."""
+        if now - self.checked_at < interval or not self._lock.acquire(blocking=False):
+            # Fresh enough, or another thread is measuring it right now
+            return self.lag
+        try:
+            if query is None and self.engine.dialect.name == 'postgresql':
+                query = POSTGRES_LAG_QUERY
+            if query is None:
+                # Nothing to measure, e.g. SQLite files standing in for replicas
+                self.lag = 0.0
+            else:
+                with self.engine.connect() as connection:
+                    self.lag = float(connection.execute(text(query)).scalar() or 0.0)
+            self.checked_at = now
+            DB_REPLICA_LAG.set(self.lag, replica=self.name)
+            return self.lag
+        finally:
+            self._lock.release()
+
+class ReplicaRouter:
+    """Chooses the database that serves each lookup."""
+    def __init__(self):
+        self.replicas = {}
+        self.enabled = False
+        self._turn = itertools.count()
+
+    def init_app(self, app):
+        binds = app.config.get('SQLALCHEMY_BINDS') or {}
+        self.replicas = {}
+        for database, names in (app.config.get('READ_REPLICAS') or {}).items():
+            for name in names:
+                if name not in binds:
+                    raise RuntimeError(f"Read replica '{name}' is not a key of SQLALCHEMY_BINDS")
+            self.replicas[database] = [Replica(name) for name in names]
+        self.max_lag = app.config.get('REPLICA_MAX_LAG_SECONDS', 1.0)
+        self.lag_check_interval = app.config.get('REPLICA_LAG_CHECK_SECONDS', 1.0)
+        self.lag_query = app.config.get('REPLICA_LAG_QUERY')
+        self.retry_after = app.config.get('REPLICA_RETRY_SECONDS', 10)
+        self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 5)
+        self.cookie_name = app.config.get('REPLICA_STICKY_COOKIE', 'read_primary_until')
+        self.enabled = any(self.replicas.values())
+        if self.enabled:
+            app.after_request(self._set_sticky_cookie)
+
+    def mark_written(self):
+        """Sends the rest of this request, and the client's lookups for `REPLICA_STICKY_SECONDS`, to the primary."""
+        if has_request_context():
+            g.db_wrote = True
+
+    def _sticky(self):
+        if g.get('db_wrote'):
+            return True
+        try:
+            return float(request.cookies.get(self.cookie_name, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def _set_sticky_cookie(self, response):
+        if g.get('db_wrote') and response.status_code < 400:
+            response.set_cookie(
+                self.cookie_name, f"{time.time() + self.sticky_seconds:.3f}",
+                max_age=math.ceil(self.sticky_seconds), httponly=True, samesite='Strict',
+            )
+        return response
+
+    def _choose(self, database):
+        """Returns (replica, reason); replica is None when the lookup has to run on the primary."""
+        replicas = self.replicas.get(database)
+        if not replicas:
+            return None, 'no_replica'
+        if not has_request_context():
+            return None, 'no_request'
+        if self._sticky():
+            return None, 'sticky'
+        now = time.monotonic()
+        start = next(self._turn)
+        reason = 'lag'
+        for i in range(len(replicas)):
+            replica = replicas[(start + i) % len(replicas)]
+            if replica.down_until > now:
+                reason = 'error'
+                continue
+            try:
+                lag = replica.current_lag(now, self.lag_check_interval, self.lag_query)
+            except exc.DBAPIError:
+                replica.down_until = now + self.retry_after
+                reason = 'error'
+                continue
+            if lag > self.max_lag:
+                continue
+            return replica, 'replica'
+        return None, reason
+
+    def read(self, database, statement, params=None, confirm_missing=False):
+        """
+        Runs the lookup `statement` on a replica of `database`, or on the primary.
+
+        With `confirm_missing`, a lookup that finds nothing on a replica is
+        repeated on the primary, so a row written moments ago (e.g. a new user)
+        is never reported missing.
+
+        Returns:
+            result (Result): The buffered rows.
+        """
+        replica, reason = self._choose(database)
+        if replica is not None:
+            try:
+                with Session(replica.engine) as session:
+                    frozen = session.execute(statement, params).freeze()
+            except exc.DBAPIError:
+                replica.down_until = time.monotonic() + self.retry_after
+                reason = 'error'
+            else:
+                if frozen.data or not confirm_missing:
+                    DB_READS.inc(database=database, target=replica.name, reason=reason)
+                    return frozen()
+                reason = 'missing'
+        if self.enabled:
+            DB_READS.inc(database=database, target='primary', reason=reason)
+        return user_shards.execute(database, statement, params)
+
+# Shared router, configured by `create_app`
+read_replicas = ReplicaRouter()
@@ -0,0 +1,153 @@
+"""
+This module serialises JSON responses.
+
+With `JSON_PROVIDER = 'orjson'` and orjson installed, the app's JSON provider
+encodes with orjson and falls back to the json module for anything orjson
+would write differently (floats, enums, non-ASCII text while `ensure_ascii` is
+set, non-string keys), so responses stay byte-for-byte what `jsonify` returns:
+sorted keys, compact separators, two-space indentation in debug mode and a
+trailing newline.
+
+Handlers build responses with `json_response`, which hands the encoded bytes
+straight to the response class, and error bodies without extra payload are
+encoded once per status code and message and reused.
+"""
+
+import enum
+import threading
+
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, responses are the same without it
+    orjson = None
+
+# The two ways Flask's `DefaultJSONProvider.response` calls `dumps`
+_COMPACT = {'separators': (',', ':')}
+_INDENTED = {'indent': 2}
+
+class OrjsonProvider(DefaultJSONProvider):
+    """`DefaultJSONProvider` with the compact and indented dumps Flask responses use done by orjson."""
+    def _orjson(self, obj, indent):
+        """Returns `obj` encoded by orjson, or None when the json module has to encode it."""
+        if not _orjson_compatible(obj):
+            return None
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            # Dates, dataclasses, decimals and markup go through Flask's `default`, as with the json module
+            data = orjson.dumps(obj, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            # Non-string keys, integers over 64 bits, lone surrogates
+            return None
+        if self.ensure_ascii and not data.isascii():
+            return None
+        return data
+
+    def dumps(self, obj, **kwargs):
+        data = None
+        if kwargs == _COMPACT or kwargs == _INDENTED:
+            data = self._orjson(obj, 'indent' in kwargs)
+        if data is None:
+            return super().dumps(obj, **kwargs)
+        return data.decode('utf-8')
+
+    def response_body(self, obj, indent):
+        """Returns the body `response` sends for `obj`, as bytes."""
+        data = self._orjson(obj, indent)
+        if data is None:
+            return f"{super().dumps(obj, **(_INDENTED if indent else _COMPACT))}\n".encode('utf-8')
+        return data + b"\n"
+
+# Values both libraries write the same way, checked by exact type as an isinstance walk costs more than the encoding
+_SAME_OUTPUT = frozenset((str, int, bool, type(None)))
+
+def _orjson_compatible(obj):
+    """Returns False if `obj` holds values orjson writes differently from the json module."""
+    pending = [obj]
+    while pending:
+        container = pending.pop()
+        kind = type(container)
+        if kind is dict:
+            values = container.values()
+        elif kind is list or kind is tuple:
+            values = container
+        else:
+            values = (container,)
+        for value in values:
+            kind = type(value)
+            if kind in _SAME_OUTPUT:
+                continue
+            if kind is dict or kind is list or kind is tuple:
+                pending.append(value)
+            elif isinstance(value, (float, enum.Enum, dict, list, tuple)):
+                # orjson writes 1e+16 as 1e16 and NaN as null, serialises any enum by its value
+                # and handles subclasses of containers natively
+                return False
+    return True
+
+def register_json_provider(app):
+    """
+    Installs the JSON provider named by `JSON_PROVIDER` on the Flask application.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+    if app.config.get('JSON_PROVIDER', 'orjson') == 'orjson' and orjson is not None:
+        app.json = OrjsonProvider(app)
+
+def response_body(obj, app=None):
+    """Returns the bytes `jsonify(obj)` would send with the JSON provider of `app` (the current app)."""
+    app = app or current_app._get_current_object()
+    provider = app.json
+    # Same choice as `DefaultJSONProvider.response`
+    indent = (provider.compact is None and app.debug) or provider.compact is False
+    if type(provider) is OrjsonProvider:
+        return provider.response_body(obj, indent)
+    return f"{provider.dumps(obj, **(_INDENTED if indent else _COMPACT))}\n".encode('utf-8')
+
+def json_response(obj, status_code=200, headers=None):
+    """
+    Builds a JSON response, the same as `jsonify` followed by setting the status code.
+
+    Args:
+        obj (dict): The JSON document.
+        status_code (int): The HTTP status code.
+        headers (dict): Extra response headers.
+
+    Returns:
+        response (Response): The JSON response.
+    """
+    # Resolve the app proxy once, each access costs a context lookup
+    app = current_app._get_current_object()
+    return app.response_class(response_body(obj, app), status=status_code, headers=headers, mimetype=app.json.mimetype)
+
+class ErrorBodies:
+    """Encoded error bodies keyed by status code and message, bounded so dynamic messages cannot grow it."""
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def get(self, status_code, message):
+        """Returns the body of `{'message': message, 'status_code': status_code}`."""
+        app = current_app._get_current_object()
+        if not isinstance(message, str):
+            # Validation errors carry a dict of field messages
+            return response_body({'message': message, 'status_code': status_code}, app)
+        key = (app.json, app.debug, status_code, message)
+        body = self._bodies.get(key)
+        if body is None:
+            body = response_body({'message': message, 'status_code': status_code}, app)
+            with self._lock:
+                if len(self._bodies) < self.maxsize:
+                    self._bodies[key] = body
+        return body
+
+# Shared cache of encoded error bodies
+error_bodies = ErrorBodies()
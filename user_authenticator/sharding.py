@@ -0,0 +1,394 @@
+"""
+This module spreads the `users` table over several databases.
+
+`USER_SHARDS` names the databases holding users: keys of `SQLALCHEMY_BINDS`,
+or `default` for `SQLALCHEMY_DATABASE_URI`. A user lives on the shard that a
+consistent hash ring assigns to the lower-cased email, so signup and login go
+straight to one database, and adding a shard only moves the users whose ring
+position now belongs to it (about 1/N of them). Tokens carry the user id, not
+the email; the `user_directory` table in the default database maps ids to
+shards.
+
+To change the shard list, move the old list to `USER_SHARDS_PREVIOUS` and run
+`flask rebalance-users` while the service keeps running. Until it finishes,
+lookups by email try the new shard first and then the old one, and signups
+check both so an email cannot be registered twice.
+
+With the single `default` shard (the default) every query goes to the default
+database and no directory rows are written.
+
+A signup writes the user to its shard and the directory entry to the default
+database in the same session, but each database commits separately, so a
+crash between the two commits leaves a user without a directory entry or an
+entry whose user is missing. Lookups by id still find such users by scanning
+the shards; `flask reconcile-users` repairs the directory.
+
+`User.find_by_email` and `User.find_by_id` return `User` objects detached
+from the session; users are written through the Core statements of `User`
+(`insert_new`, `update_password`), which route themselves.
+"""
+
+import bisect
+import hashlib
+
+import datetime
+
+from sqlalchemy import and_, delete, exc, select, update
+
+from user_authenticator import db
+
+DEFAULT_SHARD = 'default'
+
+def normalise_email(email):
+    """Returns the shard key of an email, the same value `lower(email)` compares."""
+    return email.lower()
+
+def _point(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+class HashRing:
+    """Consistent hash ring mapping keys to shard names, with `replicas` points per shard."""
+    def __init__(self, shards, replicas=100):
+        self.shards = list(shards)
+        points = sorted((_point(f"{shard}#{i}"), shard) for shard in self.shards for i in range(replicas))
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def get(self, key):
+        """Returns the shard owning `key`: the first point clockwise of its hash."""
+        if len(self.shards) == 1:
+            return self.shards[0]
+        i = bisect.bisect(self._points, _point(key)) % len(self._points)
+        return self._shards[i]
+
+class UserShards:
+    """Routes user queries to the shard of an email or user id."""
+    def __init__(self):
+        self.ring = HashRing([DEFAULT_SHARD])
+        self.previous = None
+        self.sharded = False
+
+    def init_app(self, app):
+        replicas = app.config.get('USER_SHARD_REPLICAS', 100)
+        shards = list(app.config.get('USER_SHARDS') or [DEFAULT_SHARD])
+        previous = list(app.config.get('USER_SHARDS_PREVIOUS') or [])
+        binds = app.config.get('SQLALCHEMY_BINDS') or {}
+        for shard in shards + previous:
+            if shard != DEFAULT_SHARD and shard not in binds:
+                raise RuntimeError(f"User shard '{shard}' is not a key of SQLALCHEMY_BINDS")
+        self.ring = HashRing(shards, replicas)
+        self.previous = HashRing(previous, replicas) if previous else None
+        self.sharded = shards != [DEFAULT_SHARD] or self.previous is not None
+
+    def locations(self):
+        """Returns every shard that may hold users: the current ones, then the previous ones."""
+        shards = list(self.ring.shards)
+        if self.previous is not None:
+            shards += [shard for shard in self.previous.shards if shard not in shards]
+        return shards
+
+    def engine(self, shard):
+        return db.engines[None if shard == DEFAULT_SHARD else shard]
+
+    def execute(self, shard, statement, params=None):
+        """Executes `statement` on `shard` as part of the current session transaction."""
+        return db.session.execute(statement, params, bind_arguments={'bind': self.engine(shard)})
+
+    def shards_for_email(self, email):
+        """Returns the shards that may hold `email`, most likely first."""
+        key = normalise_email(email)
+        shards = [self.ring.get(key)]
+        if self.previous is not None and self.previous.get(key) not in shards:
+            shards.append(self.previous.get(key))
+        return shards
+
+    def shard_for_id(self, user_id):
+        """Returns the shard holding the user `user_id`, or None if there is no such user."""
+        if not self.sharded:
+            return DEFAULT_SHARD
+        from .models import User, UserDirectory
+        from .replicas import read_replicas
+
+        shard = read_replicas.read(
+            DEFAULT_SHARD, select(UserDirectory.shard).where(UserDirectory.user_id == user_id), confirm_missing=True
+        ).scalar()
+        if shard is not None:
+            return shard
+        # Users registered before sharding are only in the directory once rebalanced
+        for shard in self.locations():
+            if self.execute(shard, select(User.id).where(User.id == user_id)).first() is not None:
+                return shard
+        return None
+
+    def shards_for_ids(self, user_ids):
+        """
+        Groups `user_ids` by the shard holding them, with one directory query for the whole batch.
+
+        Returns:
+            shards (dict): Shard name to the ids it holds; ids of users that do not exist are left out.
+        """
+        user_ids = list(user_ids)
+        if not self.sharded:
+            return {DEFAULT_SHARD: user_ids}
+        from .models import User, UserDirectory
+        from .replicas import read_replicas
+
+        shards = {}
+        rows = read_replicas.read(
+            DEFAULT_SHARD, select(UserDirectory.user_id, UserDirectory.shard).where(UserDirectory.user_id.in_(user_ids)),
+            confirm_missing=True,
+        )
+        for user_id, shard in rows:
+            shards.setdefault(shard, []).append(user_id)
+        # Users registered before sharding are only in the directory once rebalanced
+        missing = set(user_ids).difference(*shards.values())
+        for shard in self.locations():
+            if not missing:
+                break
+            found = self.execute(shard, select(User.id).where(User.id.in_(missing))).scalars().all()
+            shards.setdefault(shard, []).extend(found)
+            missing.difference_update(found)
+        return {shard: ids for shard, ids in shards.items() if ids}
+
+    def create_tables(self):
+        """
+        Creates the `users` table on every shard that does not have it yet, and upgrades the others.
+
+        Alembic migrates the default database only. Shards created earlier get
+        the columns and indexes the model gained since (e.g. `token_generation`,
+        `uq_users_email_lower`); new columns need a server default or must be
+        nullable, as the table already holds rows.
+
+        Returns:
+            changes (list): (shard, change) for every table and column created.
+        """
+        from alembic.migration import MigrationContext
+        from alembic.operations import Operations
+        from sqlalchemy import Column, inspect
+        from sqlalchemy.schema import CreateIndex
+        from .models import User
+
+        users = User.__table__
+        changes = []
+        for shard in self.locations():
+            with self.engine(shard).begin() as connection:
+                inspector = inspect(connection)
+                if not inspector.has_table(users.name):
+                    users.create(connection)
+                    changes.append((shard, f"table {users.name}"))
+                    continue
+                if shard == DEFAULT_SHARD:
+                    # Left to `flask db upgrade`
+                    continue
+                existing = {column['name'] for column in inspector.get_columns(users.name)}
+                operations = Operations(MigrationContext.configure(connection))
+                for column in users.columns:
+                    if column.name not in existing:
+                        operations.add_column(users.name, Column(
+                            column.name, column.type, nullable=column.nullable, server_default=column.server_default,
+                        ))
+                        changes.append((shard, f"column {column.name}"))
+                for index in users.indexes:
+                    # Expression indexes are not reflected on every database, let it skip existing ones
+                    connection.execute(CreateIndex(index, if_not_exists=True))
+        return changes
+
+    def rebalance(self, batch_size=500):
+        """
+        Moves every user to the shard the current ring assigns and records all users in the directory.
+
+        Users are moved one at a time and stay readable throughout: the row is
+        copied, the directory is pointed at the copy, and the original is only
+        deleted if it did not change in between (otherwise it is copied again).
+        A copy on the target is only overwritten while it still holds what was
+        copied; once writes reached it through the directory it is kept and
+        the original deleted.
+
+        Returns:
+            report (dict): Users scanned, moved, copied again and left in place because of an email conflict.
+        """
+        from .models import User, UserDirectory
+
+        users = User.__table__
+        report = {'scanned': 0, 'moved': 0, 'retried': 0, 'conflicts': 0}
+        for source in self.locations():
+            last_id = ''
+            while True:
+                rows = self.execute(
+                    source, select(users).where(users.c.id > last_id).order_by(users.c.id).limit(batch_size)
+                ).mappings().all()
+                if not rows:
+                    db.session.commit()
+                    break
+                last_id = rows[-1]['id']
+                report['scanned'] += len(rows)
+                directory = {
+                    entry.user_id: entry
+                    for entry in UserDirectory.query.filter(UserDirectory.user_id.in_([row['id'] for row in rows]))
+                }
+                moves = []
+                for row in rows:
+                    target = self.ring.get(normalise_email(row['email']))
+                    if target != source:
+                        moves.append((dict(row), target))
+                    elif row['id'] not in directory:
+                        db.session.add(UserDirectory(row['id'], source))
+                    else:
+                        directory[row['id']].shard = source
+                db.session.commit()
+                for row, target in moves:
+                    try:
+                        report['retried'] += self._move(row, source, target)
+                        report['moved'] += 1
+                    except exc.IntegrityError:
+                        # The email is registered on the target under another id, leave the user where it is
+                        db.session.rollback()
+                        report['conflicts'] += 1
+        return report
+
+    def _move(self, row, source, target, attempts=5):
+        """Moves one user from `source` to `target`. Returns how many times it had to be copied again."""
+        from .models import User, UserDirectory
+
+        users = User.__table__
+        copied = None  # The target row as this move last wrote it
+        for attempt in range(attempts):
+            current = self.execute(target, select(users).where(users.c.id == row['id'])).mappings().first()
+            if current is None:
+                self.execute(target, users.insert().values(**row))
+            elif dict(current) == copied or (copied is None and not self._points_to(row['id'], target)):
+                # Our own copy, or one an interrupted run left before any write was routed to it;
+                # replace it only if nothing changed it since it was read
+                replaced = self.execute(
+                    target, update(users).where(self._unchanged(current)).values(**row)
+                ).rowcount
+                if not replaced:
+                    self._keep_target(row['id'], source, target)
+                    return attempt
+            else:
+                # Writes have reached the target through the directory, it holds the newest values
+                self._keep_target(row['id'], source, target)
+                return attempt
+            db.session.merge(UserDirectory(row['id'], target))
+            db.session.commit()
+            copied = row
+            deleted = self.execute(source, delete(users).where(self._unchanged(row))).rowcount
+            db.session.commit()
+            if deleted:
+                return attempt
+            # Written through the old directory entry while being copied, copy the new values
+            row = self.execute(source, select(users).where(users.c.id == row['id'])).mappings().first()
+            db.session.commit()
+            if row is None:
+                return attempt
+            row = dict(row)
+        raise RuntimeError(f"User {row['id']} kept changing while being moved, run the rebalance again")
+
+    def _keep_target(self, user_id, source, target):
+        """Points the directory at the copy of a user on `target` and drops the one on `source`."""
+        from .models import User, UserDirectory
+
+        users = User.__table__
+        db.session.merge(UserDirectory(user_id, target))
+        db.session.commit()
+        self.execute(source, delete(users).where(users.c.id == user_id))
+        db.session.commit()
+
+    def _points_to(self, user_id, shard):
+        from .models import UserDirectory
+
+        return db.session.execute(
+            select(UserDirectory.shard).where(UserDirectory.user_id == user_id)
+        ).scalar() == shard
+
+    @staticmethod
+    def _unchanged(row):
+        from .models import User
+
+        return and_(*(User.__table__.c[name] == value for name, value in row.items()))
+
+    def reconcile(self, batch_size=500, grace_seconds=60):
+        """
+        Repairs the directory after commits that reached only some of the databases.
+
+        Adds the entries of users that have none (skipping users registered in
+        the last `grace_seconds`, whose signup may still be committing), points
+        entries whose shard lacks the user at a shard that has it, and deletes
+        entries of users found on no shard. Run it again if users were being
+        written meanwhile.
+
+        Returns:
+            report (dict): Users and entries scanned, entries added, repointed and removed.
+        """
+        from .models import User, UserDirectory
+
+        report = {'users': 0, 'entries': 0, 'added': 0, 'repointed': 0, 'removed': 0}
+        if not self.sharded:
+            return report
+        users = User.__table__
+        directory = UserDirectory.__table__
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=grace_seconds)
+        locations = self.locations()
+
+        # Users without a directory entry
+        for shard in locations:
+            last_id = ''
+            while True:
+                rows = self.execute(
+                    shard,
+                    select(users.c.id, users.c.registered_on)
+                    .where(users.c.id > last_id).order_by(users.c.id).limit(batch_size),
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                report['users'] += len(rows)
+                listed = set(db.session.execute(
+                    select(directory.c.user_id).where(directory.c.user_id.in_([row.id for row in rows]))
+                ).scalars())
+                for row in rows:
+                    if row.id not in listed and row.registered_on < cutoff:
+                        db.session.merge(UserDirectory(row.id, shard))
+                        report['added'] += 1
+                db.session.commit()
+
+        # Entries whose user is not on their shard
+        last_id = ''
+        while True:
+            entries = db.session.execute(
+                select(directory).where(directory.c.user_id > last_id).order_by(directory.c.user_id).limit(batch_size)
+            ).all()
+            if not entries:
+                break
+            last_id = entries[-1].user_id
+            report['entries'] += len(entries)
+            missing = set()
+            by_shard = {}
+            for entry in entries:
+                by_shard.setdefault(entry.shard, []).append(entry.user_id)
+            for shard, ids in by_shard.items():
+                found = set()
+                if shard in locations:
+                    found = set(self.execute(shard, select(users.c.id).where(users.c.id.in_(ids))).scalars())
+                missing.update(set(ids) - found)
+            found_on = {}
+            for shard in locations:
+                if len(found_on) == len(missing):
+                    break
+                for user_id in self.execute(
+                    shard, select(users.c.id).where(users.c.id.in_(missing - set(found_on)))
+                ).scalars():
+                    found_on[user_id] = shard
+            for user_id in missing:
+                shard = found_on.get(user_id)
+                if shard is None:
+                    db.session.execute(delete(directory).where(directory.c.user_id == user_id))
+                    report['removed'] += 1
+                else:
+                    db.session.merge(UserDirectory(user_id, shard))
+                    report['repointed'] += 1
+            db.session.commit()
+        return report
+
+# Shared router, configured by `create_app`
+user_shards = UserShards()
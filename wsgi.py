@@ -0,0 +1,6 @@
+from user_authenticator import create_app
+from user_authenticator.config import get_config
+import os
+
+# The WSGI entry point used by gunicorn (see gunicorn.conf.py), defaults to the production profile
+app = create_app(get_config(os.environ.get('APP_CONFIG', 'production')))